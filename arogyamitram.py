@@ -1,11 +1,27 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import datetime
 import urllib.parse
+import math
+import os
+import json
+import hashlib
+import html
 import plotly.express as px
-from PIL import Image
-import io
-import base64
+from dataclasses import asdict, astuple
+from inventory_store import (InventoryStore, ExpirySweeper, DEFAULT_DB_PATH, MEDICINE_COLUMNS, CATEGORIES, LOCATIONS,
+                             URGENCY_LEVELS, RESERVATION_TTL_MINUTES, OUTBOX_STATUSES, SchemaError, ReservationError)
+from schema import STATUSES, coerce_medicines, format_date
+from image_store import ImageStore, DEFAULT_IMAGE_DIR
+from inventory_service import FindQuery, GRID_COLUMNS, create_service
+from service_api import ServiceClient, SERVICE_URL
+from notifications import NotificationWorker, StaticDirectory
+from locations import REGISTRY
+from page_data import save_upload, donation_record, recent_months_frame, analytics_frames
+from bulk_import import import_donations, REQUIRED_COLUMNS, OPTIONAL_COLUMNS
+from perf import PERF, WINDOW_SLOTS, span, timed, start_exporters
+from figure_cache import FigureCache
 
 # ====================
 # 1. PAGE CONFIGURATION
@@ -20,385 +36,200 @@ st.set_page_config(
 # ====================
 # 2. CUSTOM THEME & STYLING
 # ====================
+THEME_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "theme.css")
+
+@st.cache_resource
+def load_theme():
+    # Read once per process; the content hash versions the injected stylesheet
+    with open(THEME_PATH, encoding="utf-8") as f:
+        css = f.read()
+    return css, hashlib.sha256(css.encode()).hexdigest()[:12]
+
 def apply_custom_theme():
-    st.markdown("""
-    <style>
-        :root {
-            --primary: #4361ee;       /* Modern blue */
-            --primary-dark: #1e40af;
-            --primary-light: #3b82f6;
-            --secondary: #7c3aed;     /* Purple */
-            --accent: #10b981;        /* Emerald */
-            --danger: #ef4444;        /* Red */
-            --warning: #f59e0b;       /* Amber */
-            --dark: #1e293b;          /* Dark slate */
-            --darker: #0f172a;
-            --light: #f8fafc;         /* Lightest slate */
-            --card-bg: rgba(255, 255, 255, 0.08);
-            --sidebar-bg: rgba(30, 41, 59, 0.9);
-        }
-        
-        /* Main container */
-        .stApp {
-            background: linear-gradient(135deg, var(--darker) 0%, var(--dark) 100%);
-            color: var(--light);
-        }
-        
-        /* Glassmorphism cards */
-        .glass-card {
-            background: var(--card-bg);
-            backdrop-filter: blur(16px);
-            -webkit-backdrop-filter: blur(16px);
-            border-radius: 12px;
-            border: 1px solid rgba(255, 255, 255, 0.1);
-            padding: 1.5rem;
-            margin-bottom: 1.5rem;
-            box-shadow: 0 8px 32px 0 rgba(0, 0, 0, 0.36);
-            transition: all 0.3s ease;
-        }
-        
-        .glass-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 12px 40px 0 rgba(0, 0, 0, 0.5);
-            border-color: rgba(255, 255, 255, 0.2);
-        }
-        
-        /* Stats cards */
-        .stat-card {
-            background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%);
-            border-radius: 12px;
-            padding: 1.5rem;
-            margin: 0.5rem;
-            box-shadow: 0 4px 30px rgba(0, 0, 0, 0.2);
-            text-align: center;
-            transition: all 0.3s ease;
-            color: white;
-            border: 1px solid rgba(255, 255, 255, 0.2);
-        }
-        
-        .stat-card:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 8px 40px rgba(0, 0, 0, 0.3);
-        }
-        
-        /* Header with gradient */
-        .dashboard-header {
-            background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%);
-            padding: 2rem;
-            border-radius: 12px;
-            margin-bottom: 2rem;
-            box-shadow: 0 4px 30px rgba(0, 0, 0, 0.2);
-            position: relative;
-            overflow: hidden;
-            border: 1px solid rgba(255, 255, 255, 0.2);
-        }
-        
-        /* Modern buttons */
-        .stButton>button {
-            background: linear-gradient(to right, var(--primary), var(--primary-dark));
-            color: white;
-            border: none;
-            border-radius: 8px;
-            padding: 0.5rem 1.5rem;
-            transition: all 0.3s;
-            font-weight: 500;
-            box-shadow: 0 2px 8px rgba(0, 0, 0, 0.2);
-        }
-        
-        .stButton>button:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 4px 12px rgba(0, 0, 0, 0.3);
-            background: linear-gradient(to right, var(--primary-light), var(--primary));
-        }
-        
-        /* Sidebar styling */
-        .css-1vq4p4l {
-            background: var(--sidebar-bg) !important;
-            backdrop-filter: blur(16px);
-            -webkit-backdrop-filter: blur(16px);
-            border-right: 1px solid rgba(255, 255, 255, 0.1);
-        }
-        
-        /* Form elements */
-        .stTextInput>div>div>input, 
-        .stTextArea>div>div>textarea,
-        .stNumberInput>div>div>input,
-        .stSelectbox>div>div>select,
-        .stDateInput>div>div>input {
-            background: rgba(255, 255, 255, 0.1) !important;
-            border: 1px solid rgba(255, 255, 255, 0.2) !important;
-            color: white !important;
-            border-radius: 8px !important;
-            padding: 10px 12px !important;
-        }
-        
-        .stTextInput>label, 
-        .stTextArea>label,
-        .stNumberInput>label,
-        .stSelectbox>label,
-        .stDateInput>label {
-            font-weight: 500 !important;
-            color: var(--light) !important;
-        }
-        
-        /* Custom scrollbar */
-        ::-webkit-scrollbar {
-            width: 8px;
-        }
-        ::-webkit-scrollbar-track {
-            background: rgba(255,255,255,0.1);
-        }
-        ::-webkit-scrollbar-thumb {
-            background: var(--primary);
-            border-radius: 4px;
-        }
-        
-        /* Status badges */
-        .status-badge {
-            padding: 0.35rem 0.7rem;
-            border-radius: 1rem;
-            font-size: 0.8rem;
-            font-weight: bold;
-            color: white;
-            display: inline-block;
-            min-width: 80px;
-            text-align: center;
-        }
-        .pending { background: var(--warning); }
-        .approved { background: var(--accent); }
-        .rejected { background: var(--danger); }
-        
-        /* Tabs */
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 10px;
-        }
-        .stTabs [data-baseweb="tab"] {
-            background: rgba(255, 255, 255, 0.1);
-            border-radius: 8px !important;
-            padding: 0.5rem 1rem !important;
-            transition: all 0.3s;
-            color: var(--light);
-            border: 1px solid rgba(255, 255, 255, 0.1);
-        }
-        .stTabs [aria-selected="true"] {
-            background: var(--primary) !important;
-            color: white !important;
-            border-color: var(--primary-light);
-        }
-        
-        /* Image preview */
-        .image-preview {
-            border-radius: 8px;
-            overflow: hidden;
-            border: 1px solid rgba(255, 255, 255, 0.2);
-            margin-bottom: 1rem;
-        }
-        
-        /* WhatsApp button */
-        .whatsapp-btn {
-            background: #25D366 !important;
-            color: white !important;
-            border: none !important;
-        }
-        .whatsapp-btn:hover {
-            background: #128C7E !important;
-            transform: translateY(-2px) !important;
-        }
-        
-        /* Login container */
-        .login-container {
-            background: rgba(255, 255, 255, 0.1);
-            backdrop-filter: blur(16px);
-            border-radius: 16px;
-            padding: 2rem;
-            margin: 2rem 0;
-            border: 1px solid rgba(255, 255, 255, 0.2);
-            box-shadow: 0 8px 32px 0 rgba(0, 0, 0, 0.36);
-        }
-        
-        /* College logo */
-        .college-logo {
-            width: 120px;
-            height: 120px;
-            object-fit: contain;
-            margin: 0 auto 1rem;
-            display: block;
-            filter: drop-shadow(0 0 8px rgba(0,0,0,0.3));
-        }
-        
-        /* Floating particles */
-        .particles {
-            position: absolute;
-            width: 100%;
-            height: 100%;
-            top: 0;
-            left: 0;
-            z-index: -1;
-            overflow: hidden;
-        }
-        
-        .particle {
-            position: absolute;
-            background: rgba(255,255,255,0.5);
-            border-radius: 50%;
-            animation: float 15s infinite linear;
-        }
-        
-        @keyframes float {
-            0% { transform: translateY(0) rotate(0deg); opacity: 1; }
-            100% { transform: translateY(-1000px) rotate(720deg); opacity: 0; }
-        }
-        
-        /* Impact visualization */
-        .impact-visual {
-            width: 100%;
-            height: 300px;
-            background: linear-gradient(135deg, rgba(67,97,238,0.2) 0%, rgba(124,58,237,0.2) 100%);
-            border-radius: 16px;
-            position: relative;
-            overflow: hidden;
-            margin: 1rem 0;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            border: 1px solid rgba(255,255,255,0.1);
-        }
-        
-        .impact-icon {
-            font-size: 5rem;
-            opacity: 0.2;
-            position: absolute;
-        }
-        
-        /* Animated gradient border */
-        .gradient-border {
-            position: relative;
-            border-radius: 16px;
-            overflow: hidden;
-            padding: 1px;
-        }
-        
-        .gradient-border::before {
-            content: '';
-            position: absolute;
-            top: -50%;
-            left: -50%;
-            width: 200%;
-            height: 200%;
-            background: linear-gradient(
-                45deg,
-                rgba(67,97,238,0.8) 0%,
-                rgba(124,58,237,0.8) 50%,
-                rgba(16,185,129,0.8) 100%
-            );
-            animation: rotate 4s linear infinite;
-            z-index: -1;
-        }
-        
-        @keyframes rotate {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-        
-        .gradient-border > div {
-            background: var(--darker);
-            border-radius: 15px;
-            width: 100%;
-            height: 100%;
-            position: relative;
-        }
-    </style>
-    """, unsafe_allow_html=True)
+    # The stylesheet is attached to the page <head> once per browser session.
+    # It outlives reruns there, so later reruns send no CSS at all.
+    css, version = load_theme()
+    if st.session_state.get("theme_version") == version:
+        return
+    components.html(f"""
+    <script>
+        const doc = window.parent.document;
+        if (!doc.getElementById("arogya-theme-{version}")) {{
+            doc.querySelectorAll("style[data-arogya-theme]").forEach((node) => node.remove());
+            const style = doc.createElement("style");
+            style.id = "arogya-theme-{version}";
+            style.dataset.arogyaTheme = "{version}";
+            style.textContent = {json.dumps(css)};
+            doc.head.appendChild(style);
+        }}
+    </script>
+    """, height=0)
+    st.session_state.theme_version = version
 
 # ====================
 # 3. DATA INITIALIZATION
 # ====================
+# "id" is the stable user id stored on donations; names and phones may change
+USERS = {
+    "admin": {"id": "U1000", "password": "admin123", "name": "Admin", "phone": "911234567890", "role": "admin", "org": "College Medical Center"},
+    "donor1": {"id": "U1001", "password": "donor123", "name": "Rahul Sharma", "phone": "917068720697", "role": "donor", "org": "Student"},
+    "donor2": {"id": "U1002", "password": "donor123", "name": "Priya Patel", "phone": "918076747293", "role": "donor", "org": "Faculty"},
+    "recipient1": {"id": "U1003", "password": "recipient123", "name": "Medical Staff", "phone": "919876543213", "role": "recipient", "org": "College Health Center"}
+}
+
+SEED_MEDICINES = [
+    {
+        "id": 1, "name": "Paracetamol 500mg", "description": "For fever and pain relief", 
+        "quantity": 50, "expiry": "2024-12-31", "donor": "Rahul Sharma", "donor_id": "U1001",
+        "donor_contact": "918076747293", "location": "College Medical Room", "status": "approved", 
+        "category": "Pain Relief", "image": "https://m.media-amazon.com/images/I/61tL6yTZf6L._AC_UF1000,1000_QL80_.jpg",
+        "value": 2, "added_date": "2023-05-15", "prescription": False
+    },
+    {
+        "id": 2, "name": "Amoxicillin 250mg", "description": "Antibiotic for bacterial infections", 
+        "quantity": 30, "expiry": "2024-08-30", "donor": "Priya Patel", "donor_id": "U1002",
+        "donor_contact": "917068720697", "location": "College Medical Room", "status": "approved", 
+        "category": "Antibiotic", "image": "https://5.imimg.com/data5/SELLER/Default/2021/12/SE/BN/YK/3033203/amoxicillin-250mg-capsule-1000x1000.jpg",
+        "value": 5, "added_date": "2023-06-20", "prescription": True
+    },
+    {
+        "id": 3, "name": "Atorvastatin 20mg", "description": "Cholesterol lowering medication", 
+        "quantity": 20, "expiry": "2025-03-15", "donor": "Amit Kumar", 
+        "donor_contact": "917068720697", "location": "College Medical Room", "status": "pending", 
+        "category": "Cardiovascular", "image": "https://5.imimg.com/data5/SELLER/Default/2023/7/318929384/QH/VS/GT/199470473/atorvastatin-20-mg-tablet-500x500.jpg",
+        "value": 8, "added_date": "2023-07-10", "prescription": True
+    }
+]
+
+@st.cache_resource
+def get_store():
+    # Shared by every session in this process; the SQLite file is shared across processes
+    store = InventoryStore(DEFAULT_DB_PATH)
+    store.seed(SEED_MEDICINES)
+    store.assign_donor_ids({user['name']: user['id'] for user in USERS.values() if user['role'] == 'donor'})
+    ExpirySweeper(store).start()
+    return store
+
+@st.cache_resource
+def get_service():
+    # Every page goes through the inventory service: in this process by default,
+    # or the HTTP API in service_api.py when AROGYA_SERVICE_URL points at one.
+    # Locally the search index, columnar table and matching engine are built
+    # once per process and kept current through store listeners.
+    if SERVICE_URL:
+        return ServiceClient(SERVICE_URL)
+    return create_service(get_store())
+
+@st.cache_resource
+def get_perf_exporters():
+    # Optional: AROGYA_METRICS_PORT serves /metrics, AROGYA_PERF_EXPORT_PATH is rewritten every minute
+    return start_exporters()
+
+@st.cache_resource
+def get_notification_worker():
+    # Delivers outbox rows in the background; reruns only ever write to the outbox
+    worker = NotificationWorker(get_store(), StaticDirectory(USERS.values()))
+    worker.start()
+    return worker
+
 def init_session_state():
-    if 'medicines' not in st.session_state:
-        st.session_state.medicines = pd.DataFrame([
-            {
-                "id": 1, "name": "Paracetamol 500mg", "description": "For fever and pain relief", 
-                "quantity": 50, "expiry": "2024-12-31", "donor": "Rahul Sharma", 
-                "donor_contact": "918076747293", "location": "College Medical Room", "status": "approved", 
-                "category": "Pain Relief", "image": "https://m.media-amazon.com/images/I/61tL6yTZf6L._AC_UF1000,1000_QL80_.jpg",
-                "value": 2, "added_date": "2023-05-15", "prescription": False
-            },
-            {
-                "id": 2, "name": "Amoxicillin 250mg", "description": "Antibiotic for bacterial infections", 
-                "quantity": 30, "expiry": "2024-08-30", "donor": "Priya Patel", 
-                "donor_contact": "917068720697", "location": "College Medical Room", "status": "approved", 
-                "category": "Antibiotic", "image": "https://5.imimg.com/data5/SELLER/Default/2021/12/SE/BN/YK/3033203/amoxicillin-250mg-capsule-1000x1000.jpg",
-                "value": 5, "added_date": "2023-06-20", "prescription": True
-            },
-            {
-                "id": 3, "name": "Atorvastatin 20mg", "description": "Cholesterol lowering medication", 
-                "quantity": 20, "expiry": "2025-03-15", "donor": "Amit Kumar", 
-                "donor_contact": "917068720697", "location": "College Medical Room", "status": "pending", 
-                "category": "Cardiovascular", "image": "https://5.imimg.com/data5/SELLER/Default/2023/7/318929384/QH/VS/GT/199470473/atorvastatin-20-mg-tablet-500x500.jpg",
-                "value": 8, "added_date": "2023-07-10", "prescription": True
-            }
-        ])
-    
     if 'users' not in st.session_state:
-        st.session_state.users = {
-            "admin": {"password": "admin123", "name": "Admin", "phone": "911234567890", "role": "admin", "org": "College Medical Center"},
-            "donor1": {"password": "donor123", "name": "Rahul Sharma", "phone": "917068720697", "role": "donor", "org": "Student"},
-            "donor2": {"password": "donor123", "name": "Priya Patel", "phone": "918076747293", "role": "donor", "org": "Faculty"},
-            "recipient1": {"password": "recipient123", "name": "Medical Staff", "phone": "919876543213", "role": "recipient", "org": "College Health Center"}
-        }
+        st.session_state.users = USERS
     
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
         st.session_state.current_page = "impact"
-    
-    if 'impact_stats' not in st.session_state:
-        st.session_state.impact_stats = {
-            "total_medicines": 180,
-            "total_value": 1200,
-            "waste_prevented": 1500,
-            "lives_impacted": 250,
-            "carbon_footprint": 300
-        }
-    
-    if 'analytics' not in st.session_state:
-        st.session_state.analytics = {
-            "monthly_donations": [10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65],
-            "categories": {
-                "Pain Relief": 45,
-                "Antibiotics": 30,
-                "Chronic Diseases": 15,
-                "Vitamins": 8,
-                "Other": 2
-            }
-        }
 
 # ====================
 # 4. UTILITY FUNCTIONS
 # ====================
-def img_to_base64(image):
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode()
+@st.cache_resource
+def get_image_store():
+    return ImageStore(DEFAULT_IMAGE_DIR)
 
+@timed("op")
 def get_img_from_upload(uploaded_file):
-    if uploaded_file is not None:
-        try:
-            image = Image.open(uploaded_file)
-            return f"data:image/png;base64,{img_to_base64(image)}"
-        except:
-            return "https://via.placeholder.com/150?text=Medicine"
-    return "https://via.placeholder.com/150?text=Medicine"
+    return save_upload(get_image_store(), uploaded_file.getvalue() if uploaded_file is not None else None)
+
+@timed("op")
+def show_medicine_image(med, size, width):
+    image_store = get_image_store()
+    st.image(image_store.resolve(med['image'], size), width=width)
+    if st.toggle("🔍 Full image", key=f"full_image_{med['id']}"):
+        st.image(image_store.resolve(med['image'], "full"), use_column_width=True)
+
+@timed("op", "plotly_chart")
+def show_chart(fig):
+    # Serializing the figure for the browser is timed apart from building it
+    st.plotly_chart(fig, use_container_width=True)
+
+@st.cache_resource
+def get_figure_cache():
+    return FigureCache()
+
+def cached(chart_id, version, build):
+    # For charts every role sees the same way: built once per stats version and theme, shared by all sessions
+    return get_figure_cache().get_or_build(chart_id, version, load_theme()[1], build)
+
+PAGE_SIZES = [10, 20, 50, 100]
+DEFAULT_PAGE_SIZE = 20
+SORT_OPTIONS = {
+    "Expiry (soonest first)": "expiry",
+    "Recently added": "added_date",
+    "Quantity (highest first)": "quantity"
+}
+
+EXPIRY_WINDOWS = {"Any time": None, "7 days": 7, "30 days": 30, "90 days": 90}
+
+GRID_SORTS = {"Oldest first": "id", "Newest first": "newest", "Name": "name", "Expiry (soonest first)": "expiry",
+              "Recently added": "added_date", "Quantity (highest first)": "quantity"}
+
+RANKED_SORTS = {"Best for me (near, expiring soon, in stock)": "recommended", "Best match": "relevance"}
+
+@timed("op")
+def sort_selector(key, with_relevance=False, with_recommendation=False):
+    options = ((["Best for me (near, expiring soon, in stock)"] if with_recommendation else [])
+               + (["Best match"] if with_relevance else []) + list(SORT_OPTIONS))
+    choice = st.selectbox("↕️ Sort by", options, key=f"{key}_sort")
+    return RANKED_SORTS.get(choice) or SORT_OPTIONS[choice]
+
+@timed("op")
+def paginate(key, total, noun="medicines"):
+    # Renders the total-count header and page controls; returns (offset, limit)
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col2:
+        page_size = st.selectbox("Per page", PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE), key=f"{key}_page_size")
+    pages = max(1, math.ceil(total / page_size))
+    # The widget takes its value from session state, seeded here and kept within range
+    st.session_state[f"{key}_page"] = min(st.session_state.get(f"{key}_page", 1), pages)
+    with col3:
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    offset = (page - 1) * page_size
+    with col1:
+        shown = f"showing {offset + 1:,}–{min(offset + page_size, total):,}" if total else "none to show"
+        st.markdown(f"**{total:,} {noun}** · {shown} · page {page} of {pages}")
+    return offset, page_size
+
+def paged(key, fetch, noun="medicines"):
+    # One service call returns both the total and the page the controls point
+    # at; the controls are drawn afterwards because they need that total.
+    # fetch(offset, limit) -> Page
+    page_size = st.session_state.get(f"{key}_page_size", DEFAULT_PAGE_SIZE)
+    offset = (st.session_state.get(f"{key}_page", 1) - 1) * page_size
+    result = fetch(offset, page_size)
+    if result.total:
+        shown = paginate(key, result.total, noun)
+        if shown != (offset, page_size):
+            result = fetch(*shown)
+    return result
+
+def medicines_frame(medicines):
+    # Service results as the typed frame the pages render from
+    return coerce_medicines(pd.DataFrame([asdict(med) for med in medicines], columns=MEDICINE_COLUMNS))
 
 def create_particles():
     st.markdown("""
-    <div class="particles">
-        <div class="particle" style="width: 8px; height: 8px; top: 20%; left: 10%; animation-delay: 0s;"></div>
-        <div class="particle" style="width: 6px; height: 6px; top: 60%; left: 25%; animation-delay: 2s;"></div>
-        <div class="particle" style="width: 10px; height: 10px; top: 30%; left: 50%; animation-delay: 4s;"></div>
-        <div class="particle" style="width: 5px; height: 5px; top: 70%; left: 75%; animation-delay: 6s;"></div>
-        <div class="particle" style="width: 7px; height: 7px; top: 40%; left: 90%; animation-delay: 8s;"></div>
-        <div class="particle" style="width: 9px; height: 9px; top: 80%; left: 30%; animation-delay: 10s;"></div>
-    </div>
+    <div class="particles"><i class="particle"></i><i class="particle"></i><i class="particle"></i><i class="particle"></i><i class="particle"></i><i class="particle"></i></div>
     """, unsafe_allow_html=True)
 
 # ====================
@@ -487,7 +318,10 @@ def create_sidebar():
             "admin": [
                 {"icon": "📊", "name": "Impact Dashboard", "id": "impact"},
                 {"icon": "🛡️", "name": "Admin Console", "id": "admin"},
-                {"icon": "📈", "name": "Analytics", "id": "analytics"}
+                {"icon": "📥", "name": "Bulk Import", "id": "import"},
+                {"icon": "⏳", "name": "Expiring Soon", "id": "expiring"},
+                {"icon": "📈", "name": "Analytics", "id": "analytics"},
+                {"icon": "⏱️", "name": "Performance", "id": "performance"}
             ],
             "donor": [
                 {"icon": "📊", "name": "Impact Dashboard", "id": "impact"},
@@ -514,6 +348,10 @@ def create_sidebar():
 # 7. DASHBOARD COMPONENTS
 # ====================
 def show_impact_dashboard():
+    service = get_service()
+    version = service.stats_version()
+    with span("op", "impact_summary"):
+        impact_stats = cached("impact.summary", version, lambda: asdict(service.impact()))
     st.markdown("""
     <div class="dashboard-header">
         <h1 style="color: white; margin-bottom:0.5rem;">Impact Dashboard</h1>
@@ -524,10 +362,10 @@ def show_impact_dashboard():
     # Metrics cards
     col1, col2, col3, col4 = st.columns(4)
     metrics = [
-        {"icon": "💊", "title": "Medicines Saved", "value": f"{st.session_state.impact_stats['total_medicines']:,}", "unit": "tablets"},
-        {"icon": "💰", "title": "Value Saved", "value": f"₹{st.session_state.impact_stats['total_value']:,.0f}", "unit": "for college"},
-        {"icon": "♻️", "title": "Waste Prevented", "value": f"{st.session_state.impact_stats['waste_prevented']}g", "unit": "of medical waste"},
-        {"icon": "👥", "title": "Students Helped", "value": f"{st.session_state.impact_stats['lives_impacted']:,}", "unit": "students"}
+        {"icon": "💊", "title": "Medicines Saved", "value": f"{impact_stats['total_medicines']:,}", "unit": "tablets"},
+        {"icon": "💰", "title": "Value Saved", "value": f"₹{impact_stats['total_value']:,.0f}", "unit": "for college"},
+        {"icon": "♻️", "title": "Waste Prevented", "value": f"{impact_stats['waste_prevented']}g", "unit": "of medical waste"},
+        {"icon": "👥", "title": "Students Helped", "value": f"{impact_stats['lives_impacted']:,}", "unit": "students"}
     ]
     
     for i, metric in enumerate(metrics):
@@ -541,9 +379,9 @@ def show_impact_dashboard():
             </div>
             """, unsafe_allow_html=True)
     
-    # Impact visualization - FIXED THE FORMAT ISSUE HERE
-    prescriptions_fulfilled = int(0.5 * st.session_state.impact_stats['total_medicines'])
-    student_savings = int(0.3 * st.session_state.impact_stats['total_value'])
+    # Impact visualization
+    units_handed_over = impact_stats['units_handed_over']
+    student_savings = impact_stats['student_savings']
     st.markdown(f"""
     <div class="impact-visual">
         <div style="text-align: center; z-index: 1;">
@@ -551,8 +389,8 @@ def show_impact_dashboard():
             <p>This represents the amount of medicine waste we've prevented this semester</p>
             <div style="display: flex; justify-content: center; gap: 2rem; margin-top: 1rem;">
                 <div>
-                    <div style="font-size: 2rem;">{prescriptions_fulfilled}</div>
-                    <div style="font-size: 0.8rem;">Prescriptions Fulfilled</div>
+                    <div style="font-size: 2rem;">{units_handed_over:,}</div>
+                    <div style="font-size: 0.8rem;">Units Handed Over</div>
                 </div>
                 <div>
                     <div style="font-size: 2rem;">₹{student_savings:,}</div>
@@ -568,34 +406,43 @@ def show_impact_dashboard():
     st.markdown("---")
     st.subheader("College Medicine Analytics")
     
+    def analytics():
+        return cached("analytics", version, service.analytics)
+    
+    def categories_figure():
+        categories = analytics().category
+        with span("figure", "impact.categories"):
+            fig = px.pie(
+                values=list(categories.values()),
+                names=list(categories.keys()),
+                hole=0.4,
+                color_discrete_sequence=px.colors.qualitative.Pastel,
+                title="Medicine Categories in College"
+            )
+            fig.update_traces(textposition='inside', textinfo='percent+label')
+            fig.update_layout(showlegend=False, height=400)
+        return fig
+    
+    def monthly_figure():
+        monthly_data = recent_months_frame(analytics().month)
+        with span("figure", "impact.monthly"):
+            fig = px.bar(
+                monthly_data,
+                x="Month",
+                y="Donations",
+                color="Donations",
+                color_continuous_scale="Blues",
+                title="Monthly Donations in College"
+            )
+            fig.update_layout(height=400)
+        return fig
+    
     col1, col2 = st.columns(2)
     with col1:
-        fig = px.pie(
-            values=list(st.session_state.analytics['categories'].values()),
-            names=list(st.session_state.analytics['categories'].keys()),
-            hole=0.4,
-            color_discrete_sequence=px.colors.qualitative.Pastel,
-            title="Medicine Categories in College"
-        )
-        fig.update_traces(textposition='inside', textinfo='percent+label')
-        fig.update_layout(showlegend=False, height=400)
-        st.plotly_chart(fig, use_container_width=True)
-    
+        show_chart(cached("impact.categories", version, categories_figure))
     with col2:
-        monthly_data = pd.DataFrame({
-            "Month": ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"],
-            "Donations": st.session_state.analytics['monthly_donations']
-        })
-        fig = px.bar(
-            monthly_data,
-            x="Month",
-            y="Donations",
-            color="Donations",
-            color_continuous_scale="Blues",
-            title="Monthly Donations in College"
-        )
-        fig.update_layout(height=400)
-        st.plotly_chart(fig, use_container_width=True)
+        # The last twelve months move on with the calendar as well as with writes
+        show_chart(cached(f"impact.monthly.{datetime.date.today():%Y-%m}", version, monthly_figure))
 
 def admin_dashboard():
     st.markdown("""
@@ -605,32 +452,77 @@ def admin_dashboard():
     </div>
     """, unsafe_allow_html=True)
     
-    tab1, tab2 = st.tabs(["📝 Pending Approvals", "📦 All Medicines"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📝 Pending Approvals", "📦 All Medicines", "📌 Reservations", "🧾 Audit Log", "📨 Outbox"])
     
+    service = get_service()
     with tab1:
-        pending_meds = st.session_state.medicines[st.session_state.medicines['status'] == 'pending']
+        col1, col2 = st.columns(2)
+        with col1:
+            category = st.selectbox("🏷️ Filter by category", ["All"] + CATEGORIES, key="pending_category")
+        with col2:
+            location = st.selectbox("📍 Filter by location", ["All"] + LOCATIONS, key="pending_location")
+        filters = {
+            "status": "pending",
+            "category": None if category == "All" else category,
+            "location": None if location == "All" else location
+        }
+        result = paged("pending", lambda offset, limit: service.list_medicines(
+            sort="added_date", limit=limit, offset=offset, **filters), noun="pending donations")
+        total = result.total
         
-        if pending_meds.empty:
+        if total == 0:
             st.info("✨ No medicines pending approval")
         else:
+            pending_meds = medicines_frame(result.items)
+            page_ids = pending_meds['id'].tolist()
+            
+            # Batch actions: everything selected is applied in one transaction and one rerun.
+            # Bumping the selection generation after an action gives every checkbox a fresh key.
+            generation = st.session_state.setdefault("selection_generation", 0)
+            st.checkbox("Select all on this page", key=f"pending_select_all_{generation}",
+                        on_change=select_page, args=(page_ids, generation))
+            selected = [med_id for med_id in page_ids if st.session_state.get(f"select_{generation}_{med_id}")]
+            cols = st.columns(3)
+            with cols[0]:
+                if st.button(f"✅ Approve selected ({len(selected)})", disabled=not selected, key="approve_selected"):
+                    update_medicine_statuses(selected, 'approved')
+            with cols[1]:
+                if st.button(f"❌ Reject selected ({len(selected)})", disabled=not selected, key="reject_selected"):
+                    update_medicine_statuses(selected, 'rejected')
+            with cols[2]:
+                # Confirmed for this exact count; a changed filter or a finished action needs a fresh tick
+                confirmed = st.checkbox(f"Yes, approve all {total:,}", key=f"approve_filtered_confirm_{generation}_{total}")
+                if st.button(f"✅ Approve all {total:,} matching filter", disabled=not confirmed, key="approve_filtered") and confirmed:
+                    update_medicine_statuses(service.medicine_ids(**filters), 'approved')
+            
+            # Earlier listings with a near-identical photo, looked up for this page only
+            duplicates = {}
+            for dup in service.near_duplicates(page_ids):
+                duplicates.setdefault(dup.medicine_id, []).append(dup)
+            
             for _, med in pending_meds.iterrows():
                 with st.container():
                     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
                     
                     cols = st.columns([1, 3, 1])
                     with cols[0]:
-                        st.image(med['image'], width=150)
+                        st.checkbox("Select", key=f"select_{generation}_{med['id']}")
+                        show_medicine_image(med, "thumb", 150)
                     
                     with cols[1]:
                         st.subheader(med['name'])
                         st.caption(med.get('description', ''))
                         st.write(f"""
-                        **Quantity:** {med['quantity']} | **Value:** ₹{med.get('value', 0)*med['quantity']:,}  
-                        **Expiry:** {med['expiry']} | **Location:** {med['location']}  
+                        **Quantity:** {med['quantity']} | **Value:** ₹{int(med.get('value', 0)) * int(med['quantity']):,}  
+                        **Expiry:** {format_date(med['expiry'])} | **Location:** {med['location']}  
                         **Donor:** {med['donor']} ({med['donor_contact']})
                         """)
                         if med['prescription']:
                             st.warning("⚠️ Prescription Required")
+                        if med['id'] in duplicates:
+                            st.warning("🖼️ Photo looks like " + "; ".join(
+                                f"#{dup.id} {dup.name} ({dup.status}, {dup.donor}, added {dup.added_date})"
+                                for dup in duplicates[med['id']]))
                     
                     with cols[2]:
                         col1, col2 = st.columns(2)
@@ -643,28 +535,222 @@ def admin_dashboard():
                     
                     st.markdown('</div>', unsafe_allow_html=True)
     
+    with tab4:
+        st.dataframe(pd.DataFrame(service.audit_log(limit=500)), use_container_width=True, hide_index=True)
+    
+    with tab3:
+        reservations_admin()
+    
+    with tab5:
+        outbox = service.outbox(limit=200)
+        cols = st.columns(4)
+        for col, status in zip(cols, OUTBOX_STATUSES):
+            col.metric(status.title(), f"{outbox.summary.get(status, 0):,}")
+        st.dataframe(pd.DataFrame(outbox.items), use_container_width=True, hide_index=True)
+    
     with tab2:
-        st.dataframe(
-            st.session_state.medicines,
-            use_container_width=True,
-            column_config={
-                "image": st.column_config.ImageColumn("Preview"),
-                "status": st.column_config.SelectboxColumn(
-                    "Status",
-                    options=["pending", "approved", "rejected"],
-                    required=True
+        all_medicines_grid()
+
+def all_medicines_grid():
+    # Only one page of the projected columns leaves the store; images load for an expanded row alone
+    service = get_service()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        status = st.selectbox("📋 Status", ["All"] + STATUSES, key="grid_status")
+    with col2:
+        category = st.selectbox("🏷️ Category", ["All"] + CATEGORIES, key="grid_category")
+    with col3:
+        location = st.selectbox("📍 Location", ["All"] + LOCATIONS, key="grid_location")
+    with col4:
+        sort = GRID_SORTS[st.selectbox("↕️ Sort by", list(GRID_SORTS), key="grid_sort")]
+    # The id column always shows: it is what a row is expanded by
+    optional = [c for c in GRID_COLUMNS if c != "id"]
+    columns = ["id"] + st.multiselect("Columns", optional, default=optional, key="grid_columns")
+    filters = {
+        "status": None if status == "All" else status,
+        "category": None if category == "All" else category,
+        "location": None if location == "All" else location
+    }
+    result = paged("all_meds", lambda offset, limit: service.medicine_rows(
+        columns=columns, sort=sort, limit=limit, offset=offset, **filters))
+    if result.total == 0:
+        st.info("No medicines match these filters")
+        return
+    st.dataframe(
+        coerce_medicines(pd.DataFrame(result.items, columns=columns)),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "expiry": st.column_config.DateColumn("Expiry", format="YYYY-MM-DD"),
+            "added_date": st.column_config.DateColumn("Added", format="YYYY-MM-DD")
+        }
+    )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        expanded = st.selectbox("🔍 Expand row", [None] + [row["id"] for row in result.items], key="grid_expanded",
+                                format_func=lambda med_id: "—" if med_id is None else f"#{med_id}")
+    with col2:
+        # The CSV is only built on request and kept until the filter changes
+        export_key = json.dumps([columns, sort, filters])
+        if st.button(f"📤 Export {result.total:,} rows as CSV", key="grid_export"):
+            st.session_state.grid_csv = (export_key, service.export_medicines_csv(columns=columns, sort=sort, **filters))
+        export = st.session_state.get("grid_csv")
+        if export and export[0] == export_key:
+            st.download_button("⬇️ Download CSV", export[1], file_name="medicines.csv", mime="text/csv", key="grid_download")
+    if expanded is not None:
+        for med in service.get_medicines([expanded]):
+            cols = st.columns([1, 3])
+            with cols[0]:
+                show_medicine_image(asdict(med), "card", 220)
+            with cols[1]:
+                st.subheader(med.name)
+                st.caption(med.description)
+                st.write(f"""
+                **Quantity:** {med.quantity} ({med.available_quantity} available) | **Status:** {med.status}  
+                **Expiry:** {format_date(med.expiry)} | **Location:** {med.location}  
+                **Donor:** {med.donor} ({med.donor_contact})
+                """)
+
+def reservations_admin():
+    service = get_service()
+    actor = st.session_state.user['id']
+    with st.form("handover_form", clear_on_submit=True):
+        cols = st.columns([2, 1])
+        with cols[0]:
+            handover_id = st.number_input("Reservation ID handed over to a recipient", min_value=1, step=1)
+        with cols[1]:
+            st.write("")
+            handed_over = st.form_submit_button("🤝 Mark handed over")
+        if handed_over:
+            try:
+                service.fulfil_reservation(handover_id, actor=actor)
+            except ReservationError as e:
+                st.error(str(e))
+            else:
+                st.success(f"Reservation #{handover_id} handed over")
+    
+    result = paged("reservations", lambda offset, limit: service.list_reservations(limit=limit, offset=offset),
+                   noun="held reservations")
+    if result.total == 0:
+        st.info("No reservations are on hold")
+        return
+    for reservation in result.items:
+        cols = st.columns([4, 1, 1])
+        with cols[0]:
+            st.markdown(
+                f"**#{reservation.id} {reservation.name}** × {reservation.quantity} for {reservation.recipient} "
+                f"· {reservation.location} · expires {reservation.expires_at} UTC"
+            )
+        with cols[1]:
+            if st.button("🤝 Handed over", key=f"fulfil_reservation_{reservation.id}"):
+                try:
+                    service.fulfil_reservation(reservation.id, actor=actor)
+                except ReservationError as e:
+                    st.error(str(e))
+                else:
+                    st.rerun()
+        with cols[2]:
+            if st.button("↩ Release", key=f"admin_release_{reservation.id}"):
+                service.cancel_reservation(reservation.id, actor=actor)
+                st.rerun()
+
+def expiring_dashboard():
+    st.markdown("""
+    <div class="dashboard-header">
+        <h1 style="color: white;">Expiring Soon</h1>
+        <p style="color: rgba(255,255,255,0.8);">Stock to hand out before it goes to waste</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    service = get_service()
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        days = st.slider("Expiring within (days)", min_value=1, max_value=180, value=30, key="expiring_days")
+    with col2:
+        status = st.selectbox("Status", ["approved", "pending"], key="expiring_status")
+    with col3:
+        st.write("")
+        if st.button("🧹 Sweep expired now", key="sweep_now"):
+            swept = service.sweep_expired()
+            st.success(f"Moved {len(swept):,} expired medicines out of the active inventory")
+    
+    today = datetime.date.today()
+    window = {"status": status, "expires_from": today, "expires_to": today + datetime.timedelta(days=days)}
+    result = paged("expiring", lambda offset, limit: service.list_medicines(sort="expiry", limit=limit, offset=offset,
+                                                                            **window))
+    if result.total == 0:
+        st.info(f"Nothing {status} expires in the next {days} days")
+        return
+    expiring = medicines_frame(result.items)
+    expiring['days_left'] = (expiring['expiry'] - pd.Timestamp(today)).dt.days
+    st.dataframe(
+        expiring[['id', 'name', 'quantity', 'expiry', 'days_left', 'location', 'category', 'donor']],
+        use_container_width=True,
+        hide_index=True,
+        column_config={"expiry": st.column_config.DateColumn("Expiry", format="YYYY-MM-DD")}
+    )
+
+def bulk_import_dashboard():
+    st.markdown("""
+    <div class="dashboard-header">
+        <h1 style="color: white;">Bulk Import</h1>
+        <p style="color: rgba(255,255,255,0.8);">Log a whole donation drive from a CSV or Excel sheet</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    st.caption(f"Required columns: {', '.join(REQUIRED_COLUMNS)}. Optional: {', '.join(OPTIONAL_COLUMNS)}. "
+               f"Expiry as YYYY-MM-DD; category one of {', '.join(CATEGORIES)}; location one of {', '.join(LOCATIONS)}.")
+    
+    with st.form("bulk_import_form"):
+        upload = st.file_uploader("Donation sheet", type=["csv", "xlsx"])
+        cols = st.columns(2)
+        with cols[0]:
+            status = st.selectbox("Import as", ["approved", "pending"])
+        with cols[1]:
+            dry_run = st.checkbox("Validate only (don't import)")
+        submitted = st.form_submit_button("Import", type="primary")
+    
+    if submitted:
+        if upload is None:
+            st.error("Please choose a CSV or XLSX file")
+            return
+        try:
+            with st.spinner("Validating and importing..."):
+                imported, report = import_donations(
+                    get_service(), upload, status,
+                    donor=st.session_state.user['org'], donor_contact=st.session_state.user['phone'],
+                    dry_run=dry_run
                 )
-            }
-        )
+        except ValueError as e:
+            st.error(str(e))
+            return
+        
+        if dry_run:
+            st.info(f"Validation finished: {len(report):,} rows have errors")
+        else:
+            st.success(f"Imported {len(imported):,} donations (IDs {imported[0]}–{imported[-1]})" if imported
+                       else "No rows were imported")
+        if not report.empty:
+            st.warning(f"{len(report):,} rows were rejected")
+            st.dataframe(report.head(1000), use_container_width=True, hide_index=True)
+            st.download_button("⬇️ Download error report", report.to_csv(index=False),
+                               file_name="import_errors.csv", mime="text/csv")
 
-def update_medicine_status(med_id, status):
-    st.session_state.medicines.loc[st.session_state.medicines['id'] == med_id, 'status'] = status
-    if status == 'approved':
-        med = st.session_state.medicines[st.session_state.medicines['id'] == med_id].iloc[0]
-        st.session_state.impact_stats['total_medicines'] += med['quantity']
-        st.session_state.impact_stats['total_value'] += med.get('value', 0)*med['quantity']
+def select_page(page_ids, generation):
+    for med_id in page_ids:
+        st.session_state[f"select_{generation}_{med_id}"] = st.session_state[f"pending_select_all_{generation}"]
+
+@timed("op")
+def update_medicine_statuses(med_ids, status):
+    # The store records each decision in the audit log and the impact ledger
+    get_service().update_statuses(med_ids, status, actor=st.session_state.user['id'])
+    st.session_state.selection_generation = st.session_state.get("selection_generation", 0) + 1
     st.rerun()
 
+def update_medicine_status(med_id, status):
+    update_medicine_statuses([med_id], status)
+
 # ====================
 # 8. DONOR DASHBOARD
 # ====================
@@ -686,9 +772,9 @@ def donor_dashboard(show_history=False):
                     quantity = st.number_input("Quantity*", min_value=1)
                     expiry = st.date_input("Expiry Date*", min_value=datetime.date.today())
                 with cols[1]:
-                    category = st.selectbox("Category*", ["Pain Relief", "Antibiotic", "Chronic Disease", "Cardiovascular", "Vitamins", "Other"])
+                    category = st.selectbox("Category*", CATEGORIES)
                     value = st.number_input("Approx. Value per Unit (₹)*", min_value=1)
-                    location = st.selectbox("Location*", ["College Medical Room", "Hostel A", "Hostel B", "Faculty Block"])
+                    location = st.selectbox("Location*", LOCATIONS)
                     prescription = st.checkbox("Requires Prescription")
                     image = st.file_uploader("Upload Medicine Image", type=["jpg", "png", "jpeg"])
                 
@@ -697,19 +783,9 @@ def donor_dashboard(show_history=False):
                     if not (name and quantity and expiry and location and value):
                         st.error("Please fill all required fields (*)")
                     else:
-                        new_id = max(st.session_state.medicines['id']) + 1 if not st.session_state.medicines.empty else 1
-                        new_med = {
-                            "id": new_id, "name": name, "description": description,
-                            "quantity": quantity, "expiry": expiry.strftime("%Y-%m-%d"), 
-                            "donor": st.session_state.user['name'], "donor_contact": st.session_state.user['phone'],
-                            "location": location, "status": "pending", "category": category,
-                            "value": value, "image": get_img_from_upload(image),
-                            "prescription": prescription, "added_date": datetime.date.today().strftime("%Y-%m-%d")
-                        }
-                        st.session_state.medicines = pd.concat([
-                            st.session_state.medicines,
-                            pd.DataFrame([new_med])
-                        ], ignore_index=True)
+                        new_med = donation_record(st.session_state.user, name, description, quantity, expiry,
+                                                  category, value, location, prescription, get_img_from_upload(image))
+                        get_service().submit_donations([new_med])
                         st.success("Donation submitted for approval!")
                         st.balloons()
         
@@ -723,23 +799,35 @@ def donor_dashboard(show_history=False):
         </div>
         """, unsafe_allow_html=True)
     
-    your_donations = st.session_state.medicines[
-        st.session_state.medicines['donor'] == st.session_state.user['name']
-    ]
+    service = get_service()
+    donor_id = st.session_state.user['id']
+    summary = service.donor_summary(donor_id)
+    total = sum(s['donations'] for s in summary.values())
     
-    if your_donations.empty:
+    if total == 0:
         st.info("You haven't donated any medicines yet")
     else:
+        if show_history:
+            cols = st.columns(len(summary))
+            for col, (status, stats) in zip(cols, sorted(summary.items())):
+                with col:
+                    st.metric(status.title(), f"{stats['donations']:,}",
+                              f"{stats['quantity']:,} units · ₹{stats['value']:,}", delta_color="off")
+        history_key = "history" if show_history else "recent"
+        sort = sort_selector(history_key)
+        result = paged(history_key, lambda offset, limit: service.list_medicines(
+            donor_id=donor_id, sort=sort, limit=limit, offset=offset), noun="donations")
+        your_donations = medicines_frame(result.items)
         for _, med in your_donations.iterrows():
             status_class = med['status']
             st.markdown(f"""
             <div class="glass-card">
                 <div style="display: flex; justify-content: space-between; align-items: center;">
-                    <h3>{med['name']}</h3>
+                    <h3>{html.escape(str(med['name']))}</h3>
                     <span class="status-badge {status_class}">{status_class.upper()}</span>
                 </div>
-                <p>Quantity: {med['quantity']} | Value: ₹{med.get('value', 0)*med['quantity']:,}</p>
-                <p>Submitted on: {med.get('added_date', 'N/A')} | Expiry: {med['expiry']}</p>
+                <p>Quantity: {med['quantity']} | Value: ₹{int(med.get('value', 0)) * int(med['quantity']):,}</p>
+                <p>Submitted on: {format_date(med.get('added_date'))} | Expiry: {format_date(med['expiry'])}</p>
                 {f'<p style="color: var(--warning);">⚠️ Prescription Required</p>' if med['prescription'] else ''}
             </div>
             """, unsafe_allow_html=True)
@@ -755,49 +843,67 @@ def recipient_dashboard():
     </div>
     """, unsafe_allow_html=True)
     
+    service = get_service()
+    
     # Search Filters
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4, col5 = st.columns(5)
     with col1:
         search = st.text_input("🔍 Search medicines", key="search_meds")
     with col2:
-        category = st.selectbox("🏷️ Filter by category", ["All"] + list(st.session_state.medicines['category'].unique()), key="filter_category")
+        category = st.selectbox("🏷️ Filter by category", ["All"] + service.options('category'), key="filter_category")
     with col3:
-        location = st.selectbox("📍 Filter by location", ["All"] + list(st.session_state.medicines['location'].unique()), key="filter_location")
-    
-    # Filter approved medicines
-    approved_meds = st.session_state.medicines[st.session_state.medicines['status'] == 'approved']
-    if search:
-        approved_meds = approved_meds[approved_meds['name'].str.contains(search, case=False)]
-    if category != "All":
-        approved_meds = approved_meds[approved_meds['category'] == category]
-    if location != "All":
-        approved_meds = approved_meds[approved_meds['location'] == location]
-    
-    if approved_meds.empty:
+        location = st.selectbox("📍 Filter by location", ["All"] + service.options('location'), key="filter_location")
+    with col4:
+        expiring_days = EXPIRY_WINDOWS[st.selectbox("⏳ Expiring within", list(EXPIRY_WINDOWS), key="filter_expiring")]
+    with col5:
+        origin = st.selectbox("🧭 I am near", ["Anywhere"] + REGISTRY.names, key="find_origin")
+    origin = None if origin == "Anywhere" else origin
+    
+    # Approved, unexpired stock with units left
+    sort = sort_selector("find", with_relevance=bool(search), with_recommendation=origin is not None)
+    result = paged("find", lambda offset, limit: service.find_medicines(FindQuery(
+        search=search, category=None if category == "All" else category,
+        location=None if location == "All" else location, expiring_days=expiring_days,
+        sort=sort, origin=origin, limit=limit, offset=offset
+    )))
+    
+    if result.total == 0:
         st.info("No medicines currently available matching your criteria")
     else:
+        approved_meds = medicines_frame(result.items)
         for _, med in approved_meds.iterrows():
             with st.container():
                 st.markdown('<div class="glass-card">', unsafe_allow_html=True)
                 cols = st.columns([1, 3])
                 with cols[0]:
-                    st.image(med['image'], width=200)
+                    show_medicine_image(med, "card", 200)
                 with cols[1]:
                     st.subheader(med['name'])
                     st.caption(f"**Category:** {med['category']}")
                     st.write(med.get('description', ''))
+                    # Units promised to other requests by the matcher cannot be reserved here
+                    reservable = int(med['available_quantity'] - med['promised_quantity'])
                     
                     st.write(f"""
-                    **Quantity Available:** {med['quantity']}  
-                    **Expiry Date:** {med['expiry']}  
-                    **Location:** {med['location']}  
+                    **Quantity Available:** {reservable} of {med['quantity']}  
+                    **Expiry Date:** {format_date(med['expiry'])}  
+                    **Location:** {med['location']}{walking_note(origin, med['location'])}  
                     **Donated by:** {med['donor']}
                     """)
                     
                     if med['prescription']:
                         st.warning("⚠️ Prescription Required")
                     
-                    whatsapp_url = f"https://wa.me/{med['donor_contact']}?text=" + urllib.parse.quote(
+                    reserve_cols = st.columns([1, 1, 2])
+                    with reserve_cols[0]:
+                        units = st.number_input("Units", min_value=1, max_value=reservable,
+                                                step=1, key=f"reserve_units_{med['id']}")
+                    with reserve_cols[1]:
+                        st.write("")
+                        if st.button("📌 Reserve", key=f"reserve_{med['id']}"):
+                            reserve_medicine(med['id'], units)
+                    
+                    whatsapp_url = f"https://wa.me/{urllib.parse.quote(str(med['donor_contact']))}?text=" + urllib.parse.quote(
                         f"Hello {med['donor']}, I need {med['name']} from ArogyaMitram.\n"
                         f"My details:\nName: {st.session_state.user['name']}\n"
                         f"Organization: {st.session_state.user['org']}\n"
@@ -805,7 +911,7 @@ def recipient_dashboard():
                         f"Quantity needed: [Please specify]"
                     )
                     st.markdown(f"""
-                    <a href="{whatsapp_url}" target="_blank">
+                    <a href="{html.escape(whatsapp_url)}" target="_blank">
                         <button class="whatsapp-btn" style="
                             padding:0.5rem 1.5rem;
                             border-radius:8px;
@@ -819,6 +925,131 @@ def recipient_dashboard():
                     """, unsafe_allow_html=True)
                 st.markdown('</div>', unsafe_allow_html=True)
 
+def walking_note(origin, location):
+    if origin is None:
+        return ""
+    meters = REGISTRY.distance(origin, location)
+    if math.isinf(meters):
+        return ""
+    return " (here)" if meters == 0 else f" (≈{meters:,.0f} m walk)"
+
+@timed("op")
+def reserve_medicine(med_id, units, request_id=None):
+    user = st.session_state.user
+    try:
+        reservation_id = get_service().reserve(med_id, units, user['id'], recipient=user['name'], request_id=request_id)
+    except ReservationError as e:
+        st.error(str(e))
+    else:
+        hours = RESERVATION_TTL_MINUTES // 60
+        st.success(f"Reserved {units} units (reservation #{reservation_id}). "
+                   f"Collect them within {hours} hours or they return to the pool.")
+
+def requests_dashboard():
+    st.markdown("""
+    <div class="dashboard-header">
+        <h1 style="color: white;">My Requests</h1>
+        <p style="color: rgba(255,255,255,0.8);">Tell donors what you need; new stock is matched to you automatically</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    service = get_service()
+    user = st.session_state.user
+    
+    with st.expander("➕ New Request", expanded=True):
+        with st.form("request_form", clear_on_submit=True):
+            cols = st.columns(2)
+            with cols[0]:
+                drug = st.text_input("Medicine Needed*")
+                quantity = st.number_input("Quantity*", min_value=1, step=1)
+                urgency = st.selectbox("Urgency", URGENCY_LEVELS, index=URGENCY_LEVELS.index("normal"))
+            with cols[1]:
+                category = st.selectbox("Category", ["Any"] + CATEGORIES)
+                location = st.selectbox("Pickup Location", ["Any"] + LOCATIONS)
+            
+            submitted = st.form_submit_button("Post Request", type="primary")
+            if submitted:
+                if not drug.strip():
+                    st.error("Please enter the medicine you need")
+                else:
+                    try:
+                        submitted = service.create_request({
+                            "recipient_id": user['id'], "recipient": user['name'], "contact": user['phone'],
+                            "drug": drug, "quantity": int(quantity), "urgency": urgency,
+                            "category": "" if category == "Any" else category,
+                            "location": "" if location == "Any" else location
+                        })
+                    except SchemaError as e:
+                        st.error(str(e))
+                    else:
+                        units = submitted.matched_units
+                        if units >= quantity:
+                            st.success(f"Matched all {units} units from available stock!")
+                        elif units:
+                            st.success(f"Matched {units} of {quantity} units; the rest will be matched as donations are approved")
+                        else:
+                            st.info("No stock matches yet; you will be matched as soon as a donation is approved")
+    
+    held = service.list_reservations(recipient_id=user['id'], limit=100).items
+    if held:
+        st.markdown("---")
+        st.subheader("My Reservations")
+        for reservation in held:
+            cols = st.columns([4, 1])
+            with cols[0]:
+                st.markdown(
+                    f"**#{reservation.id} {reservation.name}** × {reservation.quantity} at {reservation.location} "
+                    f"· collect from {reservation.donor} ({reservation.donor_contact}) before {reservation.expires_at} UTC"
+                )
+            with cols[1]:
+                if st.button("↩ Release", key=f"release_reservation_{reservation.id}"):
+                    service.cancel_reservation(reservation.id, recipient_id=user['id'])
+                    st.rerun()
+    
+    st.markdown("---")
+    result = paged("requests", lambda offset, limit: service.list_requests(recipient_id=user['id'], limit=limit,
+                                                                           offset=offset), noun="requests")
+    if result.total == 0:
+        st.info("You have not posted any requests yet")
+        return
+    
+    for request in result.items:
+        wanted = " · ".join(x for x in [request.category, request.location] if x) or "any category · any location"
+        # The drug and the rest come from what recipients typed; never let them through as markup
+        status = html.escape(request.status)
+        st.markdown(f"""
+        <div class="glass-card">
+            <div style="display: flex; justify-content: space-between; align-items: center;">
+                <h3>{html.escape(request.drug)}</h3>
+                <span class="status-badge {status}">{status.upper()}</span>
+            </div>
+            <p>Matched {request.matched_quantity} of {request.quantity} units | Urgency: {html.escape(request.urgency)} | {html.escape(wanted)}</p>
+            <p>Requested on: {format_date(request.created_at)}</p>
+        </div>
+        """, unsafe_allow_html=True)
+        for match in request.matches:
+            whatsapp_url = f"https://wa.me/{urllib.parse.quote(str(match.donor_contact))}?text=" + urllib.parse.quote(
+                f"Hello {match.donor}, ArogyaMitram matched my request to your {match.name}.\n"
+                f"My details:\nName: {user['name']}\n"
+                f"Organization: {user['org']}\n"
+                f"Phone: {user['phone']}\n"
+                f"Quantity needed: {match.matched}"
+            )
+            match_cols = st.columns([4, 1])
+            with match_cols[0]:
+                st.markdown(
+                    f"- **{match.name}** × {match.matched} at {match.location} "
+                    f"(expires {format_date(match.expiry)}) · held for you until {match.promised_until} UTC "
+                    f"· [📱 Contact {match.donor}]({whatsapp_url})"
+                )
+            with match_cols[1]:
+                if match.status == 'approved' and st.button("📌 Reserve", key=f"reserve_match_{request.id}_{match.id}"):
+                    reserve_medicine(match.id, match.matched, request_id=request.id)
+        if request.status != 'cancelled':
+            if st.button("✖ Cancel request", key=f"cancel_request_{request.id}"):
+                service.cancel_request(request.id, recipient_id=user['id'])
+                st.rerun()
+
 # ====================
 # 10. ANALYTICS DASHBOARD
 # ====================
@@ -830,84 +1061,182 @@ def analytics_dashboard():
     </div>
     """, unsafe_allow_html=True)
     
+    service = get_service()
+    version = service.stats_version()
+    
+    def frames():
+        return cached("analytics.frames", version, lambda: analytics_frames(*astuple(service.analytics())))
+    
+    def status_figure():
+        with span("figure", "analytics.status"):
+            fig = px.pie(
+                frames()['status'],
+                values='Count',
+                names='Status',
+                color='Status',
+                color_discrete_map={
+                    'approved': '#10b981',
+                    'pending': '#f59e0b',
+                    'rejected': '#ef4444'
+                },
+                hole=0.4
+            )
+            fig.update_traces(textposition='inside', textinfo='percent+label')
+        return fig
+    
+    def category_figure():
+        with span("figure", "analytics.category"):
+            fig = px.bar(
+                frames()['category'],
+                x='Category',
+                y='Count',
+                color='Category',
+                color_discrete_sequence=px.colors.qualitative.Pastel
+            )
+        return fig
+    
+    def timeline_figure():
+        with span("figure", "analytics.timeline"):
+            fig = px.line(
+                frames()['timeline'],
+                x='Month',
+                y='Count',
+                markers=True,
+                title="Monthly Donations Over Time"
+            )
+        return fig
+    
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("Donation Status Distribution")
-        status_counts = st.session_state.medicines['status'].value_counts().reset_index()
-        status_counts.columns = ['Status', 'Count']
-        fig = px.pie(
-            status_counts,
-            values='Count',
-            names='Status',
-            color='Status',
-            color_discrete_map={
-                'approved': '#10b981',
-                'pending': '#f59e0b',
-                'rejected': '#ef4444'
-            },
-            hole=0.4
-        )
-        fig.update_traces(textposition='inside', textinfo='percent+label')
-        st.plotly_chart(fig, use_container_width=True)
+        show_chart(cached("analytics.status", version, status_figure))
     
     with col2:
         st.subheader("Donations by Category")
-        category_counts = st.session_state.medicines['category'].value_counts().reset_index()
-        category_counts.columns = ['Category', 'Count']
-        fig = px.bar(
-            category_counts,
-            x='Category',
-            y='Count',
-            color='Category',
-            color_discrete_sequence=px.colors.qualitative.Pastel
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        show_chart(cached("analytics.category", version, category_figure))
     
     st.subheader("Donation Timeline")
-    donations_timeline = st.session_state.medicines.copy()
-    donations_timeline['added_date'] = pd.to_datetime(donations_timeline['added_date'])
-    timeline_data = donations_timeline.groupby(pd.Grouper(key='added_date', freq='M')).size().reset_index()
-    timeline_data.columns = ['Month', 'Count']
-    fig = px.line(
-        timeline_data,
-        x='Month',
-        y='Count',
-        markers=True,
-        title="Monthly Donations Over Time"
-    )
-    st.plotly_chart(fig, use_container_width=True)
+    show_chart(cached("analytics.timeline", version, timeline_figure))
+    
+    with st.expander("🧮 Counter consistency check"):
+        st.caption("Charts read pre-aggregated counters that every write keeps up to date. "
+                   "This recounts the medicines table and repairs any drift.")
+        if st.button("Verify & rebuild counters", key="verify_counters"):
+            drift = service.check_counters()
+            if drift:
+                service.rebuild_counters()
+                st.warning(f"Counters had drifted and were rebuilt: {drift}")
+            else:
+                st.success("All counters match the medicines table")
+
+# ====================
+# 11. PERFORMANCE DASHBOARD
+# ====================
+PERF_KINDS = {"All": None, "Pages": "page", "Rerun steps": "step", "Operations": "op", "Figures": "figure"}
+
+def performance_dashboard():
+    st.markdown(f"""
+    <div class="dashboard-header">
+        <h1 style="color: white;">Performance</h1>
+        <p style="color: rgba(255,255,255,0.8);">Rerun latency in this server process over the last {WINDOW_SLOTS} minutes</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    spans = pd.DataFrame(PERF.snapshot(), columns=["kind", "name", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms", "total_ms"])
+    if spans.empty:
+        st.info("No timings recorded yet")
+        return
+    
+    rerun = spans[spans['kind'] == 'rerun']
+    if not rerun.empty:
+        cols = st.columns(4)
+        for col, column in zip(cols, ["count", "p50_ms", "p95_ms", "p99_ms"]):
+            value = rerun.iloc[0][column]
+            col.metric("Reruns" if column == "count" else f"Rerun {column[:3]}",
+                       f"{value:,}" if column == "count" else f"{value:,.0f} ms")
+    
+    figures = get_figure_cache().stats()
+    st.caption(f"Chart cache: {figures['entries']} figures held · {figures['hits']:,} hits, "
+               f"{figures['misses']:,} builds ({figures['hit_rate']:.0%} hit rate)")
+    
+    kind = PERF_KINDS[st.selectbox("Show", list(PERF_KINDS), key="perf_kind")]
+    shown = spans if kind is None else spans[spans['kind'] == kind]
+    pages = spans[spans['kind'] == 'page']
+    if kind in (None, 'page') and not pages.empty:
+        with span("figure", "performance.pages"):
+            fig = px.bar(
+                pages.melt(id_vars='name', value_vars=['p50_ms', 'p95_ms', 'p99_ms'], var_name='Quantile', value_name='ms'),
+                x='name', y='ms', color='Quantile', barmode='group', title="Page latency"
+            )
+        show_chart(fig)
+    st.dataframe(shown, use_container_width=True, hide_index=True)
+    
+    cols = st.columns(3)
+    with cols[0]:
+        st.download_button("⬇️ Prometheus text", PERF.prometheus_text(), file_name="arogyamitram.prom",
+                           mime="text/plain", key="perf_download_prom")
+    with cols[1]:
+        st.download_button("⬇️ JSON", PERF.to_json(), file_name="arogyamitram-perf.json",
+                           mime="application/json", key="perf_download_json")
+    with cols[2]:
+        if st.button("💾 Export to server file", key="perf_export"):
+            try:
+                st.success(f"Written to {PERF.export()}")
+            except OSError as e:
+                st.error(f"Export failed: {e}")
+    if st.button("🧹 Reset timings", key="perf_reset"):
+        PERF.reset()
+        st.rerun()
 
 # ====================
-# 11. MAIN APPLICATION FLOW
+# 12. MAIN APPLICATION FLOW
 # ====================
+@timed("rerun", "total")
 def main():
-    apply_custom_theme()
-    init_session_state()
+    with span("step", "theme"):
+        apply_custom_theme()
+    with span("step", "init_session_state"):
+        init_session_state()
     
     if not st.session_state.logged_in:
-        show_login()
+        with span("page", "login"):
+            show_login()
         return
     
-    create_sidebar()
+    with span("step", "sidebar"):
+        create_sidebar()
+    # Started with the first session so approvals are matched whichever page made them
+    with span("step", "background_services"):
+        get_service()
+        if not SERVICE_URL:
+            # A remote service runs its own sweeper and delivery worker
+            get_notification_worker()
+        get_perf_exporters()
     
     # Main content area
-    with st.container():
-        if st.session_state.current_page == "impact":
+    page = st.session_state.current_page
+    with st.container(), span("page", page):
+        if page == "impact":
             show_impact_dashboard()
-        elif st.session_state.current_page == "admin":
+        elif page == "admin":
             admin_dashboard()
-        elif st.session_state.current_page == "donate":
+        elif page == "donate":
             donor_dashboard()
-        elif st.session_state.current_page == "find":
+        elif page == "find":
             recipient_dashboard()
-        elif st.session_state.current_page == "analytics":
+        elif page == "expiring":
+            expiring_dashboard()
+        elif page == "import":
+            bulk_import_dashboard()
+        elif page == "analytics":
             analytics_dashboard()
-        elif st.session_state.current_page == "mydonations":
+        elif page == "performance":
+            performance_dashboard()
+        elif page == "mydonations":
             donor_dashboard(show_history=True)
-        elif st.session_state.current_page == "requests":
-            st.markdown('<div class="dashboard-header"><h1>My Requests</h1></div>', unsafe_allow_html=True)
-            st.info("Feature coming soon! Your request history will appear here.")
+        elif page == "requests":
+            requests_dashboard()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,225 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from columnar import ChunkedTable  # noqa: E402
+from duplicate_index import DuplicateIndex  # noqa: E402
+from image_store import ImageStore  # noqa: E402
+from inventory_store import InventoryStore  # noqa: E402
+from page_data import (analytics_frames, donation_record, find_medicine_ids, find_medicines_page,  # noqa: E402
+                       impact_summary, recent_months_frame, recipient_filters, save_upload)
+from schema import LOCATIONS, MEDICINE_COLUMNS, coerce_medicines  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+from synthetic import DEFAULT_SEED, generate_images, generate_medicines, load_store  # noqa: E402
+
+# ====================
+# DATA PATH BENCHMARKS
+# ====================
+# Times what each page does per rerun, headlessly, against a seeded synthetic
+# inventory of each requested size, and prints one JSON document:
+#
+#   python benchmarks/run.py --sizes 1000 10000 100000 --output bench.json
+#   python benchmarks/run.py --sizes 10000 --compare bench.json
+#
+# --compare reports each benchmark's median against an earlier run so a
+# regression between commits shows up as a ratio above 1.
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_REPEAT = 20
+IMAGE_FIXTURES = 8
+REGRESSION_RATIO = 1.2
+
+
+def measure(fn, repeat, setup=None):
+    # Runs fn repeat times (setup untimed before each run); returns per-run milliseconds
+    samples = []
+    for i in range(repeat):
+        arg = setup(i) if setup else None
+        start = time.perf_counter()
+        fn(arg) if setup else fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(name, rows, samples):
+    ordered = sorted(samples)
+    return {
+        "benchmark": name,
+        "rows": rows,
+        "repeat": len(samples),
+        "min_ms": round(ordered[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+    }
+
+
+def bench_size(rows, repeat, seed, workdir, images):
+    today = datetime.date.today()
+    store = InventoryStore(os.path.join(workdir, f"bench_{rows}.db"))
+    results = []
+
+    def record(name, samples):
+        results.append(summarize(name, rows, samples))
+
+    frame = generate_medicines(rows, seed, today)
+    start = time.perf_counter()
+    load_store(store, frame)
+    record("load.insert_many", [(time.perf_counter() - start) * 1000])
+
+    # In-memory views each process builds at start-up
+    def build_table():
+        table = ChunkedTable(MEDICINE_COLUMNS, seal=coerce_medicines)
+        for batch in store.iter_medicines():
+            table.append_frame(batch)
+        return table
+    record("startup.inventory_table", measure(build_table, max(1, repeat // 10)))
+    table = build_table()
+    record("startup.search_index", measure(lambda: SearchIndex().rebuild(table.frame()), max(1, repeat // 10)))
+    index = SearchIndex()
+    index.rebuild(table.frame())
+
+    # admin_dashboard duplicate flags: one photo hash per row, looked up with a few bits flipped
+    rng = random.Random(seed)
+    hashes = [rng.getrandbits(64) for _ in range(rows)]
+    photos = pd.DataFrame({"id": range(rows), "image": [f"img:{i:032x}:{h:016x}" for i, h in enumerate(hashes)],
+                           "status": "pending"})
+
+    def build_duplicates():
+        duplicates = DuplicateIndex()
+        duplicates.rebuild(photos)
+        return duplicates
+    record("startup.duplicate_index", measure(build_duplicates, max(1, repeat // 10)))
+    duplicates = build_duplicates()
+    near_copies = [hashes[i] ^ (1 << (i % 64)) ^ (1 << (i * 7 % 64)) for i in range(min(repeat, rows))]
+    record("images.near_duplicates", measure(duplicates.near, len(near_copies), setup=lambda i: near_copies[i]))
+
+    # recipient_dashboard: filter, count and one page for each sort
+    filters = recipient_filters(today=today)
+    narrow = recipient_filters("Antibiotic", LOCATIONS[0], 30, today=today)
+    for label, f in (("all", filters), ("narrow", narrow)):
+        for sort in ("expiry", "added_date", "quantity"):
+            def find(f=f, sort=sort):
+                total, ranked = find_medicine_ids(store, f, None, sort)
+                find_medicines_page(store, f, ranked, sort, 0, 20)
+            record(f"find.{label}.{sort}", measure(find, repeat))
+    search_ids = lambda: index.search("paracetmol 500", status="approved")  # noqa: E731
+    record("find.search_index", measure(search_ids, repeat))
+
+    def find_relevance():
+        total, ranked = find_medicine_ids(store, filters, search_ids(), "relevance")
+        find_medicines_page(store, filters, ranked, "relevance", 0, 20)
+    record("find.search.relevance", measure(find_relevance, repeat))
+
+    def find_recommended():
+        total, ranked = find_medicine_ids(store, filters, None, "recommended", table=table, origin=LOCATIONS[1], today=today)
+        find_medicines_page(store, filters, ranked, "recommended", 0, 20)
+    record("find.recommended", measure(find_recommended, max(1, repeat // 4)))
+
+    # analytics_dashboard and show_impact_dashboard
+    counters = lambda: [store.counters(kind) for kind in ("status", "category", "month")]  # noqa: E731
+    record("analytics.frames", measure(lambda: analytics_frames(*counters()), repeat))
+    record("impact.summary", measure(lambda: (impact_summary(store), recent_months_frame(store.counters('month'))), repeat))
+
+    # update_medicine_status: one row and a page-sized batch
+    pending = sorted(store.medicine_ids(status="pending"))
+    record("status.update_one", measure(lambda i: store.update_status_many([i], "approved", actor="bench"),
+                                        min(repeat, len(pending)), setup=lambda i: pending[i]))
+    batches = [pending[repeat + i * 100:repeat + (i + 1) * 100] for i in range(max(1, repeat // 4))]
+    batches = [batch for batch in batches if batch]
+    record("status.update_batch100", measure(lambda batch: store.update_status_many(batch, "approved", actor="bench"),
+                                             len(batches), setup=lambda i: batches[i]))
+
+    # donor_dashboard submit: one new donation through the single-row write path
+    user = {"id": "S00000", "name": "Donor 00000", "phone": "919000000000"}
+    expiry = today + datetime.timedelta(days=180)
+    record("donate.insert_one", measure(lambda: store.insert_medicine(donation_record(
+        user, "Paracetamol 500mg", "", 10, expiry, "Pain Relief", 2, LOCATIONS[0], False, ""
+    )), repeat))
+
+    # get_img_from_upload: each fixture is new to the store, so every run encodes
+    image_store = ImageStore(os.path.join(workdir, f"images_{rows}"))
+    record("upload.image", measure(lambda data: save_upload(image_store, data), len(images),
+                                   setup=lambda i: images[i]))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r["benchmark"], r["rows"]): r for r in json.load(f)["results"]}
+    report = []
+    for result in results:
+        before = baseline.get((result["benchmark"], result["rows"]))
+        if before and before["median_ms"] > 0:
+            ratio = result["median_ms"] / before["median_ms"]
+            report.append({"benchmark": result["benchmark"], "rows": result["rows"],
+                           "baseline_ms": before["median_ms"], "median_ms": result["median_ms"],
+                           "ratio": round(ratio, 3), "regression": ratio > REGRESSION_RATIO})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the inventory data paths on synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON output to compare medians against")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="arogya-bench-")
+    images = generate_images(IMAGE_FIXTURES, args.seed)
+    results = []
+    try:
+        for rows in args.sizes:
+            size_results = bench_size(rows, args.repeat, args.seed, workdir, images)
+            results += size_results
+            print(f"{rows:,} rows: {len(size_results)} benchmarks", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.compare:
+        document["comparison"] = compare(results, args.compare)
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if any(r["regression"] for r in document.get("comparison", [])) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import datetime
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schema import CATEGORIES, LOCATIONS  # noqa: E402
+
+# ====================
+# SYNTHETIC INVENTORY
+# ====================
+# Seeded, reproducible medicines tables with roughly the shape of a real
+# college inventory: a long tail of drug names, most stock in the medical
+# room, more pain relief than cardiology, and a status mix that follows
+# the donation lifecycle. The same seed always yields the same rows.
+
+DEFAULT_SEED = 20240501
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+DRUGS = {
+    "Pain Relief": ["Paracetamol", "Ibuprofen", "Diclofenac", "Aspirin", "Naproxen", "Aceclofenac"],
+    "Antibiotic": ["Amoxicillin", "Azithromycin", "Ciprofloxacin", "Doxycycline", "Cefixime", "Metronidazole"],
+    "Chronic Disease": ["Metformin", "Levothyroxine", "Glimepiride", "Montelukast", "Pantoprazole"],
+    "Cardiovascular": ["Atorvastatin", "Amlodipine", "Losartan", "Telmisartan", "Clopidogrel"],
+    "Vitamins": ["Vitamin D3", "Vitamin B12", "Folic Acid", "Calcium", "Zinc", "Multivitamin"],
+    "Other": ["Cetirizine", "Ondansetron", "ORS", "Loperamide", "Ranitidine", "Domperidone"],
+}
+STRENGTHS = ["5mg", "10mg", "20mg", "40mg", "250mg", "400mg", "500mg", "650mg", "1000 IU"]
+
+CATEGORY_WEIGHTS = [0.30, 0.18, 0.15, 0.10, 0.17, 0.10]
+# The medical room collects most donations; hostels and the faculty block the rest
+LOCATION_WEIGHTS = [0.55, 0.18, 0.17, 0.10]
+STATUS_WEIGHTS = {"approved": 0.55, "pending": 0.12, "rejected": 0.05, "fulfilled": 0.18, "expired": 0.10}
+
+
+def _weights(weights, size):
+    # Pads or trims a weight list to size (custom location registries) and normalizes it
+    weights = np.resize(np.asarray(weights, dtype=float), size)
+    return weights / weights.sum()
+
+
+def generate_medicines(rows, seed=DEFAULT_SEED, today=None, donors=None):
+    # Returns a DataFrame of new donation rows (no ids) ready for insert_many
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp(today or datetime.date.today())
+    donors = donors or max(10, min(rows // 20, 5_000))
+
+    category = rng.choice(len(CATEGORIES), rows, p=_weights(CATEGORY_WEIGHTS, len(CATEGORIES)))
+    names = np.empty(rows, dtype=object)
+    for i, cat in enumerate(CATEGORIES):
+        picked = category == i
+        drugs = np.array(DRUGS.get(cat, DRUGS["Other"]), dtype=object)
+        names[picked] = (drugs[rng.integers(0, len(drugs), picked.sum())] + " "
+                         + np.array(STRENGTHS, dtype=object)[rng.integers(0, len(STRENGTHS), picked.sum())])
+
+    statuses = list(STATUS_WEIGHTS)
+    status = np.array(statuses, dtype=object)[rng.choice(len(statuses), rows, p=list(STATUS_WEIGHTS.values()))]
+    # Donations over the last two years, more of them recently
+    added = today - pd.to_timedelta((rng.beta(1.2, 2.5, rows) * 730).astype(int), unit="D")
+    # Stock still listed expires in the future; expired stock is past its date
+    shelf_days = rng.gamma(2.0, 150, rows).astype(int) + 1
+    expiry = today + pd.to_timedelta(shelf_days, unit="D")
+    expired = status == "expired"
+    expiry = expiry.where(~expired, today - pd.to_timedelta(rng.integers(1, 365, rows), unit="D"))
+
+    quantity = np.clip(rng.lognormal(2.7, 0.8, rows).astype(int), 1, 500)
+    donor = rng.integers(0, donors, rows)
+    return pd.DataFrame({
+        "name": names,
+        "description": "Synthetic donation",
+        "quantity": quantity,
+        "expiry": expiry.strftime("%Y-%m-%d"),
+        "donor": pd.Series(donor).map(lambda d: f"Donor {d:05d}"),
+        "donor_id": pd.Series(donor).map(lambda d: f"S{d:05d}"),
+        "donor_contact": pd.Series(donor).map(lambda d: f"91{9000000000 + d}"),
+        "location": np.array(LOCATIONS, dtype=object)[
+            rng.choice(len(LOCATIONS), rows, p=_weights(LOCATION_WEIGHTS, len(LOCATIONS)))],
+        "status": status,
+        "category": np.array(CATEGORIES, dtype=object)[category],
+        "image": "",
+        "value": np.clip(rng.lognormal(1.5, 0.9, rows).astype(int), 1, 500),
+        "added_date": added.strftime("%Y-%m-%d"),
+        "prescription": rng.random(rows) < 0.3,
+    })
+
+
+def generate_images(count, seed=DEFAULT_SEED, size=(1600, 1200), fmt="JPEG"):
+    # Photo-sized fixtures for the upload path: a gradient, a few "strips"
+    # and some noise, so each image is distinct and compresses like a photo
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        base = np.linspace(0, 255, size[0], dtype=np.float32)[None, :, None] * rng.random(3)
+        pixels = np.clip(base + rng.normal(0, 18, (size[1], size[0], 3)), 0, 255).astype(np.uint8)
+        image = Image.fromarray(pixels)
+        draw = ImageDraw.Draw(image)
+        for _ in range(rng.integers(2, 6)):
+            x, y = rng.integers(0, size[0] // 2), rng.integers(0, size[1] // 2)
+            draw.rectangle([x, y, x + size[0] // 3, y + size[1] // 6], fill=tuple(int(c) for c in rng.integers(0, 255, 3)))
+        buffer = io.BytesIO()
+        image.save(buffer, fmt, quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def load_store(store, frame, batch_rows=20_000):
+    # Inserts the frame through the normal write path, a batch per transaction
+    ids = []
+    records = frame.to_dict("records")
+    for start in range(0, len(records), batch_rows):
+        ids += store.insert_many(records[start:start + batch_rows])
+    return ids
+
+
+if __name__ == "__main__":
+    # python benchmarks/synthetic.py ROWS OUT.csv [SEED]
+    rows, out = int(sys.argv[1]), sys.argv[2]
+    generate_medicines(rows, int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_SEED).to_csv(out, index=False)
@@ -0,0 +1,127 @@
+import datetime
+import os
+
+import pandas as pd
+
+from schema import CATEGORIES, INT32_RANGE, LOCATIONS, check_medicines
+
+# ====================
+# BULK DONATION IMPORT
+# ====================
+# Streams an uploaded CSV/XLSX in fixed-size chunks, validates each chunk with
+# vectorized pandas checks and inserts the valid rows in one batch per chunk;
+# the service then runs each batch through the schema validation layer.
+
+CHUNK_ROWS = 10_000
+REQUIRED_COLUMNS = ["name", "quantity", "expiry", "category", "location", "value"]
+OPTIONAL_COLUMNS = ["description", "prescription", "donor", "donor_contact"]
+TRUE_VALUES = {"true", "yes", "y", "1"}
+
+
+def read_chunks(uploaded_file, chunk_rows=CHUNK_ROWS):
+    # Yields string-typed DataFrames of at most chunk_rows rows
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    if extension == ".csv":
+        yield from pd.read_csv(uploaded_file, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+        return
+    if extension != ".xlsx":
+        raise ValueError(f"Unsupported file type {extension!r}; upload a .csv or .xlsx file")
+
+    from openpyxl import load_workbook
+    sheet = load_workbook(uploaded_file, read_only=True, data_only=True).active
+    rows = sheet.iter_rows(values_only=True)
+    header = [str(h).strip() if h is not None else "" for h in next(rows, [])]
+    batch = []
+    for row in rows:
+        batch.append(["" if v is None else v for v in row])
+        if len(batch) == chunk_rows:
+            yield pd.DataFrame(batch, columns=header)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, columns=header)
+
+
+def validate_chunk(chunk, first_row, today=None):
+    # Returns (valid_rows, errors); errors has one row per rejected input line
+    today = today or datetime.date.today()
+    chunk = chunk.rename(columns=lambda c: str(c).strip().lower())
+    missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    for column in OPTIONAL_COLUMNS:
+        if column not in chunk.columns:
+            chunk[column] = ""
+
+    text = {c: chunk[c].astype(str).str.strip() for c in REQUIRED_COLUMNS + OPTIONAL_COLUMNS}
+    quantity = pd.to_numeric(text["quantity"], errors="coerce")
+    value = pd.to_numeric(text["value"], errors="coerce")
+    expiry = pd.to_datetime(text["expiry"], errors="coerce", format="ISO8601")
+
+    errors = pd.Series("", index=chunk.index)
+    checks = [
+        (text["name"] == "", "name is required"),
+        (quantity.isna() | (quantity <= 0) | (quantity % 1 != 0), "quantity must be a positive whole number"),
+        (quantity > INT32_RANGE[1], f"quantity must be at most {INT32_RANGE[1]:,}"),
+        (value.isna() | (value <= 0), "value must be positive"),
+        (value.round() > INT32_RANGE[1], f"value must be at most {INT32_RANGE[1]:,}"),
+        (expiry.isna(), "expiry is not a valid YYYY-MM-DD date"),
+        (expiry.notna() & (expiry.dt.date <= today), "expiry must be in the future"),
+        (~text["category"].isin(CATEGORIES), "category is not one of the allowed categories"),
+        (~text["location"].isin(LOCATIONS), "location is not one of the allowed locations"),
+    ]
+    for failed, message in checks:
+        errors[failed] += message + "; "
+
+    ok = errors == ""
+    valid = pd.DataFrame({
+        "name": text["name"][ok],
+        "description": text["description"][ok],
+        "quantity": quantity[ok].astype(int),
+        "expiry": expiry[ok].dt.strftime("%Y-%m-%d"),
+        "category": text["category"][ok],
+        "location": text["location"][ok],
+        "value": value[ok].round().astype(int).clip(lower=1),
+        "prescription": text["prescription"][ok].str.lower().isin(TRUE_VALUES),
+        "donor": text["donor"][ok],
+        "donor_contact": text["donor_contact"][ok],
+    })
+    # CSV/XLSX line numbers: +1 for the header, +1 because lines count from 1
+    valid.index = chunk.index[ok] - chunk.index[0] + first_row + 2
+    report = pd.DataFrame({
+        "row": chunk.index[~ok] - chunk.index[0] + first_row + 2,
+        "name": text["name"][~ok].values,
+        "errors": errors[~ok].str.rstrip("; ").values,
+    })
+    return valid, report
+
+
+def import_donations(service, uploaded_file, status, donor, donor_contact, dry_run=False, chunk_rows=CHUNK_ROWS):
+    # Returns (imported_ids, error_report)
+    today = datetime.date.today()
+    imported, reports, seen = [], [], 0
+    for chunk in read_chunks(uploaded_file, chunk_rows):
+        valid, report = validate_chunk(chunk, seen, today)
+        seen += len(chunk)
+        reports.append(report)
+        if dry_run or valid.empty:
+            continue
+        valid["donor"] = valid["donor"].mask(valid["donor"] == "", donor)
+        valid["donor_contact"] = valid["donor_contact"].mask(valid["donor_contact"] == "", donor_contact)
+        valid["donor_id"] = ""
+        valid["status"] = status
+        valid["image"] = ""
+        valid["added_date"] = today.strftime("%Y-%m-%d")
+        # Anything the store's schema would still refuse is reported here, by
+        # line, instead of failing the chunk after earlier chunks were written
+        problems = check_medicines(valid)
+        refused = problems != ""
+        if refused.any():
+            reports.append(pd.DataFrame({"row": valid.index[refused], "name": valid["name"][refused].values,
+                                         "errors": problems[refused].values}))
+            valid = valid[~refused]
+        if not valid.empty:
+            imported += service.submit_donations(valid.to_dict("records"))
+    report = pd.DataFrame(columns=["row", "name", "errors"])
+    if reports:
+        report = pd.concat(reports, ignore_index=True).sort_values("row", kind="stable", ignore_index=True)
+    return imported, report
@@ -0,0 +1,109 @@
+import threading
+
+import pandas as pd
+
+# ====================
+# CHUNKED COLUMNAR TABLE
+# ====================
+# Append-optimized in-memory table: sealed fixed-size DataFrame chunks plus
+# one open row buffer. Appends land in the buffer and are sealed into a
+# columnar chunk once it fills, so inserts are amortized O(1) instead of
+# copying the whole table. The consolidated frame is only rebuilt lazily,
+# once per batch of writes, when something reads it.
+
+CHUNK_ROWS = 8192
+
+
+class ChunkedTable:
+    def __init__(self, columns, key="id", chunk_rows=CHUNK_ROWS, seal=None):
+        self.columns = list(columns)
+        self.key = key
+        self.chunk_rows = chunk_rows
+        self._seal_frame = seal or (lambda frame: frame)
+        self._chunks = []
+        self._buffer = []
+        self._positions = {}  # key -> (chunk index, row offset); chunk index None means the buffer
+        self._view = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def upsert(self, rows):
+        # New keys are appended to the buffer; known keys are overwritten in place
+        with self._lock:
+            for row in rows:
+                values = [row.get(c) for c in self.columns]
+                position = self._positions.get(row[self.key])
+                if position is None:
+                    self._positions[row[self.key]] = (None, len(self._buffer))
+                    self._buffer.append(values)
+                    if len(self._buffer) >= self.chunk_rows:
+                        self._seal()
+                elif position[0] is None:
+                    self._buffer[position[1]] = values
+                else:
+                    chunk = self._chunks[position[0]]
+                    for column, value in zip(self.columns, values):
+                        self._set(chunk, position[1], column, value)
+            self._view = None
+
+    @staticmethod
+    def _set(chunk, offset, column, value):
+        # Sealed chunks keep their dtypes; a categorical column learns new
+        # values instead of falling back to object
+        try:
+            chunk.at[offset, column] = value
+        except TypeError:
+            if not isinstance(chunk[column].dtype, pd.CategoricalDtype):
+                raise
+            chunk[column] = chunk[column].cat.add_categories([value])
+            chunk.at[offset, column] = value
+
+    def append_frame(self, frame):
+        # Bulk load: rows whose key is already present are skipped, so a load
+        # racing with live upserts never overwrites a newer version
+        with self._lock:
+            fresh = frame[~frame[self.key].isin(self._positions.keys())]
+            for start in range(0, len(fresh), self.chunk_rows):
+                self._add_chunk(fresh.iloc[start:start + self.chunk_rows][self.columns])
+            self._view = None
+
+    def _seal(self):
+        self._add_chunk(pd.DataFrame(self._buffer, columns=self.columns))
+        self._buffer = []
+
+    def _add_chunk(self, frame):
+        chunk = self._seal_frame(frame.reset_index(drop=True))
+        index = len(self._chunks)
+        self._chunks.append(chunk)
+        self._positions.update((key, (index, offset)) for offset, key in enumerate(chunk[self.key]))
+
+    def frame(self):
+        # Every row, chunks first and then the open buffer, merged once per write batch
+        with self._lock:
+            if self._view is None:
+                parts = list(self._chunks)
+                if self._buffer:
+                    parts.append(self._seal_frame(pd.DataFrame(self._buffer, columns=self.columns)))
+                self._view = self._concat(parts)
+            return self._view
+
+    def select(self, predicate):
+        # Filters chunk by chunk, so only matching rows are ever concatenated
+        with self._lock:
+            parts = list(self._chunks)
+            if self._buffer:
+                parts.append(self._seal_frame(pd.DataFrame(self._buffer, columns=self.columns)))
+            matches = [part[predicate(part)] for part in parts]
+        return self._concat(matches)
+
+    def _concat(self, parts):
+        # Chunks sealed with different category sets concatenate to object
+        # columns, so the merged frame goes through the seal hook once more
+        if not parts:
+            return self._seal_frame(pd.DataFrame(columns=self.columns))
+        return self._seal_frame(pd.concat(parts, ignore_index=True))
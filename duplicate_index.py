@@ -0,0 +1,121 @@
+import itertools
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from image_store import ref_hash
+
+# ====================
+# NEAR-DUPLICATE IMAGE INDEX
+# ====================
+# Multi-index hashing over the 64-bit perceptual hashes carried in image
+# references. Each hash is split into four 16-bit segments, each with its own
+# table. Two hashes within distance d must agree to within d // 4 bits on at
+# least one segment (pigeonhole), so a lookup probes a few dozen buckets per
+# segment and checks only the ids found there, however many images are stored.
+
+HASH_BITS = 64
+SEGMENTS = 4
+SEGMENT_BITS = HASH_BITS // SEGMENTS
+SEGMENT_MASK = (1 << SEGMENT_BITS) - 1
+# Bits out of 64 two photos may differ by and still count as the same strip
+DUPLICATE_DISTANCE = 6
+# Listings a new photo is never flagged against
+IGNORED_STATUSES = ("rejected",)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+@lru_cache(maxsize=None)
+def _probes(radius):
+    # Every 16-bit mask with at most radius bits set
+    masks = [0]
+    for bits in range(1, radius + 1):
+        for positions in itertools.combinations(range(SEGMENT_BITS), bits):
+            masks.append(sum(1 << p for p in positions))
+    return tuple(masks)
+
+
+def _segments(value):
+    return [(value >> (i * SEGMENT_BITS)) & SEGMENT_MASK for i in range(SEGMENTS)]
+
+
+class DuplicateIndex:
+    def __init__(self):
+        self._tables = [defaultdict(set) for _ in range(SEGMENTS)]  # segment value -> med ids
+        self._hashes = {}                                            # med_id -> hash
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def upsert(self, med):
+        med_id, value = int(med["id"]), ref_hash(med.get("image"))
+        with self._lock:
+            self._remove(med_id)
+            if value is None or med.get("status") in IGNORED_STATUSES:
+                return
+            for table, segment in zip(self._tables, _segments(value)):
+                table[segment].add(med_id)
+            self._hashes[med_id] = value
+
+    def remove(self, med_id):
+        with self._lock:
+            self._remove(int(med_id))
+
+    def _remove(self, med_id):
+        value = self._hashes.pop(med_id, None)
+        if value is None:
+            return
+        for table, segment in zip(self._tables, _segments(value)):
+            bucket = table.get(segment)
+            if bucket is not None:
+                bucket.discard(med_id)
+                if not bucket:
+                    del table[segment]
+
+    def rebuild(self, medicines):
+        with self._lock:
+            for table in self._tables:
+                table.clear()
+            self._hashes.clear()
+            for med_id, ref, status in zip(medicines["id"].tolist(), medicines["image"].tolist(),
+                                           medicines["status"].tolist()):
+                value = ref_hash(ref)
+                if value is not None and status not in IGNORED_STATUSES:
+                    self._hashes[med_id] = value
+            for i, table in enumerate(self._tables):
+                shift = i * SEGMENT_BITS
+                for med_id, value in self._hashes.items():
+                    table[(value >> shift) & SEGMENT_MASK].add(med_id)
+
+    def apply_changes(self, medicines):
+        # Store listener: called with the rows touched by each committed write
+        for med in medicines:
+            self.upsert(med)
+
+    def near(self, value, distance=DUPLICATE_DISTANCE, limit=None):
+        # [(distance, med_id)] for every stored hash within distance, closest first
+        probes = _probes(distance // SEGMENTS)
+        found = {}
+        with self._lock:
+            for table, segment in zip(self._tables, _segments(value)):
+                for mask in probes:
+                    for med_id in table.get(segment ^ mask, ()):
+                        if med_id not in found:
+                            found[med_id] = hamming(value, self._hashes[med_id])
+        matches = sorted((d, med_id) for med_id, d in found.items() if d <= distance)
+        return matches[:limit]
+
+    def duplicates_of(self, med_id, distance=DUPLICATE_DISTANCE, limit=None):
+        # Earlier listings (ids come from one rising sequence) whose photo is
+        # within distance of this one's, so an original is never flagged as a
+        # copy of its own later duplicate
+        with self._lock:
+            value = self._hashes.get(int(med_id))
+        if value is None:
+            return []
+        matches = [m for m in self.near(value, distance) if m[1] < int(med_id)]
+        return matches[:limit]
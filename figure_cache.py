@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+# ====================
+# FIGURE CACHE
+# ====================
+# Built chart figures (and the aggregates behind them) shared by every
+# session in the process. Keys are (chart id, stats version, theme): the
+# stats version only moves when a write touches the counters or impact
+# rollups the charts are drawn from, so a repeat view of an unchanged
+# dashboard reuses the figure instead of aggregating and rebuilding it.
+# Entries from older versions are dropped as soon as a newer one is stored,
+# and the whole cache is bounded by least-recently-used eviction.
+
+FIGURE_CACHE_ENTRIES = 64
+
+
+class FigureCache:
+    def __init__(self, max_entries=FIGURE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, chart_id, version, theme, build):
+        # Built outside the lock: two sessions missing together both build, and the later one is kept
+        key = (chart_id, version, theme)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = build()
+        with self._lock:
+            for stale in [k for k in self._entries if k[0] == chart_id and k[1] < version]:
+                del self._entries[stale]
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,111 @@
+import hashlib
+import io
+import os
+import threading
+
+from PIL import Image, ImageOps, features
+
+# ====================
+# CONTENT-ADDRESSED IMAGE STORE
+# ====================
+# Uploaded photos are downsized once into a few fixed renditions and written
+# to disk under their content hash. Medicine rows only keep the short
+# "img:<hash>" reference, so pages ship small thumbnails instead of
+# full-resolution base64 payloads. The reference also carries a 64-bit
+# perceptual hash of the photo ("img:<hash>:<dhash>"), so re-photographed
+# or re-encoded copies of one strip can be found without opening any file.
+
+DEFAULT_IMAGE_DIR = os.environ.get(
+    "AROGYA_IMAGE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "images")
+)
+
+PLACEHOLDER_IMAGE = "https://via.placeholder.com/150?text=Medicine"
+REF_PREFIX = "img:"
+
+# dHash compares each pixel of a 9x8 grayscale thumbnail with its right-hand
+# neighbour: 64 bits that survive re-encoding, resizing and small crops
+HASH_WIDTH, HASH_HEIGHT = 9, 8
+
+# Longest edge in pixels for every rendition that is kept on disk
+THUMBNAIL_SIZES = {"thumb": 160, "card": 400, "full": 1600}
+
+if features.check("webp"):
+    IMAGE_FORMAT, IMAGE_EXT = "WEBP", "webp"
+    SAVE_OPTIONS = {"quality": 80, "method": 4}
+else:
+    IMAGE_FORMAT, IMAGE_EXT = "JPEG", "jpg"
+    SAVE_OPTIONS = {"quality": 85, "optimize": True, "progressive": True}
+
+
+def is_image_ref(value):
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+
+def dhash(image):
+    small = image.convert("L").resize((HASH_WIDTH, HASH_HEIGHT), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_HEIGHT):
+        for col in range(HASH_WIDTH - 1):
+            left = pixels[row * HASH_WIDTH + col]
+            value = (value << 1) | (left > pixels[row * HASH_WIDTH + col + 1])
+    return value
+
+
+def perceptual_hash(data):
+    image = Image.open(io.BytesIO(data))
+    # JPEGs decode straight at a fraction of their size; only 9x8 pixels are needed
+    image.draft("L", (HASH_WIDTH * 16, HASH_HEIGHT * 16))
+    return dhash(ImageOps.exif_transpose(image))
+
+
+def ref_hash(ref):
+    # The perceptual hash in a reference, or None for references made before hashes were kept
+    if not is_image_ref(ref):
+        return None
+    parts = ref[len(REF_PREFIX):].split(":")
+    return int(parts[1], 16) if len(parts) == 2 else None
+
+
+def _digest(ref):
+    return ref[len(REF_PREFIX):].split(":")[0]
+
+
+class ImageStore:
+    def __init__(self, root=DEFAULT_IMAGE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest, size):
+        return os.path.join(self.root, digest[:2], f"{digest}_{size}.{IMAGE_EXT}")
+
+    def save(self, data):
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        ref = f"{REF_PREFIX}{digest}:{perceptual_hash(data):016x}"
+        if all(os.path.exists(self._path(digest, size)) for size in THUMBNAIL_SIZES):
+            return ref
+
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        mode = "RGBA" if has_alpha and IMAGE_FORMAT == "WEBP" else "RGB"
+        if image.mode != mode:
+            image = image.convert(mode)
+
+        os.makedirs(os.path.join(self.root, digest[:2]), exist_ok=True)
+        for size, edge in THUMBNAIL_SIZES.items():
+            rendition = image.copy()
+            rendition.thumbnail((edge, edge), Image.LANCZOS)
+            path = self._path(digest, size)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            rendition.save(tmp_path, format=IMAGE_FORMAT, **SAVE_OPTIONS)
+            os.replace(tmp_path, path)
+        return ref
+
+    def resolve(self, ref, size="card"):
+        # Anything that is not a stored reference (seed URLs, legacy data URIs)
+        # is passed through unchanged.
+        if not is_image_ref(ref):
+            return ref or PLACEHOLDER_IMAGE
+        path = self._path(_digest(ref), size)
+        return path if os.path.exists(path) else PLACEHOLDER_IMAGE
@@ -0,0 +1,490 @@
+import base64
+import binascii
+import io
+import json
+from dataclasses import dataclass, field, fields
+
+import pandas as pd
+
+from columnar import ChunkedTable
+from duplicate_index import DuplicateIndex
+from inventory_store import SORT_KEYSETS, SORT_ORDERS, ChangeFeed
+from matching import MatchingEngine
+from page_data import find_medicine_ids, find_medicines_page, impact_summary, recipient_filters
+from schema import MEDICINE_COLUMNS, coerce_medicines, format_date
+from search_index import SearchIndex
+
+# ====================
+# INVENTORY SERVICE
+# ====================
+# The application's operations as one typed API: every call takes plain
+# values and returns the dataclasses below, never DataFrames or sqlite rows.
+# The Streamlit app, the HTTP API in service_api.py and its client all speak
+# this interface, so pages work the same against an in-process service or a
+# remote one. Lists are paged with opaque cursors that continue after the
+# last row returned (keyset pages on the store's sort indexes); offsets are
+# still accepted for page-number navigation.
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 1000
+RANKED_SORTS = ("relevance", "recommended")
+# Listing filters accepted by list_medicines, count and ids calls
+MEDICINE_FILTERS = ("status", "donor", "donor_id", "category", "location", "expires_from", "expires_to", "available")
+# What grids show unless asked for more; image references only come with an expanded row
+GRID_COLUMNS = ["id", "name", "quantity", "available_quantity", "expiry", "status", "category", "location",
+                "donor", "donor_contact", "value", "added_date", "prescription"]
+EXPORT_BATCH = 10_000
+# Closest earlier listings shown against each flagged donation
+DUPLICATE_MATCHES = 3
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+@dataclass
+class Medicine:
+    id: int
+    name: str
+    description: str
+    quantity: int
+    available_quantity: int
+    expiry: str
+    donor: str
+    donor_id: str
+    donor_contact: str
+    location: str
+    status: str
+    category: str
+    image: str
+    value: int
+    added_date: str
+    prescription: bool
+    promised_quantity: int = 0
+    version: int = 0
+
+    @classmethod
+    def from_row(cls, row):
+        # Rows come from typed frames (Timestamps, numpy ints, NaN categories) or JSON
+        def text(key):
+            value = row.get(key)
+            return "" if value is None or value != value else str(value)
+        return cls(
+            id=int(row["id"]), name=text("name"), description=text("description"),
+            quantity=int(row["quantity"]), available_quantity=int(row["available_quantity"]),
+            expiry=format_date(row.get("expiry"), ""), donor=text("donor"), donor_id=text("donor_id"),
+            donor_contact=text("donor_contact"), location=text("location"), status=text("status"),
+            category=text("category"), image=text("image"), value=int(row.get("value") or 0),
+            added_date=format_date(row.get("added_date"), ""), prescription=bool(row.get("prescription")),
+            promised_quantity=int(row.get("promised_quantity") or 0), version=int(row.get("version") or 0),
+        )
+
+
+@dataclass
+class RequestMatch:
+    id: int
+    name: str
+    matched: int
+    location: str
+    expiry: str
+    donor: str
+    donor_contact: str
+    status: str
+    promised_until: str = ""
+
+
+@dataclass
+class ImageDuplicate:
+    # An earlier listing whose photo is within the duplicate distance of medicine_id's
+    medicine_id: int
+    id: int
+    distance: int
+    name: str
+    donor: str
+    status: str
+    added_date: str
+
+
+@dataclass
+class MedicineRequest:
+    id: int
+    recipient_id: str
+    recipient: str
+    contact: str
+    drug: str
+    category: str
+    location: str
+    quantity: int
+    matched_quantity: int
+    urgency: str
+    status: str
+    created_at: str
+    matches: list = field(default_factory=list)
+
+
+@dataclass
+class Reservation:
+    id: int
+    medicine_id: int
+    request_id: int
+    recipient_id: str
+    recipient: str
+    quantity: int
+    status: str
+    created_at: str
+    expires_at: str
+    closed_at: str
+    closed_by: str
+    name: str
+    location: str
+    donor: str
+    donor_contact: str
+
+
+@dataclass
+class Page:
+    items: list
+    total: int
+    next_cursor: str = None
+
+
+@dataclass
+class FindQuery:
+    search: str = ""
+    category: str = None
+    location: str = None
+    expiring_days: int = None
+    sort: str = "expiry"
+    origin: str = None
+    limit: int = DEFAULT_LIMIT
+    cursor: str = None
+    offset: int = 0
+
+
+@dataclass
+class ImpactSummary:
+    total_medicines: int
+    total_value: int
+    waste_prevented: int
+    lives_impacted: int
+    units_handed_over: int
+    student_savings: int
+
+
+@dataclass
+class Analytics:
+    status: dict
+    category: dict
+    month: dict
+
+
+@dataclass
+class RequestSubmitted:
+    request_id: int
+    matched_units: int
+
+
+@dataclass
+class Outbox:
+    summary: dict
+    items: list
+
+
+def build(cls, data):
+    # Dataclass from a JSON object, ignoring keys this version does not know
+    names = {f.name for f in fields(cls)}
+    return cls(**{k: v for k, v in data.items() if k in names})
+
+
+# ---- cursors ----
+def encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise InvalidCursor("Malformed cursor")
+    if not isinstance(state, dict) or state.get("sort") != sort:
+        raise InvalidCursor("Cursor does not belong to this listing; start again without it")
+    return state
+
+
+def _keyset_value(medicine, sort):
+    column = SORT_KEYSETS[sort][0]
+    return None if column is None else getattr(medicine, column)
+
+
+def _plain(value):
+    # One frame cell as a JSON value: dates as YYYY-MM-DD, numpy scalars unwrapped, missing as None
+    if value is None or value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, float) and value != value:
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def _columns(columns):
+    # A list, or comma-separated text from a query string
+    if columns is None:
+        return list(GRID_COLUMNS)
+    if isinstance(columns, str):
+        columns = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in columns if c not in MEDICINE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+    if not columns:
+        raise ValueError("Select at least one medicine column")
+    return list(dict.fromkeys(columns))
+
+
+def _limit(limit):
+    return max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+
+
+def _records(frame):
+    # DataFrame -> JSON-ready row dicts (dates as text, no numpy scalars)
+    return json.loads(frame.to_json(orient="records", date_format="iso"))
+
+
+class InventoryService:
+    def __init__(self, store, search_index=None, table=None, matching=None, duplicates=None):
+        self.store = store
+        self.search_index = search_index
+        self.table = table
+        self.matching = matching
+        self.duplicates = duplicates
+
+    # ---- medicines ----
+    def find_medicines(self, query):
+        # The recipient listing: approved, unexpired stock with units left
+        sort = query.sort
+        if sort not in SORT_ORDERS and sort not in RANKED_SORTS:
+            raise ValueError(f"Unknown sort {sort!r}")
+        filters = recipient_filters(query.category or None, query.location or None,
+                                    None if query.expiring_days is None else int(query.expiring_days))
+        ranked_ids = self.search_index.search(query.search, status='approved') if query.search else None
+        if sort == "relevance" and ranked_ids is None:
+            sort = "expiry"
+        limit = _limit(query.limit)
+        if sort in RANKED_SORTS:
+            total, ranked_ids = find_medicine_ids(self.store, filters, ranked_ids, sort, table=self.table,
+                                                  origin=query.origin)
+            offset = decode_cursor(query.cursor, sort)["offset"] if query.cursor else int(query.offset or 0)
+            frame = find_medicines_page(self.store, filters, ranked_ids, sort, offset, limit)
+            items = [Medicine.from_row(row) for row in frame.to_dict("records")]
+            more = offset + limit < total
+            return Page(items, total, encode_cursor({"sort": sort, "offset": offset + limit}) if more else None)
+        total = self.store.count_medicines(ids=ranked_ids, **filters)
+        return self._medicines_page(sort, limit, query.cursor, query.offset, total, ids=ranked_ids, **filters)
+
+    def list_medicines(self, sort="id", limit=DEFAULT_LIMIT, cursor=None, offset=0, **filters):
+        # Any listing of the medicines table (admin queue, donor history, expiring stock)
+        if sort not in SORT_ORDERS:
+            raise ValueError(f"Unknown sort {sort!r}")
+        filters = self._filters(filters)
+        return self._medicines_page(sort, _limit(limit), cursor, offset, self.store.count_medicines(**filters), **filters)
+
+    def _medicines_page(self, sort, limit, cursor, offset, total, **filters):
+        after = None
+        if cursor:
+            after = decode_cursor(cursor, sort)["after"]
+            offset = 0
+        # One extra row says whether another page follows
+        frame = self.store.list_medicines(sort=sort, limit=limit + 1, offset=int(offset or 0), after=after, **filters)
+        items = [Medicine.from_row(row) for row in frame.to_dict("records")]
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor({"sort": sort, "after": [_keyset_value(items[-1], sort), items[-1].id]})
+        return Page(items, total, next_cursor)
+
+    def medicine_rows(self, columns=None, sort="id", limit=DEFAULT_LIMIT, cursor=None, offset=0, **filters):
+        # Grid pages: only the requested columns are read and returned
+        if sort not in SORT_ORDERS:
+            raise ValueError(f"Unknown sort {sort!r}")
+        columns, filters, limit = _columns(columns), self._filters(filters), _limit(limit)
+        after = None
+        if cursor:
+            after = decode_cursor(cursor, sort)["after"]
+            offset = 0
+        keyset = self._keyset_columns(columns, sort)
+        frame = self.store.list_medicines(sort=sort, limit=limit + 1, offset=int(offset or 0), after=after,
+                                          columns=keyset, **filters)
+        rows = [{c: _plain(v) for c, v in row.items()} for row in frame.to_dict("records")]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            column = SORT_KEYSETS[sort][0]
+            next_cursor = encode_cursor({"sort": sort, "after": [rows[-1][column] if column else None, rows[-1]["id"]]})
+        items = [{c: row[c] for c in columns} for row in rows]
+        return Page(items, self.store.count_medicines(**filters), next_cursor)
+
+    def export_medicines_csv(self, columns=None, sort="id", **filters):
+        # Every row matching the filters, read a keyset batch at a time
+        if sort not in SORT_ORDERS:
+            raise ValueError(f"Unknown sort {sort!r}")
+        columns, filters = _columns(columns), self._filters(filters)
+        keyset, column = self._keyset_columns(columns, sort), SORT_KEYSETS[sort][0]
+        out, after = io.StringIO(), None
+        while True:
+            frame = self.store.list_medicines(sort=sort, limit=EXPORT_BATCH, after=after, columns=keyset, **filters)
+            if frame.empty and after is not None:
+                break
+            frame[columns].to_csv(out, header=after is None, index=False, date_format="%Y-%m-%d")
+            if len(frame) < EXPORT_BATCH:
+                break
+            last = frame.iloc[-1]
+            after = [_plain(last[column]) if column else None, int(last["id"])]
+        return out.getvalue()
+
+    @staticmethod
+    def _keyset_columns(columns, sort):
+        # The page's columns plus what its cursor is made of
+        column = SORT_KEYSETS[sort][0]
+        return list(dict.fromkeys(["id"] + columns + ([column] if column else [])))
+
+    @staticmethod
+    def _filters(filters):
+        unknown = set(filters) - set(MEDICINE_FILTERS)
+        if unknown:
+            raise ValueError(f"Unknown filter(s): {', '.join(sorted(unknown))}")
+        return {k: v for k, v in filters.items() if v is not None and v != ""}
+
+    def medicine_ids(self, **filters):
+        return sorted(self.store.medicine_ids(**self._filters(filters)))
+
+    def count_medicines(self, **filters):
+        return self.store.count_medicines(**self._filters(filters))
+
+    def get_medicines(self, ids):
+        rows = {row["id"]: row for row in self.store.get_medicines(ids)}
+        return [Medicine.from_row(rows[int(i)]) for i in ids if int(i) in rows]
+
+    def near_duplicates(self, ids, limit=DUPLICATE_MATCHES):
+        # Earlier, not rejected listings whose photo looks like each given medicine's, closest first
+        if self.duplicates is None:
+            return []
+        found = [(int(med_id), d, other) for med_id in ids
+                 for d, other in self.duplicates.duplicates_of(med_id, limit=limit)]
+        rows = {row["id"]: row for row in self.store.get_medicines(sorted({other for _, _, other in found}))}
+        return [ImageDuplicate(med_id, other, d, rows[other]["name"], rows[other]["donor"], rows[other]["status"],
+                               format_date(rows[other]["added_date"], ""))
+                for med_id, d, other in found if other in rows]
+
+    def options(self, column, status=None):
+        return self.store.distinct_values(column, status=status)
+
+    def donor_summary(self, donor_id):
+        return self.store.donor_summary(donor_id)
+
+    def submit_donations(self, donations):
+        # Validated and written in one transaction; raises SchemaError naming bad rows
+        donations = list(donations)
+        if len(donations) == 1:
+            return [self.store.insert_medicine(donations[0])]
+        return self.store.insert_many(donations)
+
+    def update_statuses(self, ids, status, actor="system"):
+        return self.store.update_status_many([int(i) for i in ids], status, actor=actor)
+
+    def sweep_expired(self):
+        return self.store.sweep_expired()
+
+    # ---- dashboards ----
+    def impact(self):
+        return ImpactSummary(**impact_summary(self.store))
+
+    def analytics(self):
+        return Analytics(self.store.counters('status'), self.store.counters('category'), self.store.counters('month'))
+
+    def stats_version(self):
+        # Bumped by every write to what impact and analytics read; cache keys use it
+        return self.store.stats_version()
+
+    def check_counters(self):
+        return self.store.check_counters()
+
+    def rebuild_counters(self):
+        self.store.rebuild_counters()
+
+    # ---- requests ----
+    def create_request(self, request):
+        request_id, allocations = self.matching.submit(request)
+        return RequestSubmitted(request_id, sum(units for _, units in allocations))
+
+    def list_requests(self, recipient_id=None, limit=DEFAULT_LIMIT, cursor=None, offset=0):
+        limit = _limit(limit)
+        before = decode_cursor(cursor, "requests")["before"] if cursor else None
+        rows = self.store.list_requests(recipient_id=recipient_id, limit=limit + 1,
+                                        offset=0 if cursor else int(offset or 0), before=before)
+        more = len(rows) > limit
+        rows = rows[:limit]
+        matches = self.store.request_matches([row["id"] for row in rows])
+        items = [MedicineRequest(**row, matches=[
+            RequestMatch(id=m["id"], name=m["name"], matched=m["matched"], location=m["location"],
+                         expiry=format_date(m["expiry"], ""), donor=m["donor"], donor_contact=m["donor_contact"],
+                         status=m["status"], promised_until=m["promised_until"])
+            for m in matches.get(row["id"], [])
+        ]) for row in rows]
+        next_cursor = encode_cursor({"sort": "requests", "before": rows[-1]["id"]}) if more else None
+        return Page(items, self.store.count_requests(recipient_id=recipient_id), next_cursor)
+
+    def cancel_request(self, request_id, recipient_id=None):
+        return self.matching.cancel(int(request_id), recipient_id)
+
+    # ---- reservations ----
+    def reserve(self, medicine_id, units, recipient_id, recipient="", request_id=None):
+        return self.store.reserve(int(medicine_id), int(units), recipient_id, recipient=recipient,
+                                  request_id=None if request_id is None else int(request_id))
+
+    def list_reservations(self, recipient_id=None, limit=DEFAULT_LIMIT, cursor=None, offset=0):
+        limit = _limit(limit)
+        before = decode_cursor(cursor, "reservations")["before"] if cursor else None
+        rows = self.store.list_reservations(recipient_id=recipient_id, limit=limit + 1,
+                                            offset=0 if cursor else int(offset or 0), before=before)
+        more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor({"sort": "reservations", "before": rows[-1]["id"]}) if more else None
+        return Page([build(Reservation, row) for row in rows],
+                    self.store.count_reservations(recipient_id=recipient_id), next_cursor)
+
+    def cancel_reservation(self, reservation_id, recipient_id=None, actor=None):
+        return self.store.cancel_reservation(int(reservation_id), recipient_id=recipient_id, actor=actor)
+
+    def fulfil_reservation(self, reservation_id, actor="system"):
+        self.store.fulfil_reservation(int(reservation_id), actor=actor)
+
+    # ---- admin ----
+    def audit_log(self, limit=200):
+        return _records(self.store.audit_log(limit=int(limit)))
+
+    def outbox(self, limit=200):
+        return Outbox(self.store.outbox_summary(), _records(self.store.list_outbox(limit=int(limit))))
+
+
+def create_service(store):
+    # The in-memory views one process keeps over the store. Each listener is
+    # registered before its view is built so no committed write slips between,
+    # and the change feed starts from before any of them was read, so writes
+    # other processes commit reach them too.
+    feed = ChangeFeed(store)
+    table = ChunkedTable(MEDICINE_COLUMNS, seal=coerce_medicines)
+    store.add_listener(table.upsert)
+    for batch in store.iter_medicines():
+        table.append_frame(batch)
+    index = SearchIndex()
+    store.add_listener(index.apply_changes)
+    index.rebuild(table.frame())
+    duplicates = DuplicateIndex()
+    store.add_listener(duplicates.apply_changes)
+    duplicates.rebuild(table.frame())
+    engine = MatchingEngine(store, index)
+    store.add_listener(engine.apply_changes)
+    store.add_request_listener(engine.apply_request_changes)
+    engine.load()
+    feed.start()
+    return InventoryService(store, index, table, engine, duplicates)
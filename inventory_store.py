@@ -0,0 +1,1483 @@
+import datetime
+import json
+import logging
+import os
+from collections import Counter, defaultdict, deque
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from schema import (CATEGORIES, LOCATIONS, MEDICINE_COLUMNS, STATUSES, SchemaError, coerce_medicines, validate_medicine,
+                    validate_medicines)
+
+# ====================
+# SHARED INVENTORY STORE
+# ====================
+# One SQLite database (WAL mode) shared by every Streamlit session and worker
+# process. Readers never block the single writer, and every write runs in its
+# own IMMEDIATE transaction so concurrent submits serialize cleanly.
+
+DEFAULT_DB_PATH = os.environ.get(
+    "AROGYA_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "arogyamitram.db")
+)
+
+# Applied in order; PRAGMA user_version records how many have already run.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS medicines (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT NOT NULL DEFAULT '',
+        quantity INTEGER NOT NULL,
+        expiry TEXT NOT NULL,
+        donor TEXT NOT NULL,
+        donor_contact TEXT NOT NULL DEFAULT '',
+        location TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        category TEXT NOT NULL,
+        image TEXT NOT NULL DEFAULT '',
+        value INTEGER NOT NULL DEFAULT 0,
+        added_date TEXT NOT NULL,
+        prescription INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_medicines_status ON medicines(status);
+    CREATE INDEX IF NOT EXISTS idx_medicines_donor ON medicines(donor);
+    CREATE INDEX IF NOT EXISTS idx_medicines_category ON medicines(category, status);
+    CREATE INDEX IF NOT EXISTS idx_medicines_location ON medicines(location, status);
+    """,
+    # Materialized analytics counters, kept in step with every write
+    """
+    CREATE TABLE IF NOT EXISTS medicine_counters (
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (kind, key)
+    ) WITHOUT ROWID;
+    INSERT OR REPLACE INTO medicine_counters
+        SELECT 'status', status, COUNT(*) FROM medicines GROUP BY status;
+    INSERT OR REPLACE INTO medicine_counters
+        SELECT 'category', category, COUNT(*) FROM medicines GROUP BY category;
+    INSERT OR REPLACE INTO medicine_counters
+        SELECT 'month', substr(added_date, 1, 7), COUNT(*) FROM medicines GROUP BY substr(added_date, 1, 7);
+    """,
+    # Impact ledger: one row per approval, fulfilment, rejection or withdrawal,
+    # with per-event rollups the impact dashboard reads directly
+    """
+    CREATE TABLE IF NOT EXISTS impact_events (
+        id INTEGER PRIMARY KEY,
+        event_key TEXT NOT NULL UNIQUE,
+        medicine_id INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        value INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_impact_events_medicine ON impact_events(medicine_id);
+    CREATE TABLE IF NOT EXISTS impact_rollups (
+        event TEXT PRIMARY KEY,
+        events INTEGER NOT NULL DEFAULT 0,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    INSERT OR IGNORE INTO impact_events (event_key, medicine_id, event, quantity, value, created_at)
+        SELECT status || ':' || id, id, status, quantity, quantity * value, added_date
+        FROM medicines WHERE status IN ('approved', 'rejected');
+    INSERT OR REPLACE INTO impact_rollups
+        SELECT event, COUNT(*), SUM(quantity), SUM(value) FROM impact_events GROUP BY event;
+    """,
+    # Audit trail of every status decision
+    """
+    CREATE TABLE IF NOT EXISTS status_audit (
+        id INTEGER PRIMARY KEY,
+        medicine_id INTEGER NOT NULL,
+        old_status TEXT NOT NULL,
+        new_status TEXT NOT NULL,
+        actor TEXT NOT NULL,
+        changed_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_status_audit_medicine ON status_audit(medicine_id);
+    """,
+    # ISO dates sort chronologically, so this serves expiry range scans per status
+    """
+    CREATE INDEX IF NOT EXISTS idx_medicines_status_expiry ON medicines(status, expiry);
+    """,
+    # Stable donor ids: history survives renames and never merges namesakes
+    """
+    ALTER TABLE medicines ADD COLUMN donor_id TEXT NOT NULL DEFAULT '';
+    CREATE INDEX IF NOT EXISTS idx_medicines_donor_id ON medicines(donor_id, status);
+    """,
+    # Persistent id sequences; a range is reserved with one row update
+    """
+    CREATE TABLE IF NOT EXISTS id_sequences (
+        name TEXT PRIMARY KEY,
+        next_value INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    INSERT OR IGNORE INTO id_sequences (name, next_value)
+        SELECT 'medicines', COALESCE(MAX(id), 0) + 1 FROM medicines;
+    """,
+    # Recipient demand and the stock promised to it
+    """
+    CREATE TABLE IF NOT EXISTS medicine_requests (
+        id INTEGER PRIMARY KEY,
+        recipient_id TEXT NOT NULL,
+        recipient TEXT NOT NULL,
+        contact TEXT NOT NULL DEFAULT '',
+        drug TEXT NOT NULL,
+        category TEXT NOT NULL DEFAULT '',
+        location TEXT NOT NULL DEFAULT '',
+        quantity INTEGER NOT NULL,
+        matched_quantity INTEGER NOT NULL DEFAULT 0,
+        urgency TEXT NOT NULL DEFAULT 'normal',
+        status TEXT NOT NULL DEFAULT 'open',
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_requests_recipient ON medicine_requests(recipient_id, status);
+    CREATE INDEX IF NOT EXISTS idx_requests_status ON medicine_requests(status, created_at);
+    CREATE TABLE IF NOT EXISTS request_matches (
+        request_id INTEGER NOT NULL,
+        medicine_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        matched_at TEXT NOT NULL,
+        expires_at TEXT NOT NULL,
+        PRIMARY KEY (request_id, medicine_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_request_matches_medicine ON request_matches(medicine_id);
+    CREATE INDEX IF NOT EXISTS idx_request_matches_expiry ON request_matches(expires_at);
+    CREATE TABLE IF NOT EXISTS lapsed_matches (
+        request_id INTEGER NOT NULL,
+        medicine_id INTEGER NOT NULL,
+        lapsed_at TEXT NOT NULL,
+        PRIMARY KEY (request_id, medicine_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_lapsed_matches_medicine ON lapsed_matches(medicine_id);
+    """,
+    # Reservations: units on hold for a recipient until handed over or timed out.
+    # available_quantity is what is not on hold, promised_quantity what of it the
+    # matcher promised to requests (kept by the triggers); the difference is what
+    # is left to reserve. version guards every change to either (compare-and-set)
+    # so writers in other processes never double-book.
+    """
+    ALTER TABLE medicines ADD COLUMN available_quantity INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE medicines ADD COLUMN promised_quantity INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE medicines ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    UPDATE medicines SET available_quantity = quantity,
+        promised_quantity = (SELECT COALESCE(SUM(quantity), 0) FROM request_matches WHERE medicine_id = medicines.id);
+    CREATE INDEX IF NOT EXISTS idx_medicines_available ON medicines(status, (available_quantity - promised_quantity));
+    CREATE TRIGGER IF NOT EXISTS promise_insert AFTER INSERT ON request_matches
+    BEGIN
+        UPDATE medicines SET promised_quantity = promised_quantity + NEW.quantity, version = version + 1
+        WHERE id = NEW.medicine_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS promise_update AFTER UPDATE OF quantity ON request_matches
+    BEGIN
+        UPDATE medicines SET promised_quantity = promised_quantity + NEW.quantity - OLD.quantity, version = version + 1
+        WHERE id = NEW.medicine_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS promise_delete AFTER DELETE ON request_matches
+    BEGIN
+        UPDATE medicines SET promised_quantity = promised_quantity - OLD.quantity, version = version + 1
+        WHERE id = OLD.medicine_id;
+    END;
+    CREATE TABLE IF NOT EXISTS reservations (
+        id INTEGER PRIMARY KEY,
+        medicine_id INTEGER NOT NULL,
+        request_id INTEGER,
+        recipient_id TEXT NOT NULL,
+        recipient TEXT NOT NULL DEFAULT '',
+        quantity INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'held',
+        created_at TEXT NOT NULL,
+        expires_at TEXT NOT NULL,
+        closed_at TEXT,
+        closed_by TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_reservations_status ON reservations(status, expires_at);
+    CREATE INDEX IF NOT EXISTS idx_reservations_medicine ON reservations(medicine_id, status);
+    CREATE INDEX IF NOT EXISTS idx_reservations_recipient ON reservations(recipient_id, status);
+    CREATE INDEX IF NOT EXISTS idx_reservations_request ON reservations(request_id);
+    """,
+    # Notification outbox, written in the same transaction as the change it
+    # reports, with the delivery state of each row per channel so a retry only
+    # re-sends on the channels that have not gone through yet
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY,
+        event TEXT NOT NULL,
+        audience TEXT NOT NULL,
+        payload TEXT NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TEXT NOT NULL,
+        last_error TEXT NOT NULL DEFAULT '',
+        created_at TEXT NOT NULL,
+        sent_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at);
+    CREATE TABLE IF NOT EXISTS outbox_deliveries (
+        outbox_id INTEGER NOT NULL REFERENCES outbox(id),
+        channel TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT NOT NULL DEFAULT '',
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (outbox_id, channel)
+    );
+    """,
+    # Version of the analytics counters and impact rollups, bumped by every
+    # write to either, so caches of what is drawn from them know when to drop it
+    """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO data_versions (name, version) VALUES ('stats', 0);
+    """,
+    # Change feed: the triggers log every medicine and request row a committed
+    # write touched, in commit order, for other processes to catch up from
+    """
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        row_id INTEGER NOT NULL
+    );
+    CREATE TRIGGER IF NOT EXISTS log_medicine_insert AFTER INSERT ON medicines
+    BEGIN
+        INSERT INTO change_log (kind, row_id) VALUES ('medicine', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS log_medicine_update AFTER UPDATE ON medicines
+    BEGIN
+        INSERT INTO change_log (kind, row_id) VALUES ('medicine', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS log_request_insert AFTER INSERT ON medicine_requests
+    BEGIN
+        INSERT INTO change_log (kind, row_id) VALUES ('request', NEW.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS log_request_update AFTER UPDATE ON medicine_requests
+    BEGIN
+        INSERT INTO change_log (kind, row_id) VALUES ('request', NEW.id);
+    END;
+    """,
+    # Admin grid sorted by name
+    """
+    CREATE INDEX IF NOT EXISTS idx_medicines_name ON medicines(name, id);
+    """,
+]
+
+FILTER_COLUMNS = ("status", "donor", "donor_id", "category", "location")
+
+# Statuses the expiry sweeper moves to "expired" once their date has passed
+SWEEPABLE_STATUSES = ("pending", "approved")
+SWEEP_INTERVAL_SECONDS = 3600
+
+# How often each process reads the change feed, and how long the log is kept.
+# A process that falls further behind than the retention reloads its views.
+CHANGE_POLL_SECONDS = 1.0
+CHANGE_BATCH = 5_000
+CHANGE_RETENTION_HOURS = 24
+
+logger = logging.getLogger(__name__)
+
+# Status changes that are written to the impact ledger
+LEDGER_EVENTS = ("approved", "rejected", "fulfilled")
+
+# Most urgent first; matching serves requests in this order
+URGENCY_LEVELS = ("urgent", "high", "normal")
+REQUEST_STATUSES = ("open", "partial", "matched", "cancelled")
+# Requests still waiting for (more) stock
+OPEN_REQUEST_STATUSES = ("open", "partial")
+# How long matched units stay promised to a request before they go back to the
+# pool; a request is not offered the same stock again once its promise lapsed
+MATCH_TTL_MINUTES = 24 * 60
+REQUEST_COLUMNS = [
+    "id", "recipient_id", "recipient", "contact", "drug", "category", "location",
+    "quantity", "matched_quantity", "urgency", "status", "created_at"
+]
+
+# How long reserved units stay on hold before they return to the pool
+RESERVATION_TTL_MINUTES = 24 * 60
+RESERVATION_SWEEP_SECONDS = 60
+# Compare-and-set attempts before a reservation gives up under contention
+RESERVE_ATTEMPTS = 5
+RESERVATION_STATUSES = ("held", "fulfilled", "expired", "cancelled")
+RESERVATION_COLUMNS = [
+    "id", "medicine_id", "request_id", "recipient_id", "recipient", "quantity", "status",
+    "created_at", "expires_at", "closed_at", "closed_by"
+]
+
+# Outbox rows: queued -> sending (leased to one worker) -> sent | failed
+OUTBOX_STATUSES = ("queued", "sending", "sent", "failed")
+OUTBOX_COLUMNS = ["id", "event", "audience", "payload", "status", "attempts", "next_attempt_at",
+                  "last_error", "created_at", "sent_at"]
+# Per-channel delivery: queued until it goes through (sent) or gives up (failed)
+DELIVERY_STATUSES = ("queued", "sent", "failed")
+ADMIN_AUDIENCE = "role:admin"
+# Medicine names listed in one status notification; the rest are counted
+NOTIFY_NAMES_LIMIT = 5
+
+# kind -> SQL expression each counter groups medicines by
+COUNTER_KEYS = {
+    "status": "status",
+    "category": "category",
+    "month": "substr(added_date, 1, 7)",
+}
+
+# Every ordering ends on id so paging through equal keys stays stable
+SORT_ORDERS = {
+    "expiry": "expiry ASC, id ASC",
+    "added_date": "added_date DESC, id DESC",
+    "quantity": "available_quantity DESC, id ASC",
+    "id": "id ASC",
+    "name": "name ASC, id ASC",
+    "newest": "id DESC",
+}
+# sort -> (sort column, comparison that moves past it, comparison on the id tiebreak),
+# for keyset pages that continue after the last row already returned
+SORT_KEYSETS = {
+    "expiry": ("expiry", ">", ">"),
+    "added_date": ("added_date", "<", "<"),
+    "quantity": ("available_quantity", "<", ">"),
+    "id": (None, None, ">"),
+    "name": ("name", ">", ">"),
+    "newest": (None, None, "<"),
+}
+
+
+class ReservationError(ValueError):
+    pass
+
+
+class InventoryStore:
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._listeners = []
+        self._request_listeners = []
+        # (first, last] change_log ranges this process committed; only kept while a ChangeFeed runs
+        self._own_changes = None
+        self._migrate()
+
+    # ---- change listeners ----
+    def add_listener(self, callback):
+        # callback(list_of_medicine_dicts) runs after every committed write, so
+        # in-process indexes can update incrementally instead of rebuilding.
+        self._listeners.append(callback)
+
+    def _notify(self, med_ids):
+        if not self._listeners or not med_ids:
+            return
+        changed = self.get_medicines(med_ids)
+        for callback in self._listeners:
+            callback(changed)
+
+    def add_request_listener(self, callback):
+        # callback(list_of_request_dicts) for requests a write reopened or another process changed
+        self._request_listeners.append(callback)
+
+    def _notify_requests(self, request_ids):
+        if not self._request_listeners or not request_ids:
+            return
+        changed = self.get_requests(request_ids)
+        for callback in self._request_listeners:
+            callback(changed)
+
+    # ---- connections ----
+    def _connect(self):
+        # Streamlit runs each session on its own thread, so every thread gets
+        # its own connection instead of sharing one across threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        own = self._own_changes
+        first = self._change_seq(conn) if own is not None else None
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            last = self._change_seq(conn) if own is not None else None
+            conn.execute("COMMIT")
+            # Recorded only once committed: a rolled-back range is handed out again
+            if last != first:
+                own.append((first, last))
+
+    def _migrate(self):
+        with self._transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for script in MIGRATIONS[version:]:
+                # Split on ";" but keep trigger bodies whole
+                statement = ""
+                for piece in script.split(";"):
+                    statement += piece + ";"
+                    if sqlite3.complete_statement(statement):
+                        if statement.strip(" \n;"):
+                            conn.execute(statement)
+                        statement = ""
+            conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+    # ---- reads ----
+    @staticmethod
+    def _row_to_dict(row):
+        med = dict(row)
+        med["prescription"] = bool(med["prescription"])
+        return med
+
+    def _to_frame(self, rows, columns=MEDICINE_COLUMNS):
+        return coerce_medicines(pd.DataFrame.from_records([dict(r) for r in rows], columns=columns))
+
+    @staticmethod
+    def _where(ids, filters):
+        clauses, params = [], []
+        if ids is not None:
+            clauses.append("id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps([int(i) for i in ids]))
+        for column in FILTER_COLUMNS:
+            value = filters.get(column)
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if filters.get("expires_from") is not None:
+            clauses.append("expiry >= ?")
+            params.append(str(filters["expires_from"]))
+        if filters.get("expires_to") is not None:
+            clauses.append("expiry <= ?")
+            params.append(str(filters["expires_to"]))
+        if filters.get("available"):
+            clauses.append("available_quantity - promised_quantity > 0")
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def list_medicines(self, ids=None, sort="id", limit=None, offset=0, after=None, columns=None, **filters):
+        # after=(sort value, id) of the previous page's last row continues from
+        # there through the index instead of skipping offset rows. columns
+        # projects the result (e.g. leaving out image references for grids).
+        columns = MEDICINE_COLUMNS if columns is None else [c for c in MEDICINE_COLUMNS if c in columns]
+        if not columns:
+            raise ValueError("Select at least one medicine column")
+        where, params = self._where(ids, filters)
+        if after is not None:
+            column, past, tiebreak = SORT_KEYSETS[sort]
+            if column is None:
+                keyset, keyset_params = f"id {tiebreak} ?", [int(after[1])]
+            else:
+                keyset = f"({column} {past} ? OR ({column} = ? AND id {tiebreak} ?))"
+                keyset_params = [after[0], after[0], int(after[1])]
+            where = f"{where} AND {keyset}" if where else f" WHERE {keyset}"
+            params += keyset_params
+        sql = f"SELECT {', '.join(columns)} FROM medicines{where} ORDER BY {SORT_ORDERS[sort]}"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+        return self._to_frame(self._connect().execute(sql, params).fetchall(), columns)
+
+    def iter_medicines(self, batch_rows=10_000):
+        # Keyset pagination over the primary key, for full loads that should not
+        # materialize one giant result set
+        last_id = 0
+        while True:
+            rows = self._connect().execute(
+                f"SELECT {', '.join(MEDICINE_COLUMNS)} FROM medicines WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_rows)
+            ).fetchall()
+            if not rows:
+                return
+            yield self._to_frame(rows)
+            last_id = rows[-1]["id"]
+
+    def count_medicines(self, ids=None, **filters):
+        where, params = self._where(ids, filters)
+        return self._connect().execute(f"SELECT COUNT(*) FROM medicines{where}", params).fetchone()[0]
+
+    def medicine_ids(self, ids=None, **filters):
+        where, params = self._where(ids, filters)
+        return {r[0] for r in self._connect().execute(f"SELECT id FROM medicines{where}", params)}
+
+    def get_medicine(self, med_id):
+        row = self._connect().execute(
+            f"SELECT {', '.join(MEDICINE_COLUMNS)} FROM medicines WHERE id = ?", (int(med_id),)
+        ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def get_medicines(self, med_ids):
+        rows = self._connect().execute(
+            f"SELECT {', '.join(MEDICINE_COLUMNS)} FROM medicines WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([int(i) for i in med_ids]),)
+        )
+        return [self._row_to_dict(row) for row in rows]
+
+    def distinct_values(self, column, status=None):
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Cannot list distinct values of {column!r}")
+        sql = f"SELECT DISTINCT {column} FROM medicines"
+        params = []
+        if status is not None:
+            sql += " WHERE status = ?"
+            params.append(status)
+        return [r[0] for r in self._connect().execute(sql + f" ORDER BY {column}", params)]
+
+    def donor_summary(self, donor_id):
+        # Per-status count, units and value for one donor, read off the (donor_id, status) index
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) AS donations, SUM(quantity) AS quantity, SUM(quantity * value) AS value "
+            "FROM medicines WHERE donor_id = ? GROUP BY status", (donor_id,)
+        )
+        return {r["status"]: {"donations": r["donations"], "quantity": r["quantity"], "value": r["value"]} for r in rows}
+
+    # ---- analytics counters ----
+    def counters(self, kind):
+        rows = self._connect().execute(
+            "SELECT key, count FROM medicine_counters WHERE kind = ? AND count > 0 ORDER BY key", (kind,)
+        )
+        return {key: count for key, count in rows}
+
+    @staticmethod
+    def _recount(conn, kind):
+        expr = COUNTER_KEYS[kind]
+        return {key: count for key, count in conn.execute(f"SELECT {expr}, COUNT(*) FROM medicines GROUP BY {expr}")}
+
+    def check_counters(self):
+        # Returns {kind: {key: (stored, actual)}} for every counter that drifted
+        conn = self._connect()
+        drift = {}
+        for kind in COUNTER_KEYS:
+            stored, actual = self.counters(kind), self._recount(conn, kind)
+            diff = {k: (stored.get(k, 0), actual.get(k, 0))
+                    for k in set(stored) | set(actual) if stored.get(k, 0) != actual.get(k, 0)}
+            if diff:
+                drift[kind] = diff
+        return drift
+
+    def rebuild_counters(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM medicine_counters")
+            for kind in COUNTER_KEYS:
+                conn.executemany(
+                    "INSERT INTO medicine_counters (kind, key, count) VALUES (?, ?, ?)",
+                    [(kind, key, count) for key, count in self._recount(conn, kind).items()]
+                )
+            self._touch_stats(conn)
+
+    @classmethod
+    def _bump(cls, conn, kind, key, delta):
+        conn.execute(
+            "INSERT INTO medicine_counters (kind, key, count) VALUES (?, ?, ?) "
+            "ON CONFLICT(kind, key) DO UPDATE SET count = count + excluded.count",
+            (kind, key, delta)
+        )
+        cls._touch_stats(conn)
+
+    # ---- stats version ----
+    @staticmethod
+    def _touch_stats(conn):
+        conn.execute("UPDATE data_versions SET version = version + 1 WHERE name = 'stats'")
+
+    def stats_version(self):
+        # Changes whenever counters or rollups do, in this process or any other
+        return self._connect().execute("SELECT version FROM data_versions WHERE name = 'stats'").fetchone()[0]
+
+    # ---- impact ledger ----
+    @classmethod
+    def _record_event(cls, conn, event_key, med, event, quantity):
+        # The unique event_key makes replays no-ops, so rollups never double count
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO impact_events (event_key, medicine_id, event, quantity, value, created_at) "
+            "VALUES (?, ?, ?, ?, ?, datetime('now'))",
+            (event_key, med["id"], event, quantity, quantity * med["value"])
+        )
+        if cursor.rowcount == 1:
+            conn.execute(
+                "INSERT INTO impact_rollups (event, events, quantity, value) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT(event) DO UPDATE SET events = events + 1, "
+                "quantity = quantity + excluded.quantity, value = value + excluded.value",
+                (event, quantity, quantity * med["value"])
+            )
+            cls._touch_stats(conn)
+
+    @classmethod
+    def _record_status_events(cls, conn, rows, status):
+        # rows as they were before the change. Keys are numbered by the events the
+        # medicine already has, so stock approved again after a withdrawal counts again.
+        ids = json.dumps([row["id"] for row in rows])
+        recorded = dict(conn.execute(
+            "SELECT medicine_id, COUNT(*) FROM impact_events "
+            "WHERE medicine_id IN (SELECT value FROM json_each(?)) GROUP BY medicine_id", (ids,)
+        ).fetchall())
+        handed_over = dict(conn.execute(
+            "SELECT medicine_id, SUM(quantity) FROM reservations WHERE status = 'fulfilled' "
+            "AND medicine_id IN (SELECT value FROM json_each(?)) GROUP BY medicine_id", (ids,)
+        ).fetchall())
+        for row in rows:
+            seq = recorded.get(row["id"], 0)
+            if status in LEDGER_EVENTS:
+                cls._record_event(conn, f"{status}:{row['id']}:{seq}", row, status, row["quantity"])
+            # Approved stock leaving the pool any other way takes back what was not handed over
+            units = row["quantity"] - handed_over.get(row["id"], 0)
+            if row["status"] == "approved" and status != "fulfilled" and units > 0:
+                cls._record_event(conn, f"withdrawn:{row['id']}:{seq}", row, "withdrawn", units)
+
+    def impact_rollups(self):
+        rows = self._connect().execute("SELECT event, events, quantity, value FROM impact_rollups")
+        return {r["event"]: {"events": r["events"], "quantity": r["quantity"], "value": r["value"]} for r in rows}
+
+    # ---- id allocation ----
+    @staticmethod
+    def _allocate_ids(conn, count, sequence="medicines"):
+        # Must run inside a write transaction, which holds SQLite's write lock,
+        # so no two sessions or processes can be handed overlapping ranges.
+        start = conn.execute("SELECT next_value FROM id_sequences WHERE name = ?", (sequence,)).fetchone()
+        start = start[0] if start else 1
+        conn.execute(
+            "INSERT INTO id_sequences (name, next_value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET next_value = excluded.next_value",
+            (sequence, start + count)
+        )
+        return range(start, start + count)
+
+    def reserve_ids(self, count, sequence="medicines"):
+        # Reserves a block of ids up front, e.g. for a bulk insert built elsewhere.
+        # Reserved ids are never handed out again, even if left unused.
+        with self._transaction() as conn:
+            return self._allocate_ids(conn, count, sequence)
+
+    # ---- writes ----
+    @classmethod
+    def _insert(cls, conn, med):
+        med = dict(med)
+        if med.get("id") is None:
+            med["id"] = cls._allocate_ids(conn, 1)[0]
+        else:
+            # Explicit ids (seed rows) push the sequence past themselves
+            conn.execute("UPDATE id_sequences SET next_value = MAX(next_value, ?) WHERE name = 'medicines'",
+                         (int(med["id"]) + 1,))
+        columns = [c for c in MEDICINE_COLUMNS if c in med]
+        cursor = conn.execute(
+            f"INSERT INTO medicines ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [int(med[c]) if c == "prescription" else med[c] for c in columns]
+        )
+        cls._bump(conn, "status", med.get("status", "pending"), 1)
+        cls._bump(conn, "category", med["category"], 1)
+        cls._bump(conn, "month", med["added_date"][:7], 1)
+        status = med.get("status", "pending")
+        if status in LEDGER_EVENTS:
+            row = {"id": cursor.lastrowid, "value": med.get("value", 0)}
+            cls._record_event(conn, f"{status}:{cursor.lastrowid}", row, status, med["quantity"])
+        if status == "pending":
+            cls._enqueue(conn, "donation_submitted", ADMIN_AUDIENCE, {
+                "medicine_id": cursor.lastrowid, "name": med["name"], "quantity": med["quantity"], "donor": med["donor"]
+            })
+        return cursor.lastrowid
+
+    def insert_medicine(self, med):
+        med = validate_medicine(med)
+        with self._transaction() as conn:
+            med_id = self._insert(conn, med)
+        self._notify([med_id])
+        return med_id
+
+    def insert_many(self, medicines, med_ids=None):
+        # One transaction for the whole batch: ids come from one sequence range
+        # (or a range reserved earlier with reserve_ids) and counters/rollups
+        # are bumped once per key.
+        if not medicines:
+            return []
+        medicines = validate_medicines(medicines)
+        with self._transaction() as conn:
+            med_ids = list(med_ids) if med_ids is not None else list(self._allocate_ids(conn, len(medicines)))
+            columns = [c for c in MEDICINE_COLUMNS if c != "id" and c in medicines[0]]
+            conn.executemany(
+                f"INSERT INTO medicines (id, {', '.join(columns)}) VALUES (?, {', '.join('?' * len(columns))})",
+                [[med_id] + [int(med[c]) if c == "prescription" else med[c] for c in columns]
+                 for med_id, med in zip(med_ids, medicines)]
+            )
+            bumps = Counter()
+            for med in medicines:
+                bumps["status", med.get("status", "pending")] += 1
+                bumps["category", med["category"]] += 1
+                bumps["month", med["added_date"][:7]] += 1
+            for (kind, key), delta in bumps.items():
+                self._bump(conn, kind, key, delta)
+            # Freshly allocated ids cannot collide with existing event keys
+            events = [(f"{med['status']}:{med_id}", med_id, med["status"], med["quantity"], med["quantity"] * med["value"])
+                      for med_id, med in zip(med_ids, medicines) if med.get("status") in LEDGER_EVENTS]
+            conn.executemany(
+                "INSERT INTO impact_events (event_key, medicine_id, event, quantity, value, created_at) "
+                "VALUES (?, ?, ?, ?, ?, datetime('now'))", events
+            )
+            rollups = {}
+            for _, _, event, quantity, value in events:
+                total = rollups.setdefault(event, [0, 0, 0])
+                total[0] += 1
+                total[1] += quantity
+                total[2] += value
+            for event, (count, quantity, value) in rollups.items():
+                conn.execute(
+                    "INSERT INTO impact_rollups (event, events, quantity, value) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(event) DO UPDATE SET events = events + excluded.events, "
+                    "quantity = quantity + excluded.quantity, value = value + excluded.value",
+                    (event, count, quantity, value)
+                )
+            # One admin notice per donor per batch, however many rows it holds
+            pending = Counter(med["donor"] for med in medicines if med.get("status", "pending") == "pending")
+            for donor, count in pending.items():
+                self._enqueue(conn, "donations_imported", ADMIN_AUDIENCE, {"donor": donor, "count": count})
+        self._notify(med_ids)
+        return med_ids
+
+    def assign_donor_ids(self, donor_ids):
+        # Backfills rows written before donor ids existed, matching on the donor name
+        with self._transaction() as conn:
+            for name, donor_id in donor_ids.items():
+                conn.execute("UPDATE medicines SET donor_id = ? WHERE donor_id = '' AND donor = ?", (donor_id, name))
+
+    def seed(self, medicines):
+        medicines = validate_medicines(medicines)
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM medicines LIMIT 1").fetchone() is None:
+                med_ids = [self._insert(conn, med) for med in medicines]
+            else:
+                med_ids = []
+        self._notify(med_ids)
+
+    def update_status_many(self, med_ids, status, actor="system"):
+        # Applies every transition, counter bump, ledger event and audit row in
+        # one transaction. Rows already in the target status are left alone.
+        # Returns the ids that actually changed.
+        if status not in STATUSES:
+            raise SchemaError(f"Unknown medicine status {status!r}")
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, status, quantity, value FROM medicines "
+                "WHERE id IN (SELECT value FROM json_each(?)) AND status != ?",
+                (json.dumps([int(i) for i in med_ids]), status)
+            ).fetchall()
+            changed = [row["id"] for row in rows]
+            reopened = self._apply_status(conn, rows, status, actor)
+        # Requests whose holds were cancelled rejoin the matcher before the stock change reaches it
+        self._notify_requests(reopened)
+        self._notify(changed)
+        return changed
+
+    @classmethod
+    def _apply_status(cls, conn, rows, status, actor, ledger=True):
+        # rows carry id, status, quantity and value as they were before the change.
+        # Returns the requests refreshed because holds on this stock were cancelled.
+        if not rows:
+            return []
+        changed = json.dumps([row["id"] for row in rows])
+        conn.execute(
+            "UPDATE medicines SET status = ?, version = version + 1 WHERE id IN (SELECT value FROM json_each(?))",
+            (status, changed)
+        )
+        for old_status, count in Counter(row["status"] for row in rows).items():
+            cls._bump(conn, "status", old_status, -count)
+        cls._bump(conn, "status", status, len(rows))
+        if ledger:
+            cls._record_status_events(conn, rows, status)
+        conn.executemany(
+            "INSERT INTO status_audit (medicine_id, old_status, new_status, actor, changed_at) "
+            "VALUES (?, ?, ?, ?, datetime('now'))",
+            [(row["id"], row["status"], status, actor) for row in rows]
+        )
+        cls._notify_donors(conn, changed, status)
+        if status != "approved":
+            # Holds on stock that left the pool can no longer be honoured
+            requests = [r[0] for r in conn.execute(
+                "SELECT DISTINCT request_id FROM reservations WHERE status = 'held' AND request_id IS NOT NULL "
+                "AND medicine_id IN (SELECT value FROM json_each(?))", (changed,)
+            )]
+            conn.execute(
+                "UPDATE reservations SET status = 'cancelled', closed_at = datetime('now'), closed_by = ? "
+                "WHERE status = 'held' AND medicine_id IN (SELECT value FROM json_each(?))", (actor, changed)
+            )
+            if requests:
+                cls._refresh_requests(conn, requests)
+            return requests
+        return []
+
+    @classmethod
+    def _notify_donors(cls, conn, med_ids_json, status):
+        # One "your donations are now <status>" notice per donor
+        by_donor = {}
+        for row in conn.execute(
+            "SELECT donor_id, name FROM medicines WHERE id IN (SELECT value FROM json_each(?)) AND donor_id != '' "
+            "ORDER BY id", (med_ids_json,)
+        ):
+            by_donor.setdefault(row["donor_id"], []).append(row["name"])
+        for donor_id, names in by_donor.items():
+            cls._enqueue(conn, "donation_status", f"user:{donor_id}", {
+                "status": status, "count": len(names), "names": names[:NOTIFY_NAMES_LIMIT]
+            })
+
+    def update_medicine_status(self, med_id, status, actor="system"):
+        self.update_status_many([med_id], status, actor)
+        return self.get_medicine(med_id)
+
+    # ---- expiry ----
+    def sweep_expired(self, today=None):
+        # Moves everything whose expiry date has passed to "expired" in bulk
+        today = (today or datetime.date.today()).isoformat()
+        conn = self._connect()
+        expired = []
+        for status in SWEEPABLE_STATUSES:
+            expired += [r[0] for r in conn.execute(
+                "SELECT id FROM medicines WHERE status = ? AND expiry < ?", (status, today)
+            )]
+        return self.update_status_many(expired, "expired", actor="expiry-sweeper") if expired else []
+
+    # ---- medicine requests ----
+    def create_request(self, request):
+        request = dict(request)
+        request.setdefault("category", "")
+        request.setdefault("location", "")
+        request.setdefault("urgency", "normal")
+        request.setdefault("contact", "")
+        problems = []
+        if not str(request.get("drug", "")).strip():
+            problems.append("drug is required")
+        if not isinstance(request.get("quantity"), int) or request["quantity"] <= 0:
+            problems.append("quantity must be a positive whole number")
+        if request["urgency"] not in URGENCY_LEVELS:
+            problems.append(f"urgency must be one of {', '.join(URGENCY_LEVELS)}")
+        if request["category"] and request["category"] not in CATEGORIES:
+            problems.append("category is not one of the allowed categories")
+        if request["location"] and request["location"] not in LOCATIONS:
+            problems.append("location is not one of the allowed locations")
+        if problems:
+            raise SchemaError("Invalid request: " + "; ".join(problems))
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO medicine_requests (recipient_id, recipient, contact, drug, category, location, "
+                "quantity, urgency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+                (request["recipient_id"], request["recipient"], request["contact"], request["drug"].strip(),
+                 request["category"], request["location"], request["quantity"], request["urgency"])
+            )
+        return cursor.lastrowid
+
+    def get_requests(self, request_ids):
+        rows = self._connect().execute(
+            f"SELECT {', '.join(REQUEST_COLUMNS)} FROM medicine_requests "
+            "WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([int(i) for i in request_ids]),)
+        )
+        return [dict(row) for row in rows]
+
+    def list_requests(self, recipient_id=None, statuses=None, limit=None, offset=0, before=None):
+        # Newest first; before=<id> continues after the last id already returned
+        where, params = self._request_where(recipient_id, statuses, before)
+        sql = f"SELECT {', '.join(REQUEST_COLUMNS)} FROM medicine_requests{where} ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def count_requests(self, recipient_id=None, statuses=None):
+        where, params = self._request_where(recipient_id, statuses)
+        return self._connect().execute(f"SELECT COUNT(*) FROM medicine_requests{where}", params).fetchone()[0]
+
+    @staticmethod
+    def _request_where(recipient_id, statuses, before=None):
+        clauses, params = [], []
+        if before is not None:
+            clauses.append("id < ?")
+            params.append(int(before))
+        if recipient_id is not None:
+            clauses.append("recipient_id = ?")
+            params.append(recipient_id)
+        if statuses is not None:
+            clauses.append("status IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(list(statuses)))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def request_matches(self, request_ids):
+        # Matched stock per request, with what a recipient needs to collect it
+        rows = self._connect().execute(
+            "SELECT rm.request_id, rm.quantity AS matched, rm.expires_at AS promised_until, m.id, m.name, m.location, "
+            "m.expiry, m.donor, m.donor_contact, m.status FROM request_matches rm JOIN medicines m ON m.id = rm.medicine_id "
+            "WHERE rm.request_id IN (SELECT value FROM json_each(?)) ORDER BY rm.matched_at, m.id",
+            (json.dumps([int(i) for i in request_ids]),)
+        )
+        matches = {}
+        for row in rows:
+            matches.setdefault(row["request_id"], []).append(dict(row))
+        return matches
+
+    def lapsed_requests(self, med_ids):
+        # {medicine id: request ids that let a promise on it lapse}; matching skips these pairs
+        lapsed = {}
+        for row in self._connect().execute(
+            "SELECT medicine_id, request_id FROM lapsed_matches WHERE medicine_id IN (SELECT value FROM json_each(?))",
+            (json.dumps([int(i) for i in med_ids]),)
+        ):
+            lapsed.setdefault(row["medicine_id"], set()).add(row["request_id"])
+        return lapsed
+
+    def allocate_request(self, request_id, med_ids):
+        return self.allocate_requests([(request_id, med_ids)]).get(int(request_id), [])
+
+    def allocate_requests(self, plan, ttl_minutes=MATCH_TTL_MINUTES):
+        # plan is [(request_id, [medicine ids in preference order])], served in
+        # order. Unclaimed approved units are promised to open requests for
+        # ttl_minutes; the remaining-units check and the writes share one
+        # IMMEDIATE transaction, so concurrent matchers never over-promise stock.
+        # Returns {request_id: [(medicine_id, units)]} for what was allocated.
+        plan = [(int(request_id), [int(m) for m in med_ids]) for request_id, med_ids in plan if med_ids]
+        if not plan:
+            return {}
+        with self._transaction() as conn:
+            request_ids = json.dumps(sorted({request_id for request_id, _ in plan}))
+            need = {row["id"]: row["quantity"] - row["matched_quantity"] for row in conn.execute(
+                "SELECT id, quantity, matched_quantity FROM medicine_requests "
+                "WHERE id IN (SELECT value FROM json_each(?)) AND status IN ('open', 'partial')", (request_ids,)
+            )}
+            lapsed = {(row[0], row[1]) for row in conn.execute(
+                "SELECT request_id, medicine_id FROM lapsed_matches WHERE request_id IN (SELECT value FROM json_each(?))",
+                (request_ids,)
+            )}
+            remaining = {row["id"]: row["remaining"] for row in conn.execute(
+                "SELECT id, available_quantity - promised_quantity AS remaining FROM medicines "
+                "WHERE id IN (SELECT value FROM json_each(?)) AND status = 'approved'",
+                (json.dumps(sorted({m for _, med_ids in plan for m in med_ids})),)
+            )}
+            allocations = {}
+            for request_id, med_ids in plan:
+                for med_id in med_ids:
+                    if (request_id, med_id) in lapsed:
+                        continue
+                    units = min(need.get(request_id, 0), remaining.get(med_id, 0))
+                    if units > 0:
+                        allocations.setdefault(request_id, []).append((med_id, units))
+                        need[request_id] -= units
+                        remaining[med_id] -= units
+            if allocations:
+                conn.executemany(
+                    "INSERT INTO request_matches (request_id, medicine_id, quantity, matched_at, expires_at) "
+                    "VALUES (?, ?, ?, datetime('now'), datetime('now', ?)) ON CONFLICT(request_id, medicine_id) "
+                    "DO UPDATE SET quantity = quantity + excluded.quantity, expires_at = excluded.expires_at",
+                    [(request_id, med_id, units, f"+{int(ttl_minutes)} minutes")
+                     for request_id, pairs in allocations.items() for med_id, units in pairs]
+                )
+                self._refresh_requests(conn, list(allocations))
+                for request in conn.execute(
+                    "SELECT id, recipient_id, drug FROM medicine_requests WHERE id IN (SELECT value FROM json_each(?))",
+                    (json.dumps(list(allocations)),)
+                ).fetchall():
+                    self._enqueue(conn, "request_matched", f"user:{request['recipient_id']}", {
+                        "request_id": request["id"], "drug": request["drug"],
+                        "units": sum(units for _, units in allocations[request["id"]])
+                    })
+        # Promised units are no longer free to reserve
+        self._notify(sorted({med_id for pairs in allocations.values() for med_id, _ in pairs}))
+        return allocations
+
+    @staticmethod
+    def _refresh_requests(conn, request_ids):
+        # Recomputes matched_quantity and status from matches plus held or handed-over reservations
+        conn.execute(
+            "UPDATE medicine_requests SET "
+            "matched_quantity = COALESCE((SELECT SUM(quantity) FROM request_matches WHERE request_id = medicine_requests.id), 0) "
+            "+ COALESCE((SELECT SUM(quantity) FROM reservations WHERE request_id = medicine_requests.id "
+            "AND status IN ('held', 'fulfilled')), 0) "
+            "WHERE id IN (SELECT value FROM json_each(?)) AND status != 'cancelled'",
+            (json.dumps([int(i) for i in request_ids]),)
+        )
+        conn.execute(
+            "UPDATE medicine_requests SET status = CASE WHEN matched_quantity >= quantity THEN 'matched' "
+            "WHEN matched_quantity > 0 THEN 'partial' ELSE 'open' END "
+            "WHERE id IN (SELECT value FROM json_each(?)) AND status != 'cancelled'",
+            (json.dumps([int(i) for i in request_ids]),)
+        )
+
+    def cancel_request(self, request_id, recipient_id=None):
+        # Releases everything promised or on hold for the request; returns the freed medicine ids
+        with self._transaction() as conn:
+            sql, params = "SELECT status FROM medicine_requests WHERE id = ?", [int(request_id)]
+            if recipient_id is not None:
+                sql += " AND recipient_id = ?"
+                params.append(recipient_id)
+            row = conn.execute(sql, params).fetchone()
+            if row is None or row["status"] == "cancelled":
+                return []
+            freed = {r[0] for r in conn.execute(
+                "SELECT medicine_id FROM request_matches WHERE request_id = ?", (int(request_id),)
+            )}
+            conn.execute("DELETE FROM request_matches WHERE request_id = ?", (int(request_id),))
+            conn.execute("DELETE FROM lapsed_matches WHERE request_id = ?", (int(request_id),))
+            held = conn.execute(
+                "SELECT id FROM reservations WHERE request_id = ? AND status = 'held'", (int(request_id),)
+            ).fetchall()
+            freed.update(self._close_reservations(conn, [r["id"] for r in held], "cancelled", recipient_id or "system")[0])
+            conn.execute("UPDATE medicine_requests SET status = 'cancelled' WHERE id = ?", (int(request_id),))
+        self._notify(sorted(freed))
+        return sorted(freed)
+
+    def release_medicines(self, med_ids):
+        # Drops matches on stock that is no longer approved; returns the
+        # requests that lost units so they can be matched again
+        with self._transaction() as conn:
+            ids = json.dumps([int(i) for i in med_ids])
+            affected = [r[0] for r in conn.execute(
+                "SELECT DISTINCT request_id FROM request_matches WHERE medicine_id IN (SELECT value FROM json_each(?))",
+                (ids,)
+            )]
+            if affected:
+                conn.execute("DELETE FROM request_matches WHERE medicine_id IN (SELECT value FROM json_each(?))", (ids,))
+                self._refresh_requests(conn, affected)
+        return affected
+
+    def expire_matches(self):
+        # Takes back promises that were not taken up in time. The requests
+        # reopen and rejoin matching before the freed units are offered again,
+        # never to the request that let them lapse. Returns the reopened requests.
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM request_matches WHERE expires_at <= datetime('now') LIMIT 1").fetchone() is None:
+            return []
+        with self._transaction() as conn:
+            lapsed = conn.execute(
+                "DELETE FROM request_matches WHERE expires_at <= datetime('now') RETURNING request_id, medicine_id"
+            ).fetchall()
+            conn.executemany(
+                "INSERT OR IGNORE INTO lapsed_matches (request_id, medicine_id, lapsed_at) VALUES (?, ?, datetime('now'))",
+                [(row["request_id"], row["medicine_id"]) for row in lapsed]
+            )
+            reopened = sorted({row["request_id"] for row in lapsed})
+            self._refresh_requests(conn, reopened)
+        self._notify_requests(reopened)
+        self._notify(sorted({row["medicine_id"] for row in lapsed}))
+        return reopened
+
+    # ---- reservations ----
+    def reserve(self, med_id, units, recipient_id, recipient="", request_id=None, ttl_minutes=RESERVATION_TTL_MINUTES):
+        # Puts units of an approved medicine on hold. Availability is read
+        # without a lock and then claimed with a compare-and-set on the row
+        # version; a concurrent writer bumps the version and we retry. Units
+        # promised to other requests by the matcher are not reservable, while a
+        # request may reserve the units matched to it.
+        units = int(units)
+        if units <= 0:
+            raise ReservationError("Reserve at least one unit")
+        self.expire_reservations()
+        conn = self._connect()
+        for _ in range(RESERVE_ATTEMPTS):
+            med = conn.execute(
+                "SELECT status, available_quantity, promised_quantity, version FROM medicines WHERE id = ?",
+                (int(med_id),)
+            ).fetchone()
+            if med is None or med["status"] != "approved":
+                raise ReservationError("This medicine is no longer available")
+            # Any change to the matches bumps the version, so this read is checked by the claim below
+            own = conn.execute(
+                "SELECT COALESCE(SUM(quantity), 0) FROM request_matches WHERE medicine_id = ? AND request_id = ?",
+                (int(med_id), request_id)
+            ).fetchone()[0] if request_id is not None else 0
+            free = med["available_quantity"] - med["promised_quantity"] + own
+            if free < units:
+                raise ReservationError(f"Only {max(free, 0)} units are left to reserve")
+            with self._transaction() as conn:
+                claimed = conn.execute(
+                    "UPDATE medicines SET available_quantity = available_quantity - ?, version = version + 1 "
+                    "WHERE id = ? AND version = ? AND status = 'approved'",
+                    (units, int(med_id), med["version"])
+                ).rowcount
+                if claimed:
+                    reservation_id = conn.execute(
+                        "INSERT INTO reservations (medicine_id, request_id, recipient_id, recipient, quantity, "
+                        "created_at, expires_at) VALUES (?, ?, ?, ?, ?, datetime('now'), datetime('now', ?))",
+                        (int(med_id), request_id, recipient_id, recipient, units, f"+{int(ttl_minutes)} minutes")
+                    ).lastrowid
+                    self._enqueue_for_donor(conn, "reservation_created", med_id, {
+                        "reservation_id": reservation_id, "units": units, "recipient": recipient
+                    })
+                    if request_id is not None:
+                        # Matched units turn into held units; the request total is unchanged
+                        conn.execute(
+                            "UPDATE request_matches SET quantity = quantity - MIN(quantity, ?) "
+                            "WHERE request_id = ? AND medicine_id = ?", (units, request_id, int(med_id))
+                        )
+                        conn.execute("DELETE FROM request_matches WHERE quantity <= 0 AND request_id = ?", (request_id,))
+                        self._refresh_requests(conn, [request_id])
+            if claimed:
+                self._notify([med_id])
+                return reservation_id
+        raise ReservationError("This medicine is busy; please try again")
+
+    def _close_reservations(self, conn, reservation_ids, status, actor):
+        # Ends held reservations; units of expired or cancelled holds go back to
+        # the pool. Returns (medicine ids whose availability changed, requests refreshed).
+        rows = conn.execute(
+            "SELECT id, medicine_id, request_id, quantity FROM reservations "
+            "WHERE id IN (SELECT value FROM json_each(?)) AND status = 'held'",
+            (json.dumps([int(i) for i in reservation_ids]),)
+        ).fetchall()
+        if not rows:
+            return [], []
+        conn.execute(
+            "UPDATE reservations SET status = ?, closed_at = datetime('now'), closed_by = ? "
+            "WHERE id IN (SELECT value FROM json_each(?))",
+            (status, actor, json.dumps([row["id"] for row in rows]))
+        )
+        returned = Counter()
+        for row in rows:
+            returned[row["medicine_id"]] += row["quantity"]
+        if status == "expired":
+            names = {r["id"]: r["name"] for r in conn.execute(
+                "SELECT id, name FROM medicines WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(returned)),)
+            )}
+            for row in conn.execute(
+                "SELECT id, medicine_id, recipient_id, quantity FROM reservations WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps([row["id"] for row in rows]),)
+            ).fetchall():
+                self._enqueue(conn, "reservation_expired", f"user:{row['recipient_id']}", {
+                    "reservation_id": row["id"], "units": row["quantity"], "name": names.get(row["medicine_id"], "")
+                })
+        conn.executemany(
+            "UPDATE medicines SET available_quantity = available_quantity + ?, version = version + 1 WHERE id = ?",
+            [(units, med_id) for med_id, units in returned.items()]
+        )
+        requests = sorted({row["request_id"] for row in rows if row["request_id"] is not None})
+        if requests:
+            self._refresh_requests(conn, requests)
+        return list(returned), requests
+
+    def cancel_reservation(self, reservation_id, recipient_id=None, actor=None):
+        with self._transaction() as conn:
+            sql, params = "SELECT id FROM reservations WHERE id = ?", [int(reservation_id)]
+            if recipient_id is not None:
+                sql += " AND recipient_id = ?"
+                params.append(recipient_id)
+            rows = conn.execute(sql, params).fetchall()
+            freed, reopened = self._close_reservations(conn, [r["id"] for r in rows], "cancelled",
+                                                       actor or recipient_id or "system")
+        # Re-track the reopened requests first, so the freed units can be offered to them
+        self._notify_requests(reopened)
+        self._notify(freed)
+        return bool(freed)
+
+    def expire_reservations(self):
+        # Returns timed-out holds to the pool in one transaction
+        conn = self._connect()
+        if conn.execute(
+            "SELECT 1 FROM reservations WHERE status = 'held' AND expires_at <= datetime('now') LIMIT 1"
+        ).fetchone() is None:
+            return []
+        with self._transaction() as conn:
+            expired = [r[0] for r in conn.execute(
+                "SELECT id FROM reservations WHERE status = 'held' AND expires_at <= datetime('now')"
+            )]
+            freed, reopened = self._close_reservations(conn, expired, "expired", "reservation-sweeper")
+        self._notify_requests(reopened)
+        self._notify(freed)
+        return expired
+
+    def fulfil_reservation(self, reservation_id, actor="system"):
+        # Hands reserved units over: one ledger event per reservation, and the
+        # medicine becomes fulfilled once nothing is left to reserve or collect
+        with self._transaction() as conn:
+            reservation = conn.execute(
+                "SELECT medicine_id, request_id, quantity, status FROM reservations WHERE id = ?", (int(reservation_id),)
+            ).fetchone()
+            if reservation is None or reservation["status"] != "held":
+                raise ReservationError("Only held reservations can be handed over")
+            conn.execute(
+                "UPDATE reservations SET status = 'fulfilled', closed_at = datetime('now'), closed_by = ? WHERE id = ?",
+                (actor, int(reservation_id))
+            )
+            med = conn.execute(
+                "SELECT id, status, quantity, value, available_quantity FROM medicines WHERE id = ?",
+                (reservation["medicine_id"],)
+            ).fetchone()
+            self._record_event(conn, f"fulfilled:res:{int(reservation_id)}", med, "fulfilled", reservation["quantity"])
+            self._enqueue_for_donor(conn, "reservation_fulfilled", med["id"], {
+                "reservation_id": int(reservation_id), "units": reservation["quantity"]
+            })
+            still_held = conn.execute(
+                "SELECT 1 FROM reservations WHERE medicine_id = ? AND status = 'held' LIMIT 1", (med["id"],)
+            ).fetchone()
+            if med["available_quantity"] == 0 and still_held is None and med["status"] == "approved":
+                self._apply_status(conn, [med], "fulfilled", actor, ledger=False)
+            if reservation["request_id"] is not None:
+                self._refresh_requests(conn, [reservation["request_id"]])
+        self._notify([med["id"]])
+
+    def list_reservations(self, recipient_id=None, statuses=("held",), limit=None, offset=0, before=None):
+        where, params = self._reservation_where(recipient_id, statuses, before)
+        sql = (f"SELECT {', '.join('r.' + c for c in RESERVATION_COLUMNS)}, m.name, m.location, m.donor, "
+               f"m.donor_contact FROM reservations r JOIN medicines m ON m.id = r.medicine_id{where} ORDER BY r.id DESC")
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def count_reservations(self, recipient_id=None, statuses=("held",)):
+        where, params = self._reservation_where(recipient_id, statuses)
+        return self._connect().execute(f"SELECT COUNT(*) FROM reservations r{where}", params).fetchone()[0]
+
+    @staticmethod
+    def _reservation_where(recipient_id, statuses, before=None):
+        clauses, params = [], []
+        if before is not None:
+            clauses.append("r.id < ?")
+            params.append(int(before))
+        if recipient_id is not None:
+            clauses.append("r.recipient_id = ?")
+            params.append(recipient_id)
+        if statuses is not None:
+            clauses.append("r.status IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(list(statuses)))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    # ---- notification outbox ----
+    @staticmethod
+    def _enqueue(conn, event, audience, payload):
+        # Runs inside the caller's transaction: the notice exists iff the change committed
+        conn.execute(
+            "INSERT INTO outbox (event, audience, payload, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, datetime('now'), datetime('now'))",
+            (event, audience, json.dumps(payload))
+        )
+
+    @classmethod
+    def _enqueue_for_donor(cls, conn, event, med_id, payload):
+        med = conn.execute("SELECT donor_id, name FROM medicines WHERE id = ?", (int(med_id),)).fetchone()
+        if med is not None and med["donor_id"]:
+            cls._enqueue(conn, event, f"user:{med['donor_id']}", {**payload, "name": med["name"]})
+
+    def claim_outbox(self, limit, lease_seconds):
+        # Leases due rows to the caller. A worker that dies mid-delivery lets
+        # its lease lapse and the rows become due again for any other process.
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "UPDATE outbox SET status = 'sending', next_attempt_at = datetime('now', ?) "
+                "WHERE id IN (SELECT id FROM outbox WHERE status IN ('queued', 'sending') "
+                "AND next_attempt_at <= datetime('now') ORDER BY id LIMIT ?) "
+                f"RETURNING {', '.join(OUTBOX_COLUMNS)}",
+                (f"+{int(lease_seconds)} seconds", int(limit))
+            ).fetchall()
+            channels = defaultdict(dict)
+            for d in conn.execute(
+                "SELECT outbox_id, channel, status FROM outbox_deliveries "
+                "WHERE outbox_id IN (SELECT value FROM json_each(?))", (json.dumps([row["id"] for row in rows]),)
+            ):
+                channels[d["outbox_id"]][d["channel"]] = d["status"]
+        return [{**dict(row), "payload": json.loads(row["payload"]), "channels": channels[row["id"]]} for row in rows]
+
+    def outbox_deliveries(self, outbox_id, results):
+        # results: {channel: (status, error)} for the channels one attempt tried
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO outbox_deliveries (outbox_id, channel, status, attempts, last_error, updated_at) "
+                "VALUES (?, ?, ?, 1, ?, datetime('now')) "
+                "ON CONFLICT (outbox_id, channel) DO UPDATE SET status = excluded.status, "
+                "attempts = attempts + 1, last_error = excluded.last_error, updated_at = excluded.updated_at",
+                [(int(outbox_id), channel, status, str(error or "")[:500])
+                 for channel, (status, error) in results.items()]
+            )
+
+    def delivery_status(self, outbox_id):
+        rows = self._connect().execute(
+            "SELECT channel, status, attempts, last_error FROM outbox_deliveries WHERE outbox_id = ? ORDER BY channel",
+            (int(outbox_id),)
+        )
+        return {r["channel"]: dict(r) for r in rows}
+
+    def outbox_sent(self, outbox_ids):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'sent', sent_at = datetime('now'), attempts = attempts + 1 "
+                "WHERE id IN (SELECT value FROM json_each(?))", (json.dumps([int(i) for i in outbox_ids]),)
+            )
+
+    def outbox_retry(self, outbox_id, error, delay_seconds):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'queued', attempts = attempts + 1, last_error = ?, "
+                "next_attempt_at = datetime('now', ?) WHERE id = ?",
+                (str(error)[:500], f"+{int(delay_seconds)} seconds", int(outbox_id))
+            )
+
+    def outbox_failed(self, outbox_id, error):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                (str(error)[:500], int(outbox_id))
+            )
+
+    def outbox_fan_out(self, outbox_id, audiences):
+        # Replaces a group notice with one row per member, so a retry never
+        # re-sends to members that were already reached
+        with self._transaction() as conn:
+            row = conn.execute("SELECT event, payload FROM outbox WHERE id = ?", (int(outbox_id),)).fetchone()
+            conn.executemany(
+                "INSERT INTO outbox (event, audience, payload, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, datetime('now'), datetime('now'))",
+                [(row["event"], audience, row["payload"]) for audience in audiences]
+            )
+            conn.execute("UPDATE outbox SET status = 'sent', sent_at = datetime('now') WHERE id = ?", (int(outbox_id),))
+
+    def outbox_summary(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+        return {r[0]: r[1] for r in rows}
+
+    def list_outbox(self, limit=200):
+        return pd.DataFrame.from_records(
+            [dict(r) for r in self._connect().execute(
+                f"SELECT {', '.join(OUTBOX_COLUMNS)} FROM outbox ORDER BY id DESC LIMIT ?", (int(limit),)
+            )],
+            columns=OUTBOX_COLUMNS
+        )
+
+    def audit_log(self, limit=200, med_id=None):
+        sql = "SELECT medicine_id, old_status, new_status, actor, changed_at FROM status_audit"
+        params = []
+        if med_id is not None:
+            sql += " WHERE medicine_id = ?"
+            params.append(int(med_id))
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(int(limit))
+        return pd.DataFrame.from_records(
+            [dict(r) for r in self._connect().execute(sql, params)],
+            columns=["medicine_id", "old_status", "new_status", "actor", "changed_at"]
+        )
+
+
+    # ---- change feed ----
+    @staticmethod
+    def _change_seq(conn):
+        # Pruning never removes the newest row, so seq keeps counting up without reuse
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+    def change_seq(self):
+        # Position of the newest committed change; a feed started here sees everything after
+        return self._change_seq(self._connect())
+
+    def changes_since(self, seq, limit=CHANGE_BATCH):
+        return [tuple(row) for row in self._connect().execute(
+            "SELECT seq, kind, row_id FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?", (int(seq), int(limit))
+        )]
+
+    def prune_changes(self, before_seq):
+        # Never the newest row, which is what keeps seq from being reused
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM change_log WHERE seq < MIN(?, (SELECT MAX(seq) FROM change_log))",
+                                (int(before_seq),)).rowcount
+
+
+class ChangeFeed(threading.Thread):
+    # Polls the change log and hands rows other processes changed to this
+    # process's listeners, the same way its own writes reach them, so the
+    # in-memory views catch up from the changed rows alone. Construct it
+    # before building the views it keeps current: changes committed while
+    # they load are replayed, and listeners treat a replay as an upsert.
+    def __init__(self, store, interval=CHANGE_POLL_SECONDS, batch=CHANGE_BATCH):
+        super().__init__(name="change-feed", daemon=True)
+        self.store = store
+        self.interval = interval
+        self.batch = batch
+        self.seq = store.change_seq()
+        if store._own_changes is None:
+            store._own_changes = deque()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except sqlite3.Error:
+                logger.exception("Change feed poll failed")
+
+    def poll(self):
+        # Returns how many changed rows were handed to the listeners
+        applied = 0
+        own = self.store._own_changes
+        while True:
+            changes = self.store.changes_since(self.seq, self.batch)
+            if not changes:
+                return applied
+            if changes[0][0] != self.seq + 1:
+                # Sequence numbers are gapless, so a gap means the rows were pruned
+                logger.warning("Change feed fell behind the log (seq %d -> %d); reloading", self.seq, changes[0][0])
+                self.resync()
+                self.seq = changes[-1][0]
+                continue
+            med_ids, request_ids = set(), set()
+            for seq, kind, row_id in changes:
+                while own and own[0][1] < seq:
+                    own.popleft()
+                # This process already applied its own writes when it committed them
+                if own and own[0][0] < seq <= own[0][1]:
+                    continue
+                (med_ids if kind == "medicine" else request_ids).add(row_id)
+            self.store._notify(sorted(med_ids))
+            self.store._notify_requests(sorted(request_ids))
+            applied += len(med_ids) + len(request_ids)
+            self.seq = changes[-1][0]
+
+    def resync(self):
+        ids = sorted(self.store.medicine_ids())
+        for start in range(0, len(ids), self.batch):
+            self.store._notify(ids[start:start + self.batch])
+        self.store._notify_requests([r["id"] for r in self.store.list_requests(statuses=OPEN_REQUEST_STATUSES)])
+
+    def stop(self):
+        self._stopped.set()
+
+
+class ExpirySweeper(threading.Thread):
+    # Background thread that returns timed-out reservations and lapsed request
+    # matches every minute and sweeps expired stock on a longer fixed interval
+    def __init__(self, store, interval=SWEEP_INTERVAL_SECONDS, reservation_interval=RESERVATION_SWEEP_SECONDS):
+        super().__init__(name="expiry-sweeper", daemon=True)
+        self.store = store
+        self.interval = interval
+        self.reservation_interval = reservation_interval
+        # (time, change seq) at each sweep; the log is pruned up to the mark older than the retention
+        self._change_marks = deque()
+        self._stopped = threading.Event()
+
+    def run(self):
+        next_sweep = 0
+        while not self._stopped.is_set():
+            try:
+                released = self.store.expire_reservations()
+                if released:
+                    logger.info("Expired %d reservations", len(released))
+                reopened = self.store.expire_matches()
+                if reopened:
+                    logger.info("Matches lapsed for %d requests", len(reopened))
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + self.interval
+                    swept = self.store.sweep_expired()
+                    if swept:
+                        logger.info("Expired %d medicines", len(swept))
+                    self._prune_changes()
+            except sqlite3.Error:
+                logger.exception("Expiry sweep failed")
+            self._stopped.wait(min(self.interval, self.reservation_interval))
+
+    def _prune_changes(self):
+        now = time.monotonic()
+        self._change_marks.append((now, self.store.change_seq()))
+        cutoff = None
+        while self._change_marks and self._change_marks[0][0] <= now - CHANGE_RETENTION_HOURS * 3600:
+            cutoff = self._change_marks.popleft()[1]
+        if cutoff is not None:
+            self.store.prune_changes(cutoff)
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,110 @@
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+# ====================
+# CAMPUS LOCATION REGISTRY
+# ====================
+# Every pickup point with its campus and coordinates, plus a walking-distance
+# matrix computed once at load. Ranking looks distances up by the categorical
+# location codes of a medicines frame, so it costs the same per row whether
+# the registry has four buildings or several campuses' worth.
+
+LOCATIONS_PATH = os.environ.get("AROGYA_LOCATIONS_PATH", "")
+
+DEFAULT_LOCATIONS = [
+    {"name": "College Medical Room", "campus": "Main Campus", "lat": 26.85000, "lon": 80.95000},
+    {"name": "Hostel A", "campus": "Main Campus", "lat": 26.85120, "lon": 80.94890},
+    {"name": "Hostel B", "campus": "Main Campus", "lat": 26.84890, "lon": 80.95210},
+    {"name": "Faculty Block", "campus": "Main Campus", "lat": 26.85060, "lon": 80.95100},
+]
+
+EARTH_RADIUS_M = 6_371_000
+# Paths are longer than the straight line between two buildings
+WALKING_FACTOR = 1.3
+
+# Recommendation score weights; each term is scaled to 0..1
+DISTANCE_WEIGHT = 0.6
+EXPIRY_WEIGHT = 0.25
+QUANTITY_WEIGHT = 0.15
+DISTANCE_SCALE_M = 500     # proximity term is 1 on site and 0.5 at 500 m
+EXPIRY_SCALE_DAYS = 60     # stock expiring sooner ranks higher, so less goes to waste
+QUANTITY_CAP = 50          # more than this many units adds nothing
+
+
+class LocationRegistry:
+    def __init__(self, locations, walking_m=()):
+        self.locations = list(locations)
+        self.names = [loc["name"] for loc in self.locations]
+        self._index = {name: i for i, name in enumerate(self.names)}
+        lat = np.radians([loc["lat"] for loc in self.locations])
+        lon = np.radians([loc["lon"] for loc in self.locations])
+        # Pairwise haversine distance, vectorized over the whole registry
+        dlat = lat[:, None] - lat[None, :]
+        dlon = lon[:, None] - lon[None, :]
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin(dlon / 2) ** 2
+        self.matrix = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1))) * WALKING_FACTOR
+        # Measured walking distances override the estimate
+        for origin, destination, meters in walking_m:
+            i, j = self._index[origin], self._index[destination]
+            self.matrix[i, j] = self.matrix[j, i] = meters
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def campus(self, name):
+        return self.locations[self._index[name]]["campus"]
+
+    def distance(self, origin, destination):
+        if origin not in self._index or destination not in self._index:
+            return math.inf
+        return float(self.matrix[self._index[origin], self._index[destination]])
+
+    def distances_to(self, origin, names):
+        # Distance from origin to each of names; unknown names are infinitely far
+        row = self.matrix[self._index[origin]] if origin in self._index else None
+        return np.array([row[self._index[n]] if row is not None and n in self._index else math.inf for n in names])
+
+    @classmethod
+    def load(cls, path=LOCATIONS_PATH):
+        # {"locations": [{name, campus, lat, lon}], "walking_m": [[from, to, meters]]}
+        if not path:
+            return cls(DEFAULT_LOCATIONS)
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["locations"], data.get("walking_m", ()))
+
+
+REGISTRY = LocationRegistry.load()
+
+
+def recommendation_scores(frame, origin, today, registry=REGISTRY):
+    # One 0..1 score per row: near, soon-expiring, well-stocked medicines first.
+    # Distances are looked up once per location category, then by row code.
+    location = frame["location"]
+    if not isinstance(location.dtype, pd.CategoricalDtype):
+        location = location.astype("category")
+    # A trailing inf catches code -1 (missing location)
+    per_category = np.append(registry.distances_to(origin, location.cat.categories), math.inf)
+    distance = per_category[location.cat.codes.to_numpy()]
+    proximity = 1 / (1 + distance / DISTANCE_SCALE_M)
+
+    days_left = (pd.to_datetime(frame["expiry"]) - pd.Timestamp(today)).dt.days.clip(lower=0).to_numpy()
+    freshness = 1 / (1 + days_left / EXPIRY_SCALE_DAYS)
+    reservable = (frame["available_quantity"] - frame["promised_quantity"]).to_numpy()
+    supply = np.minimum(reservable, QUANTITY_CAP) / QUANTITY_CAP
+
+    score = DISTANCE_WEIGHT * proximity + EXPIRY_WEIGHT * freshness + QUANTITY_WEIGHT * supply
+    return pd.Series(score, index=frame.index)
+
+
+def rank_by_recommendation(frame, origin, today, registry=REGISTRY):
+    # Medicine ids, best score first; ties go to the lower id so paging is stable
+    if frame.empty:
+        return []
+    scores = recommendation_scores(frame, origin, today, registry)
+    order = np.lexsort((frame["id"].to_numpy(), -scores.to_numpy()))
+    return frame["id"].to_numpy()[order].tolist()
@@ -0,0 +1,191 @@
+import datetime
+import heapq
+import threading
+from collections import Counter, defaultdict
+
+from inventory_store import OPEN_REQUEST_STATUSES, URGENCY_LEVELS
+from search_index import MIN_SIMILARITY, trigrams
+
+# ====================
+# REQUEST MATCHING ENGINE
+# ====================
+# Pairs recipient requests with approved stock in both directions without
+# scanning one side against the other:
+#   * a new request looks its drug up in the medicines trigram index;
+#   * newly approved stock looks its name up in an inverted trigram index of
+#     the open requests, so only requests sharing trigrams are considered.
+# Units are promised through InventoryStore.allocate_request, which is the
+# single place that checks what is still unclaimed.
+
+URGENCY_RANK = {level: rank for rank, level in enumerate(URGENCY_LEVELS)}
+
+# Approved medicines planned and allocated per transaction
+MATCH_BATCH = 500
+
+# Stock that no longer counts for requests once it reaches these statuses
+RELEASED_STATUSES = ("rejected", "expired")
+
+
+class MatchingEngine:
+    def __init__(self, store, search_index, min_similarity=MIN_SIMILARITY):
+        self.store = store
+        self.search_index = search_index
+        self.min_similarity = min_similarity
+        self._postings = defaultdict(set)  # trigram -> open request ids
+        self._open = {}                    # request id -> (trigrams, request, min hits, priority)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._open)
+
+    def load(self):
+        # Indexes every open request and catches up on stock approved while no
+        # engine was listening (restarts, approvals made by another process)
+        with self._lock:
+            self._postings.clear()
+            self._open.clear()
+        for request in self.store.list_requests(statuses=OPEN_REQUEST_STATUSES):
+            self.match_request(request["id"])
+
+    def _track(self, request):
+        grams = trigrams(request["drug"])
+        with self._lock:
+            self._untrack(request["id"])
+            if request["status"] not in OPEN_REQUEST_STATUSES or not grams:
+                return
+            for gram in grams:
+                self._postings[gram].add(request["id"])
+            priority = (URGENCY_RANK.get(request["urgency"], len(URGENCY_RANK)), request["created_at"], request["id"])
+            self._open[request["id"]] = (grams, request, self.min_similarity * len(grams), priority)
+
+    def _untrack(self, request_id):
+        entry = self._open.pop(request_id, None)
+        if entry is None:
+            return
+        for gram in entry[0]:
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(request_id)
+                if not posting:
+                    del self._postings[gram]
+
+    # ---- request side ----
+    def submit(self, request):
+        # Stores a new request and matches it against current stock straight away.
+        # Returns (request_id, [(medicine_id, units)]).
+        request_id = self.store.create_request(request)
+        allocations = self.match_request(request_id)
+        return request_id, allocations
+
+    def match_request(self, request_id):
+        requests = self.store.get_requests([request_id])
+        if not requests or requests[0]["status"] not in OPEN_REQUEST_STATUSES:
+            return []
+        request = requests[0]
+        ranked = self.search_index.search(request["drug"], status="approved",
+                                          min_similarity=self.min_similarity)
+        allocations = []
+        if ranked:
+            eligible = self.store.medicine_ids(
+                ids=ranked, status="approved", available=True, expires_from=datetime.date.today(),
+                category=request["category"] or None, location=request["location"] or None
+            )
+            candidates = [med_id for med_id in ranked if med_id in eligible]
+            allocations = self.store.allocate_request(request_id, candidates)
+        self._track(self.store.get_requests([request_id])[0])
+        return allocations
+
+    def cancel(self, request_id, recipient_id=None):
+        # Freed stock comes back through the store listener and is re-offered there
+        with self._lock:
+            self._untrack(request_id)
+        return self.store.cancel_request(request_id, recipient_id)
+
+    # ---- stock side ----
+    def candidate_requests(self, med, cache=None):
+        # Yields open requests whose drug trigrams are mostly covered by this
+        # medicine, most urgent and then oldest first. Ordering is a lazy heap,
+        # so a medicine whose units run out after a few requests never pays for
+        # sorting the rest. Stock rows often share a name, so callers matching a
+        # batch pass a cache of the trigram step per name. Callers hold the lock.
+        key = (med.get("name"), med.get("category"))
+        similar = cache.get(key) if cache is not None else None
+        if similar is None:
+            similar = self._similar_requests(*key)
+            if cache is not None:
+                cache[key] = similar
+        heap = list(similar)
+        heapq.heapify(heap)
+        while heap:
+            entry = self._open.get(heapq.heappop(heap)[1])
+            if entry is None:
+                continue
+            request = entry[1]
+            if request["category"] and request["category"] != med.get("category"):
+                continue
+            if request["location"] and request["location"] != med.get("location"):
+                continue
+            yield request
+
+    def _similar_requests(self, name, category):
+        hits = Counter()
+        for gram in trigrams(name) | trigrams(category):
+            hits.update(self._postings.get(gram, ()))
+        open_requests = self._open
+        return [(open_requests[request_id][3], request_id) for request_id, count in hits.items()
+                if count >= open_requests[request_id][2]]
+
+    def match_stock(self, medicines):
+        # Offers approved medicines to the waiting requests, most urgent first.
+        # Each batch is planned in memory from the index, so a medicine is only
+        # offered to as many requests as its units can cover, and requests the
+        # plan fills leave the index straight away. The store then allocates the
+        # plan in one transaction, skipping whatever ran out in the meantime.
+        today = datetime.date.today().isoformat()
+        fresh = [med for med in medicines
+                 if med.get("status") == "approved" and str(med.get("expiry", ""))[:10] >= today]
+        matched = []
+        for start in range(0, len(fresh), MATCH_BATCH):
+            if not self._open:
+                break
+            batch = fresh[start:start + MATCH_BATCH]
+            lapsed = self.store.lapsed_requests([med["id"] for med in batch])
+            plan, need, cache = [], {}, {}
+            with self._lock:
+                for med in batch:
+                    units = med["available_quantity"] - med.get("promised_quantity", 0)
+                    for request in self.candidate_requests(med, cache):
+                        if request["id"] in lapsed.get(med["id"], ()):
+                            continue
+                        wanted = need.setdefault(request["id"], request["quantity"] - request["matched_quantity"])
+                        take = min(wanted, units)
+                        plan.append((request["id"], [med["id"]]))
+                        need[request["id"]] -= take
+                        units -= take
+                        if need[request["id"]] <= 0:
+                            self._untrack(request["id"])
+                        if units <= 0:
+                            break
+            allocations = self.store.allocate_requests(plan)
+            # Re-read every planned request: the plan was optimistic and another
+            # process may have matched or cancelled some of them
+            for request in self.store.get_requests(list(need)):
+                self._track(request)
+            matched += list(allocations)
+        return matched
+
+    def apply_request_changes(self, requests):
+        # Request listener: requests whose promises lapsed, or that another process
+        # created, matched or cancelled, join or leave this process's index
+        for request in requests:
+            self._track(request)
+
+    def apply_changes(self, medicines):
+        # Store listener: new approvals and units returned by cancelled or
+        # expired reservations are matched, stock leaving the approved pool
+        # releases its promises and those requests are matched again
+        released = [med["id"] for med in medicines if med.get("status") in RELEASED_STATUSES]
+        if released:
+            for request_id in self.store.release_medicines(released):
+                self.match_request(request_id)
+        self.match_stock(medicines)
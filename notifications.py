@@ -0,0 +1,309 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from email.message import EmailMessage
+
+# ====================
+# NOTIFICATION DELIVERY
+# ====================
+# The store writes notices to the outbox table in the same transaction as the
+# change they describe. NotificationWorker is a background thread running an
+# asyncio loop that leases due rows in batches, renders them and hands them to
+# the configured senders concurrently, so no Streamlit rerun ever waits on a
+# network call. Delivery is tracked per channel: a retry (exponential backoff,
+# up to MAX_ATTEMPTS) re-sends only on the channels that have not gone
+# through, and a row fails only when every channel did. Each channel is rate
+# limited by its own token bucket.
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH = 50
+OUTBOX_LEASE_SECONDS = 120       # a claimed row is redelivered if not settled by then
+OUTBOX_POLL_SECONDS = 2
+DELIVERY_CONCURRENCY = 8
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 30        # 30 s, 1 min, 2 min, ... plus jitter
+BACKOFF_MAX_SECONDS = 3600
+SEND_TIMEOUT_SECONDS = 15
+
+# channel -> (messages per second, burst)
+RATE_LIMITS = {"whatsapp": (10, 20), "sms": (1, 5), "email": (5, 10), "stub": (1000, 1000)}
+
+TEMPLATES = {
+    "donation_submitted": "New donation waiting for approval: {name} × {quantity} from {donor}.",
+    "donations_imported": "{count} donations from {donor} were imported and are waiting for approval.",
+    "donation_status": "Your donation{plural} {names}{more} {verb} {status}.",
+    "request_matched": "Good news: {units} units were found for your request for {drug} (#{request_id}).",
+    "reservation_created": "{recipient} reserved {units} units of your {name} (reservation #{reservation_id}).",
+    "reservation_expired": "Your reservation #{reservation_id} for {units} units of {name} expired and was released.",
+    "reservation_fulfilled": "{units} units of your {name} were handed over to a recipient. Thank you!",
+}
+
+
+class DeliveryError(Exception):
+    # permanent errors (bad number, unknown user) are not retried
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def render(event, payload):
+    if event == "donation_status":
+        names = payload.get("names", [])
+        extra = payload.get("count", len(names)) - len(names)
+        payload = {**payload, "names": ", ".join(names), "plural": "s" if payload.get("count", 1) > 1 else "",
+                   "more": f" and {extra} more" if extra > 0 else "",
+                   "verb": "were" if payload.get("count", 1) > 1 else "was"}
+    template = TEMPLATES.get(event)
+    if template is None:
+        raise DeliveryError(f"No template for event {event}", permanent=True)
+    try:
+        return template.format(**payload)
+    except KeyError as e:
+        raise DeliveryError(f"Missing {e} for event {event}", permanent=True)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ---- senders ----
+# A sender has a channel name, the contact field it needs and an async
+# send(contact, text). Blocking client libraries run in a worker thread.
+
+class LocalStubSender:
+    # Default when no provider is configured: records messages and logs them
+    channel = "stub"
+    contact_field = "phone"
+
+    def __init__(self, fail=None):
+        self.sent = []
+        self.fail = fail  # optional callable(contact, text) that raises, for exercising retries
+
+    async def send(self, contact, text):
+        if self.fail is not None:
+            self.fail(contact, text)
+        self.sent.append((contact, text))
+        logger.info("Notification to %s: %s", contact, text)
+
+
+def _post(url, data, headers):
+    request = urllib.request.Request(url, data=data, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=SEND_TIMEOUT_SECONDS) as response:
+            return response.read()
+    except urllib.error.HTTPError as e:
+        # 4xx other than throttling means the message itself is wrong
+        raise DeliveryError(f"HTTP {e.code} from {urllib.parse.urlsplit(url).netloc}",
+                            permanent=400 <= e.code < 500 and e.code != 429)
+    except (urllib.error.URLError, TimeoutError) as e:
+        raise DeliveryError(str(e))
+
+
+class WhatsAppCloudSender:
+    channel = "whatsapp"
+    contact_field = "phone"
+
+    def __init__(self, token, phone_number_id, api_url="https://graph.facebook.com/v18.0"):
+        self.url = f"{api_url}/{phone_number_id}/messages"
+        self.headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+    async def send(self, contact, text):
+        body = json.dumps({"messaging_product": "whatsapp", "to": contact, "type": "text", "text": {"body": text}})
+        await asyncio.to_thread(_post, self.url, body.encode(), self.headers)
+
+
+class TwilioSmsSender:
+    channel = "sms"
+    contact_field = "phone"
+
+    def __init__(self, account_sid, auth_token, from_number):
+        self.url = f"https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json"
+        credentials = base64.b64encode(f"{account_sid}:{auth_token}".encode()).decode()
+        self.headers = {"Authorization": f"Basic {credentials}", "Content-Type": "application/x-www-form-urlencoded"}
+        self.from_number = from_number
+
+    async def send(self, contact, text):
+        body = urllib.parse.urlencode({"To": f"+{contact.lstrip('+')}", "From": self.from_number, "Body": text})
+        await asyncio.to_thread(_post, self.url, body.encode(), self.headers)
+
+
+class SmtpEmailSender:
+    channel = "email"
+    contact_field = "email"
+
+    def __init__(self, host, port, username, password, from_address):
+        self.host, self.port = host, int(port)
+        self.username, self.password = username, password
+        self.from_address = from_address
+
+    def _send(self, contact, text):
+        message = EmailMessage()
+        message["From"], message["To"], message["Subject"] = self.from_address, contact, "ArogyaMitram update"
+        message.set_content(text)
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=SEND_TIMEOUT_SECONDS) as smtp:
+                smtp.starttls()
+                if self.username:
+                    smtp.login(self.username, self.password)
+                smtp.send_message(message)
+        except smtplib.SMTPRecipientsRefused as e:
+            raise DeliveryError(str(e), permanent=True)
+        except (smtplib.SMTPException, OSError) as e:
+            raise DeliveryError(str(e))
+
+    async def send(self, contact, text):
+        await asyncio.to_thread(self._send, contact, text)
+
+
+def senders_from_env(environ=os.environ):
+    # Each provider is enabled by its credentials; none configured means the local stub
+    senders = []
+    if environ.get("WHATSAPP_TOKEN"):
+        senders.append(WhatsAppCloudSender(environ["WHATSAPP_TOKEN"], environ["WHATSAPP_PHONE_NUMBER_ID"]))
+    if environ.get("TWILIO_ACCOUNT_SID"):
+        senders.append(TwilioSmsSender(environ["TWILIO_ACCOUNT_SID"], environ["TWILIO_AUTH_TOKEN"],
+                                       environ["TWILIO_FROM_NUMBER"]))
+    if environ.get("SMTP_HOST"):
+        senders.append(SmtpEmailSender(environ["SMTP_HOST"], environ.get("SMTP_PORT", 587),
+                                       environ.get("SMTP_USERNAME", ""), environ.get("SMTP_PASSWORD", ""),
+                                       environ.get("SMTP_FROM", "noreply@arogyamitram.local")))
+    return senders or [LocalStubSender()]
+
+
+class StaticDirectory:
+    # Resolves audiences against the app's user table: "user:<id>" is one
+    # person, "role:<role>" everyone holding that role
+    def __init__(self, users):
+        self.users = {user["id"]: user for user in users}
+
+    def members(self, audience):
+        kind, _, value = audience.partition(":")
+        if kind == "role":
+            return [f"user:{user['id']}" for user in self.users.values() if user.get("role") == value]
+        return [audience]
+
+    def contact(self, audience):
+        kind, _, value = audience.partition(":")
+        return self.users.get(value) if kind == "user" else None
+
+
+class NotificationWorker(threading.Thread):
+    def __init__(self, store, directory, senders=None, batch=OUTBOX_BATCH, poll_interval=OUTBOX_POLL_SECONDS):
+        super().__init__(name="notification-worker", daemon=True)
+        self.store = store
+        self.directory = directory
+        self.senders = senders if senders is not None else senders_from_env()
+        self.batch = batch
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        asyncio.run(self._loop())
+
+    def stop(self):
+        self._stopped.set()
+
+    async def _loop(self):
+        limits = {sender.channel: TokenBucket(*RATE_LIMITS.get(sender.channel, (1, 1))) for sender in self.senders}
+        semaphore = asyncio.Semaphore(DELIVERY_CONCURRENCY)
+        while not self._stopped.is_set():
+            try:
+                delivered = await self.deliver_batch(limits, semaphore)
+            except Exception:
+                logger.exception("Notification batch failed")
+                delivered = 0
+            # A full batch means more is probably due; otherwise wait for new rows
+            if delivered < self.batch:
+                await asyncio.sleep(self.poll_interval)
+
+    async def deliver_batch(self, limits=None, semaphore=None):
+        # Leases up to one batch of due rows and settles each of them; returns how many were claimed
+        if limits is None:
+            limits = {sender.channel: TokenBucket(*RATE_LIMITS.get(sender.channel, (1, 1))) for sender in self.senders}
+        semaphore = semaphore or asyncio.Semaphore(DELIVERY_CONCURRENCY)
+        # Outbox bookkeeping is a local SQLite write and runs on the loop
+        # itself; only the senders' network calls go to threads
+        rows = self.store.claim_outbox(self.batch, OUTBOX_LEASE_SECONDS)
+        sent = []
+        await asyncio.gather(*(self._deliver(row, limits, semaphore, sent) for row in rows))
+        if sent:
+            self.store.outbox_sent(sent)
+        return len(rows)
+
+    async def _deliver(self, row, limits, semaphore, sent):
+        members = self.directory.members(row["audience"])
+        if members != [row["audience"]]:
+            self.store.outbox_fan_out(row["id"], members)
+            return
+        try:
+            text = render(row["event"], row["payload"])
+            user = self.directory.contact(row["audience"])
+            if user is None:
+                raise DeliveryError(f"Unknown audience {row['audience']}", permanent=True)
+            targets = [(sender, user.get(sender.contact_field)) for sender in self.senders]
+            targets = [(sender, contact) for sender, contact in targets if contact]
+            if not targets:
+                raise DeliveryError(f"No contact for {row['audience']}", permanent=True)
+        except Exception as e:
+            self._settle_failure(row, e, getattr(e, "permanent", False))
+            return
+        # Channels settled on an earlier attempt are not sent to again
+        settled = row.get("channels", {})
+        channels = {sender.channel: settled.get(sender.channel) for sender, _ in targets}
+        results, errors = {}, []
+        async with semaphore:
+            for sender, contact in targets:
+                if channels.get(sender.channel) in ("sent", "failed"):
+                    continue
+                try:
+                    await limits[sender.channel].acquire()
+                    await sender.send(contact, text)
+                except Exception as e:
+                    final = getattr(e, "permanent", False) or row["attempts"] + 1 >= MAX_ATTEMPTS
+                    results[sender.channel] = ("failed" if final else "queued", e)
+                    errors.append(f"{sender.channel}: {e}")
+                else:
+                    results[sender.channel] = ("sent", None)
+        if results:
+            self.store.outbox_deliveries(row["id"], results)
+        channels.update({channel: status for channel, (status, _) in results.items()})
+        if "queued" in channels.values():
+            self._settle_failure(row, "; ".join(errors), False)
+        elif "sent" in channels.values():
+            sent.append(row["id"])
+        else:
+            self._settle_failure(row, "; ".join(errors) or "Every channel failed", True)
+
+    def _settle_failure(self, row, error, permanent):
+        if permanent or row["attempts"] + 1 >= MAX_ATTEMPTS:
+            logger.warning("Notification %d failed for good: %s", row["id"], error)
+            self.store.outbox_failed(row["id"], error)
+            return
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** row["attempts"])
+        self.store.outbox_retry(row["id"], error, delay * random.uniform(0.8, 1.2))
@@ -0,0 +1,142 @@
+import datetime
+
+import pandas as pd
+
+from image_store import PLACEHOLDER_IMAGE
+from locations import rank_by_recommendation
+
+# ====================
+# PAGE DATA
+# ====================
+# The data side of each dashboard, free of Streamlit: what a page reads and
+# writes given plain arguments. Page functions render what these return, and
+# the benchmark suite calls them headlessly.
+
+# Average packaged weight of one donated unit, used for the waste estimate
+WASTE_GRAMS_PER_UNIT = 2
+
+
+def impact_summary(store):
+    # Totals come from ledger rollups, so reading them is O(1) at any volume.
+    # Stock approved and later rejected, expired or sent back is withdrawn again.
+    rollups = store.impact_rollups()
+    empty = {"events": 0, "quantity": 0, "value": 0}
+    approved, withdrawn, fulfilled = (rollups.get(event, empty) for event in ('approved', 'withdrawn', 'fulfilled'))
+    saved = approved['quantity'] - withdrawn['quantity']
+    return {
+        "total_medicines": saved,
+        "total_value": approved['value'] - withdrawn['value'],
+        "waste_prevented": saved * WASTE_GRAMS_PER_UNIT,
+        "lives_impacted": fulfilled['events'],
+        "units_handed_over": fulfilled['quantity'],
+        "student_savings": fulfilled['value']
+    }
+
+
+# ---- find medicines ----
+def recipient_filters(category=None, location=None, expiring_days=None, today=None):
+    # Anything past its date is hidden even before the sweeper gets to it
+    today = today or datetime.date.today()
+    return {
+        "status": "approved",
+        "available": True,
+        "category": category,
+        "location": location,
+        "expires_from": today,
+        "expires_to": None if expiring_days is None else today + datetime.timedelta(days=expiring_days)
+    }
+
+
+def inventory_mask(frame, filters, ids=None):
+    # The recipient listing filters, evaluated on an in-memory medicines frame
+    mask = (frame['status'] == filters['status']) & (frame['available_quantity'] - frame['promised_quantity'] > 0)
+    mask &= frame['expiry'] >= pd.Timestamp(filters['expires_from'])
+    if filters.get('expires_to') is not None:
+        mask &= frame['expiry'] <= pd.Timestamp(filters['expires_to'])
+    for column in ('category', 'location'):
+        if filters.get(column) is not None:
+            mask &= frame[column] == filters[column]
+    if ids is not None:
+        mask &= frame['id'].isin(ids)
+    return mask
+
+
+def find_medicine_ids(store, filters, ranked_ids=None, sort="expiry", table=None, origin=None, today=None):
+    # Returns (total, ids in display order). Ids are only materialized for
+    # the ranked sorts; plain sorts page straight from the store.
+    if sort == "recommended":
+        # Scored over the in-memory inventory; the page itself is re-read from the store
+        candidates = table.select(lambda part: inventory_mask(part, filters, ranked_ids))
+        ranked_ids = rank_by_recommendation(candidates, origin, today or datetime.date.today())
+        return len(ranked_ids), ranked_ids
+    if sort == "relevance":
+        # Page through the index ranking, keeping only ids that pass the filters
+        matching = store.medicine_ids(ids=ranked_ids, **filters)
+        ranked_ids = [med_id for med_id in ranked_ids if med_id in matching]
+        return len(ranked_ids), ranked_ids
+    return store.count_medicines(ids=ranked_ids, **filters), ranked_ids
+
+
+def find_medicines_page(store, filters, ranked_ids, sort, offset, limit):
+    if sort in ("relevance", "recommended"):
+        page_ids = ranked_ids[offset:offset + limit]
+        rank = {med_id: i for i, med_id in enumerate(page_ids)}
+        return store.list_medicines(ids=page_ids, **filters).sort_values('id', key=lambda ids: ids.map(rank))
+    return store.list_medicines(ids=ranked_ids, sort=sort, limit=limit, offset=offset, **filters)
+
+
+# ---- donations ----
+def save_upload(image_store, data):
+    # Returns a short content-hash reference; the renditions live on disk
+    if data is None:
+        return PLACEHOLDER_IMAGE
+    try:
+        return image_store.save(data)
+    except Exception:
+        return PLACEHOLDER_IMAGE
+
+
+def donation_record(user, name, description, quantity, expiry, category, value, location, prescription, image,
+                    today=None):
+    return {
+        "name": name, "description": description,
+        "quantity": quantity, "expiry": expiry.strftime("%Y-%m-%d"),
+        "donor": user['name'], "donor_id": user['id'], "donor_contact": user['phone'],
+        "location": location, "status": "pending", "category": category,
+        "value": value, "image": image,
+        "prescription": prescription, "added_date": (today or datetime.date.today()).strftime("%Y-%m-%d")
+    }
+
+
+# ---- analytics ----
+def counters_frame(counts, label):
+    frame = pd.DataFrame(list(counts.items()), columns=[label, 'Count'])
+    return frame.sort_values('Count', ascending=False, kind='stable')
+
+
+def monthly_counts_frame(month_counts):
+    # Fill the gaps between the first and last month with zero-count buckets
+    if not month_counts:
+        return pd.DataFrame({'Month': pd.Series(dtype='datetime64[ns]'), 'Count': pd.Series(dtype=int)})
+    counts = pd.Series(month_counts)
+    counts.index = pd.PeriodIndex(counts.index, freq='M')
+    months = pd.period_range(counts.index.min(), counts.index.max(), freq='M')
+    counts = counts.reindex(months, fill_value=0)
+    return pd.DataFrame({'Month': months.to_timestamp(), 'Count': counts.values})
+
+
+def recent_months_frame(month_counts, today=None, periods=12):
+    # Last twelve months of donations, oldest first
+    months = pd.period_range(end=pd.Period(today or datetime.date.today(), freq='M'), periods=periods, freq='M')
+    return pd.DataFrame({
+        "Month": [m.strftime("%b %Y") for m in months],
+        "Donations": [month_counts.get(str(m), 0) for m in months]
+    })
+
+
+def analytics_frames(status_counts, category_counts, month_counts):
+    return {
+        "status": counters_frame(status_counts, 'Status'),
+        "category": counters_frame(category_counts, 'Category'),
+        "timeline": monthly_counts_frame(month_counts),
+    }
@@ -0,0 +1,244 @@
+import bisect
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ====================
+# TIMING SPANS
+# ====================
+# Cheap in-process latency tracking. Every span lands in a log-bucketed
+# histogram for its (kind, name), kept as one slot per minute over a rolling
+# window, so recording is a bisect and an increment and quantiles cover
+# only recent reruns. Snapshots can be written to a file or served in the
+# Prometheus text format.
+
+logger = logging.getLogger(__name__)
+
+SLOT_SECONDS = 60
+WINDOW_SLOTS = 15                  # quantiles cover the last 15 minutes
+BUCKETS_PER_DECADE = 20            # ~12% relative error on reported quantiles
+MIN_SECONDS, MAX_SECONDS = 1e-5, 1e3
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Periodic export only runs when a path is configured; the admin page can always export on demand
+PERF_EXPORT_ENABLED = "AROGYA_PERF_EXPORT_PATH" in os.environ
+PERF_EXPORT_PATH = os.environ.get(
+    "AROGYA_PERF_EXPORT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "perf.prom")
+)
+METRICS_PORT = int(os.environ.get("AROGYA_METRICS_PORT", "0") or 0)
+EXPORT_INTERVAL_SECONDS = 60
+
+BUCKET_BOUNDS = [MIN_SECONDS * 10 ** (i / BUCKETS_PER_DECADE)
+                 for i in range(round(BUCKETS_PER_DECADE * math.log10(MAX_SECONDS / MIN_SECONDS)) + 1)]
+
+
+class _Slot:
+    __slots__ = ("minute", "counts", "count", "total", "max")
+
+    def __init__(self, minute):
+        self.minute = minute
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class RollingHistogram:
+    def __init__(self):
+        self._slots = deque()
+
+    def record(self, seconds, now):
+        minute = int(now // SLOT_SECONDS)
+        if not self._slots or self._slots[-1].minute != minute:
+            self._slots.append(_Slot(minute))
+            self._expire(minute)
+        slot = self._slots[-1]
+        slot.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        slot.count += 1
+        slot.total += seconds
+        slot.max = max(slot.max, seconds)
+
+    def _expire(self, minute):
+        while self._slots and self._slots[0].minute <= minute - WINDOW_SLOTS:
+            self._slots.popleft()
+
+    def summary(self, now):
+        self._expire(int(now // SLOT_SECONDS))
+        if not self._slots:
+            return None
+        counts = [sum(column) for column in zip(*(slot.counts for slot in self._slots))]
+        count = sum(slot.count for slot in self._slots)
+        result = {
+            "count": count,
+            "sum_s": sum(slot.total for slot in self._slots),
+            "max_s": max(slot.max for slot in self._slots),
+        }
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}_s"] = min(self._quantile(counts, count, q), result["max_s"])
+        return result
+
+    @staticmethod
+    def _quantile(counts, count, q):
+        # Upper bound of the bucket holding the q-th observation
+        rank, seen = q * count, 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank and n:
+                return BUCKET_BOUNDS[min(i, len(BUCKET_BOUNDS) - 1)]
+        return BUCKET_BOUNDS[-1]
+
+
+class PerfRegistry:
+    def __init__(self, clock=time.time):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def record(self, kind, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get((kind, name))
+            if histogram is None:
+                histogram = self._histograms[(kind, name)] = RollingHistogram()
+            histogram.record(seconds, self._clock())
+
+    @contextmanager
+    def span(self, kind, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Recorded even when the block raises: st.rerun() and st.stop() unwind through spans
+            self.record(kind, name, time.perf_counter() - start)
+
+    def timed(self, kind, name=None):
+        def decorate(fn):
+            label = name or fn.__name__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(kind, label):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def snapshot(self):
+        # One row per (kind, name) seen in the window, milliseconds, slowest p95 first
+        now = self._clock()
+        with self._lock:
+            items = [(key, histogram.summary(now)) for key, histogram in self._histograms.items()]
+        rows = []
+        for (kind, name), summary in items:
+            if summary is None:
+                continue
+            rows.append({
+                "kind": kind, "name": name, "count": summary["count"],
+                **{f"p{int(q * 100)}_ms": round(summary[f"p{int(q * 100)}_s"] * 1000, 3) for q in QUANTILES},
+                "max_ms": round(summary["max_s"] * 1000, 3),
+                "total_ms": round(summary["sum_s"] * 1000, 3),
+            })
+        return sorted(rows, key=lambda row: row["p95_ms"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def prometheus_text(self, prefix="arogya"):
+        lines = [f"# HELP {prefix}_span_seconds Latency of timed spans over the last {WINDOW_SLOTS} minutes",
+                 f"# TYPE {prefix}_span_seconds summary"]
+        for row in self.snapshot():
+            labels = f'kind="{_escape(row["kind"])}",name="{_escape(row["name"])}"'
+            for q in QUANTILES:
+                lines.append(f'{prefix}_span_seconds{{{labels},quantile="{q}"}} {row[f"p{int(q * 100)}_ms"] / 1000:.6f}')
+            lines.append(f"{prefix}_span_seconds_sum{{{labels}}} {row['total_ms'] / 1000:.6f}")
+            lines.append(f"{prefix}_span_seconds_count{{{labels}}} {row['count']}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        return json.dumps({"window_minutes": WINDOW_SLOTS, "pid": os.getpid(),
+                           "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "spans": self.snapshot()}, indent=2)
+
+    def export(self, path=PERF_EXPORT_PATH):
+        # JSON for a .json path, Prometheus text otherwise (node_exporter textfile format).
+        # Written to a temp file and renamed so readers never see half a file.
+        text = self.to_json() if path.endswith(".json") else self.prometheus_text()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        return path
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+PERF = PerfRegistry()
+span = PERF.span
+timed = PERF.timed
+
+
+def serve_metrics(registry=PERF, port=METRICS_PORT, host="127.0.0.1"):
+    # GET /metrics in the Prometheus text format, from a daemon thread
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+class PerfExporter(threading.Thread):
+    # Rewrites the export file on a fixed interval
+    def __init__(self, registry=PERF, path=PERF_EXPORT_PATH, interval=EXPORT_INTERVAL_SECONDS):
+        super().__init__(name="perf-exporter", daemon=True)
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.registry.export(self.path)
+            except OSError:
+                logger.exception("Performance export failed")
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_exporters(registry=PERF):
+    # Starts whatever the environment configures; returns the running servers and threads
+    running = []
+    if METRICS_PORT:
+        try:
+            running.append(serve_metrics(registry, METRICS_PORT))
+        except OSError:
+            # Another worker process on this host already serves the port
+            logger.warning("Metrics port %d is in use; not serving /metrics from this process", METRICS_PORT)
+    if PERF_EXPORT_ENABLED:
+        exporter = PerfExporter(registry, PERF_EXPORT_PATH)
+        exporter.start()
+        running.append(exporter)
+    return running
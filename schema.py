@@ -0,0 +1,257 @@
+import datetime
+
+import pandas as pd
+
+from locations import REGISTRY
+
+# ====================
+# MEDICINES TABLE SCHEMA
+# ====================
+# One explicit dtype per column for every in-memory medicines frame:
+# categoricals for the low-cardinality text fields, datetime64 dates, 32-bit
+# integers and a nullable boolean. Frames loaded from the store, sealed into
+# the columnar table or produced by the bulk importer all go through
+# coerce_medicines, and every write goes through validate_medicines (or its
+# single-row twin validate_medicine) first.
+
+MEDICINE_COLUMNS = [
+    "id", "name", "description", "quantity", "expiry", "donor", "donor_contact",
+    "location", "status", "category", "image", "value", "added_date", "prescription",
+    "donor_id", "available_quantity", "promised_quantity", "version"
+]
+
+STATUSES = ["pending", "approved", "rejected", "fulfilled", "expired"]
+CATEGORIES = ["Pain Relief", "Antibiotic", "Chronic Disease", "Cardiovascular", "Vitamins", "Other"]
+LOCATIONS = REGISTRY.names
+
+# Categoricals with a known value set; anything else found in stored data is
+# appended after these so legacy rows load unchanged
+FIXED_CATEGORIES = {"status": STATUSES, "category": CATEGORIES, "location": LOCATIONS}
+# Categoricals whose values are only known from the data (a handful of donors)
+OPEN_CATEGORIES = ("donor", "donor_id", "donor_contact")
+TEXT_COLUMNS = ("name", "description", "image")
+INT_COLUMNS = ("id", "quantity", "value", "available_quantity", "promised_quantity", "version")
+DATE_COLUMNS = ("expiry", "added_date")
+INT32_RANGE = (-2**31, 2**31 - 1)
+
+# Columns a new row may leave out, and what they default to
+MEDICINE_DEFAULTS = {
+    "description": "", "donor_contact": "", "donor_id": "", "image": "",
+    "status": "pending", "value": 0, "prescription": False, "version": 0,
+}
+REQUIRED_MEDICINE_COLUMNS = ["name", "quantity", "expiry", "donor", "location", "category", "added_date"]
+# Kept by the store from the request matches; never taken from input
+STORE_COLUMNS = ("promised_quantity",)
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _categorical(values, known=()):
+    if isinstance(values.dtype, pd.CategoricalDtype) and list(values.cat.categories[:len(known)]) == list(known):
+        return values
+    # Factorize once, then put the known values first in a stable order
+    values = values.astype("category")
+    extra = sorted(set(values.cat.categories) - set(known), key=str)
+    return values.cat.set_categories(list(known) + extra)
+
+
+def _dates(values):
+    if pd.api.types.is_datetime64_dtype(values.dtype):
+        return values.astype("datetime64[ns]")
+    return pd.to_datetime(values.astype(str), errors="coerce", format="ISO8601")
+
+
+def _integers(values):
+    return pd.to_numeric(values, errors="coerce")
+
+
+def coerce_medicines(frame):
+    # Returns a new frame with every known column cast to its schema dtype
+    columns = {}
+    for column in frame.columns:
+        values = frame[column]
+        if column in FIXED_CATEGORIES:
+            values = _categorical(values, FIXED_CATEGORIES[column])
+        elif column in OPEN_CATEGORIES:
+            values = _categorical(values)
+        elif column in INT_COLUMNS:
+            values = _integers(values).fillna(0).astype("int32")
+        elif column in DATE_COLUMNS:
+            values = _dates(values)
+        elif column == "prescription":
+            values = values.astype("boolean")
+        elif column in TEXT_COLUMNS and values.dtype != object:
+            values = values.astype(object)
+        columns[column] = values
+    return pd.DataFrame(columns, index=frame.index)
+
+
+def _number(value):
+    # float for anything numeric however it arrives (3, "3", numpy), NaN otherwise
+    if value is None or isinstance(value, str) and not value.strip():
+        return float("nan")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _whole(value):
+    number = _number(value)
+    return 0 if number != number else int(number)
+
+
+def _parsed(values, column):
+    # One reading of a column, as a Series or a single value, for the checks:
+    # numbers as floats (NaN when unreadable), dates as Timestamps (NaT), text stripped
+    series = isinstance(values, pd.Series)
+    if column in INT_COLUMNS:
+        return _integers(values) if series else _number(values)
+    if column in DATE_COLUMNS:
+        return _dates(values) if series else pd.to_datetime(str(values), errors="coerce", format="ISO8601")
+    if column in TEXT_COLUMNS:
+        return values.astype(str).str.strip() if series else str(values).strip()
+    return values
+
+
+def _outside(values, allowed):
+    return ~values.isin(allowed) if isinstance(values, pd.Series) else values not in allowed
+
+
+def _not_whole(numbers, low):
+    return pd.isna(numbers) | (numbers < low) | (numbers % 1 != 0) | (numbers > INT32_RANGE[1])
+
+
+# Row rules shared by the frame and single-row validators: the columns a rule
+# reads (parsed by _parsed), the test flagging invalid rows and its message.
+# A rule whose columns are absent is skipped.
+MEDICINE_CHECKS = [
+    (("name",), lambda name: name == "", "name is required"),
+    (("quantity",), lambda quantity: _not_whole(quantity, 1), "quantity must be a positive whole number"),
+    (("value",), lambda value: _not_whole(value, 0), "value must be a non-negative whole number"),
+    (("expiry",), pd.isna, "expiry is not a valid YYYY-MM-DD date"),
+    (("added_date",), pd.isna, "added_date is not a valid YYYY-MM-DD date"),
+    (("status",), lambda status: _outside(status, STATUSES), "status is not a known status"),
+    (("category",), lambda category: _outside(category, CATEGORIES), "category is not one of the allowed categories"),
+    (("location",), lambda location: _outside(location, LOCATIONS), "location is not one of the allowed locations"),
+    (("available_quantity", "quantity"),
+     lambda available, quantity: pd.isna(available) | (available < 0) | (available > quantity),
+     "available_quantity must be between 0 and quantity"),
+    (("id",), lambda ids: (ids <= 0) | (ids > INT32_RANGE[1]), "id is out of range"),
+]
+
+
+def _run_checks(row):
+    # row is a frame or a single row dict; returns the parsed columns and a
+    # (failed, message) pair per applicable rule
+    parsed = {c: _parsed(row[c], c) for columns, _, _ in MEDICINE_CHECKS for c in columns if c in row}
+    return parsed, [(test(*[parsed[c] for c in columns]), message)
+                    for columns, test, message in MEDICINE_CHECKS if all(c in parsed for c in columns)]
+
+
+def check_medicines(frame):
+    # Vectorized row checks; returns one "; "-joined error string per row ("" when valid)
+    errors = pd.Series("", index=frame.index)
+    missing = [c for c in REQUIRED_MEDICINE_COLUMNS if c not in frame.columns]
+    if missing:
+        errors[:] = f"missing {', '.join(missing)}; "
+        return errors.str.rstrip("; ")
+    if "available_quantity" not in frame.columns:
+        frame = frame.assign(available_quantity=frame["quantity"])
+
+    for failed, message in _run_checks(frame)[1]:
+        errors[failed] += message + "; "
+    return errors.str.rstrip("; ")
+
+
+def sql_records(frame):
+    # Typed frame -> plain Python row dicts ready for sqlite3 (ISO dates, 0/1 flags)
+    out = {}
+    for column in frame.columns:
+        values = frame[column]
+        if column in DATE_COLUMNS:
+            values = values.dt.strftime("%Y-%m-%d")
+        elif column == "prescription":
+            values = values.fillna(False).astype(int)
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        out[column] = values
+    return pd.DataFrame(out, index=frame.index).to_dict("records")
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def validate_medicine(med):
+    # validate_medicines for a single row, without building a frame: the
+    # donor form writes one row per submit. Same defaults, checks and output.
+    row = dict(med)
+    for column, default in MEDICINE_DEFAULTS.items():
+        if _missing(row.get(column)):
+            row[column] = default
+    if _missing(row.get("available_quantity")):
+        row["available_quantity"] = row.get("quantity", 0)
+    if _missing(row.get("id")):
+        row.pop("id", None)
+    for column in STORE_COLUMNS:
+        row.pop(column, None)
+    missing = [c for c in REQUIRED_MEDICINE_COLUMNS if c not in row]
+    if missing:
+        raise SchemaError(f"1 invalid medicine row(s): row 1: missing {', '.join(missing)}")
+
+    parsed, checks = _run_checks(row)
+    problems = [message for failed, message in checks if failed]
+    if problems:
+        raise SchemaError(f"1 invalid medicine row(s): row 1: {'; '.join(problems)}")
+
+    row.update(quantity=int(parsed["quantity"]), value=int(parsed["value"]),
+               available_quantity=int(parsed["available_quantity"]),
+               expiry=parsed["expiry"].strftime("%Y-%m-%d"), added_date=parsed["added_date"].strftime("%Y-%m-%d"),
+               version=_whole(row["version"]), prescription=int(bool(row["prescription"])))
+    for column in OPEN_CATEGORIES:
+        if column in row:
+            row[column] = str(row[column])
+    if "id" in row:
+        row["id"] = _whole(row["id"]) or None
+    return row
+
+
+def validate_medicines(medicines):
+    # Fills defaults, rejects invalid rows with a SchemaError naming them and
+    # returns normalized row dicts in the order given
+    frame = pd.DataFrame.from_records(list(medicines))
+    for column, default in MEDICINE_DEFAULTS.items():
+        if column not in frame.columns:
+            frame[column] = default
+        else:
+            frame[column] = frame[column].where(frame[column].notna(), default)
+    # Nothing is reserved yet when a donation is first written
+    if "available_quantity" not in frame.columns:
+        frame["available_quantity"] = frame["quantity"] if "quantity" in frame.columns else 0
+    if "id" in frame.columns and frame["id"].isna().all():
+        frame = frame.drop(columns="id")
+    frame = frame.drop(columns=[c for c in STORE_COLUMNS if c in frame.columns])
+    errors = check_medicines(frame)
+    bad = errors[errors != ""]
+    if not bad.empty:
+        detail = "; ".join(f"row {i + 1}: {message}" for i, message in bad.head(5).items())
+        more = f" (and {len(bad) - 5} more)" if len(bad) > 5 else ""
+        raise SchemaError(f"{len(bad)} invalid medicine row(s): {detail}{more}")
+    records = sql_records(coerce_medicines(frame))
+    if "id" in frame.columns:
+        for record in records:
+            if record["id"] == 0:
+                record["id"] = None
+    return records
+
+
+def format_date(value, default="N/A"):
+    # Dates may arrive as Timestamps (typed frames), datetime.date or ISO strings (row dicts)
+    if value is None or value is pd.NaT or (isinstance(value, float) and pd.isna(value)):
+        return default
+    if isinstance(value, (datetime.date, pd.Timestamp)):
+        return value.strftime("%Y-%m-%d")
+    return str(value)[:10] or default
@@ -0,0 +1,107 @@
+import re
+import threading
+from collections import Counter, defaultdict
+
+# ====================
+# TRIGRAM SEARCH INDEX
+# ====================
+# In-memory inverted index from character trigrams to medicine ids. Lookups
+# only touch the posting lists of the query's trigrams, so latency depends on
+# the query rather than the inventory size, and small typos ("paracetmol")
+# still share most trigrams with the correct spelling.
+
+SEARCH_FIELDS = ("name", "category", "description")
+FIELD_WEIGHTS = {"name": 1.0, "category": 0.8, "description": 0.6}
+MIN_SIMILARITY = 0.45
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def trigrams(text):
+    grams = set()
+    for word in _WORD_RE.findall(str(text or "").lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings = {field: defaultdict(set) for field in SEARCH_FIELDS}  # trigram -> med ids
+        self._docs = {}                         # med_id -> ({field: trigrams}, status)
+        self._by_status = defaultdict(set)      # status -> med ids
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def upsert(self, med):
+        med_id = int(med["id"])
+        grams = {field: trigrams(med.get(field)) for field in SEARCH_FIELDS}
+        status = med.get("status")
+        with self._lock:
+            self._remove(med_id)
+            for field, field_grams in grams.items():
+                postings = self._postings[field]
+                for gram in field_grams:
+                    postings[gram].add(med_id)
+            self._docs[med_id] = (grams, status)
+            self._by_status[status].add(med_id)
+
+    def remove(self, med_id):
+        with self._lock:
+            self._remove(int(med_id))
+
+    def _remove(self, med_id):
+        doc = self._docs.pop(med_id, None)
+        if doc is None:
+            return
+        grams, status = doc
+        self._by_status[status].discard(med_id)
+        for field, field_grams in grams.items():
+            postings = self._postings[field]
+            for gram in field_grams:
+                posting = postings.get(gram)
+                if posting is not None:
+                    posting.discard(med_id)
+                    if not posting:
+                        del postings[gram]
+
+    def rebuild(self, medicines):
+        with self._lock:
+            for postings in self._postings.values():
+                postings.clear()
+            self._docs.clear()
+            self._by_status.clear()
+            for med in medicines.to_dict("records"):
+                self.upsert(med)
+
+    def apply_changes(self, medicines):
+        # Store listener: called with the rows touched by each committed write
+        for med in medicines:
+            self.upsert(med)
+
+    def search(self, query, status=None, limit=None, min_similarity=MIN_SIMILARITY):
+        # Returns medicine ids ranked by best weighted trigram coverage of the query
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        min_hits = min_similarity * len(query_grams)
+        scores = {}
+        with self._lock:
+            allowed = self._by_status.get(status, set()) if status is not None else None
+            for field in SEARCH_FIELDS:
+                postings = self._postings[field]
+                hits = Counter()
+                for gram in query_grams:
+                    hits.update(postings.get(gram, ()))
+                weight = FIELD_WEIGHTS[field] / len(query_grams)
+                for med_id, count in hits.items():
+                    if count < min_hits or (allowed is not None and med_id not in allowed):
+                        continue
+                    score = weight * count
+                    if score > scores.get(med_id, 0):
+                        scores[med_id] = score
+
+        ranked = sorted(scores, key=lambda med_id: (-scores[med_id], med_id))
+        return ranked[:limit]
@@ -0,0 +1,381 @@
+import argparse
+import json
+import logging
+import os
+import re
+import signal
+import socket
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import asdict, is_dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from inventory_service import (DUPLICATE_MATCHES, Analytics, FindQuery, ImageDuplicate, ImpactSummary, InvalidCursor,
+                               Medicine, MedicineRequest, Outbox, Page, RequestMatch, RequestSubmitted, Reservation,
+                               build, create_service)
+from inventory_store import DEFAULT_DB_PATH, ExpirySweeper, InventoryStore, ReservationError
+from schema import SchemaError
+
+# ====================
+# INVENTORY HTTP API
+# ====================
+# InventoryService over local HTTP/JSON, plus a client with the same methods.
+#
+#   python service_api.py --port 8765 --workers 4
+#
+# starts four worker processes on one port (SO_REUSEPORT), each with its own
+# in-memory indexes over the shared SQLite store. Point the app at it with
+# AROGYA_SERVICE_URL=http://127.0.0.1:8765. Every response is
+# {"result": ...} (the CSV export is served as text/csv); failures are {"error": {"type", "message"}} with a 4xx/5xx
+# status. Lists return {"items", "total", "next_cursor"}: pass next_cursor
+# back as ?cursor= (or "cursor" in a POST body) for the following page.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+SERVICE_URL = os.environ.get("AROGYA_SERVICE_URL", "")
+CLIENT_TIMEOUT_SECONDS = 30
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+# (HTTP method, path pattern, service method); path groups become arguments
+ROUTES = [
+    ("POST", r"/v1/medicines/find", "find_medicines"),
+    ("GET", r"/v1/medicines", "list_medicines"),
+    ("GET", r"/v1/medicines/ids", "medicine_ids"),
+    ("GET", r"/v1/medicines/count", "count_medicines"),
+    ("GET", r"/v1/medicines/rows", "medicine_rows"),
+    ("GET", r"/v1/medicines/export", "export_medicines_csv"),
+    ("POST", r"/v1/medicines/batch", "get_medicines"),
+    ("POST", r"/v1/medicines/duplicates", "near_duplicates"),
+    ("POST", r"/v1/medicines/status", "update_statuses"),
+    ("POST", r"/v1/medicines/sweep-expired", "sweep_expired"),
+    ("GET", r"/v1/options/(?P<column>\w+)", "options"),
+    ("GET", r"/v1/donors/(?P<donor_id>[^/]+)/summary", "donor_summary"),
+    ("POST", r"/v1/donations", "submit_donations"),
+    ("GET", r"/v1/impact", "impact"),
+    ("GET", r"/v1/analytics", "analytics"),
+    ("GET", r"/v1/stats-version", "stats_version"),
+    ("POST", r"/v1/counters/check", "check_counters"),
+    ("POST", r"/v1/counters/rebuild", "rebuild_counters"),
+    ("POST", r"/v1/requests", "create_request"),
+    ("GET", r"/v1/requests", "list_requests"),
+    ("POST", r"/v1/requests/(?P<request_id>\d+)/cancel", "cancel_request"),
+    ("POST", r"/v1/reservations", "reserve"),
+    ("GET", r"/v1/reservations", "list_reservations"),
+    ("POST", r"/v1/reservations/(?P<reservation_id>\d+)/cancel", "cancel_reservation"),
+    ("POST", r"/v1/reservations/(?P<reservation_id>\d+)/fulfil", "fulfil_reservation"),
+    ("GET", r"/v1/audit", "audit_log"),
+    ("GET", r"/v1/outbox", "outbox"),
+]
+COMPILED_ROUTES = [(method, re.compile(pattern + "$"), name) for method, pattern, name in ROUTES]
+ROUTE_PATHS = {name: (method, pattern) for method, pattern, name in ROUTES}
+# Methods whose result is sent as the raw body with this content type
+RAW_RESULTS = {"export_medicines_csv": "text/csv; charset=utf-8"}
+
+# Query-string parameters that are not text
+INT_PARAMS = ("limit", "offset", "expiring_days")
+BOOL_PARAMS = ("available",)
+
+# Errors the client raises again under their own type
+ERROR_TYPES = {cls.__name__: cls for cls in (SchemaError, ReservationError, InvalidCursor, ValueError)}
+
+
+class ServiceError(RuntimeError):
+    pass
+
+
+def _jsonable(value):
+    # Dataclasses anywhere in a result, including inside tuples and dicts
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    return asdict(value) if is_dataclass(value) else value
+
+
+def _query_args(query):
+    args = {}
+    for key, values in urllib.parse.parse_qs(query, keep_blank_values=False).items():
+        value = values[-1]
+        if key in INT_PARAMS:
+            value = int(value)
+        elif key in BOOL_PARAMS:
+            value = value.lower() in ("1", "true", "yes")
+        args[key] = value
+    return args
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def _dispatch(self, method):
+            url = urllib.parse.urlsplit(self.path)
+            if url.path == "/v1/health":
+                return self._send(200, {"result": {"ok": True, "pid": os.getpid()}})
+            for route_method, pattern, name in COMPILED_ROUTES:
+                match = pattern.match(url.path)
+                if match and route_method == method:
+                    break
+            else:
+                return self._send(404, {"error": {"type": "NotFound", "message": f"No route for {method} {url.path}"}})
+            try:
+                args = {k: urllib.parse.unquote(v) for k, v in match.groupdict().items()}
+                if method == "GET":
+                    args.update(_query_args(url.query))
+                else:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    if length > MAX_BODY_BYTES:
+                        return self._send(413, {"error": {"type": "TooLarge", "message": "Request body too large"}})
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(body, dict):
+                        raise ValueError("Request body must be a JSON object")
+                    args.update(body)
+                if name == "find_medicines":
+                    args = {"query": build(FindQuery, args)}
+                result = getattr(service, name)(**args)
+            except (SchemaError, ReservationError, ValueError, TypeError) as e:
+                return self._send(400, {"error": {"type": type(e).__name__, "message": str(e)}})
+            except Exception as e:
+                logger.exception("%s %s failed", method, url.path)
+                return self._send(500, {"error": {"type": type(e).__name__, "message": str(e)}})
+            if name in RAW_RESULTS:
+                return self._send(200, result.encode(), RAW_RESULTS[name])
+            self._send(200, {"result": _jsonable(result)})
+
+        def _send(self, status, payload, content_type="application/json"):
+            body = payload if isinstance(payload, bytes) else json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return Handler
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, reuse_port=False):
+        self.reuse_port = reuse_port
+        super().__init__(address, handler)
+
+    def server_bind(self):
+        if self.reuse_port:
+            # Lets every worker process bind the same port; the kernel spreads connections
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, reuse_port=False):
+    return ServiceServer((host, port), make_handler(service), reuse_port=reuse_port)
+
+
+# ---- client ----
+class ServiceClient:
+    # InventoryService over HTTP: same methods, same dataclasses
+    def __init__(self, base_url=SERVICE_URL, timeout=CLIENT_TIMEOUT_SECONDS):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _call(self, name, body=None, query=None, **path_args):
+        method, pattern = ROUTE_PATHS[name]
+        path = re.sub(r"\(\?P<(\w+)>[^)]*\)", lambda m: urllib.parse.quote(str(path_args[m.group(1)]), safe=""), pattern)
+        if query:
+            path += "?" + urllib.parse.urlencode({k: v for k, v in query.items() if v is not None and v != ""})
+        data = None if method == "GET" else json.dumps(body or {}, default=str).encode()
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                if name in RAW_RESULTS:
+                    return response.read().decode()
+                return json.loads(response.read())["result"]
+        except urllib.error.HTTPError as e:
+            try:
+                error = json.loads(e.read())["error"]
+            except (ValueError, KeyError):
+                raise ServiceError(f"{method} {path} failed with HTTP {e.code}")
+            raise ERROR_TYPES.get(error["type"], ServiceError)(error["message"])
+        except urllib.error.URLError as e:
+            raise ServiceError(f"Inventory service unreachable at {self.base_url}: {e.reason}")
+
+    @staticmethod
+    def _page(result, item):
+        return Page([item(row) for row in result["items"]], result["total"], result["next_cursor"])
+
+    @staticmethod
+    def _request(row):
+        return build(MedicineRequest, {**row, "matches": [build(RequestMatch, m) for m in row.get("matches", [])]})
+
+    # ---- medicines ----
+    def find_medicines(self, query):
+        return self._page(self._call("find_medicines", asdict(query)), lambda row: build(Medicine, row))
+
+    def list_medicines(self, sort="id", limit=20, cursor=None, offset=0, **filters):
+        query = {"sort": sort, "limit": limit, "cursor": cursor, "offset": offset or None, **self._filters(filters)}
+        return self._page(self._call("list_medicines", query=query), lambda row: build(Medicine, row))
+
+    @staticmethod
+    def _filters(filters):
+        out = {}
+        for key, value in filters.items():
+            if isinstance(value, bool):
+                value = "true" if value else None
+            out[key] = None if value is None else str(value)
+        return out
+
+    def medicine_ids(self, **filters):
+        return self._call("medicine_ids", query=self._filters(filters))
+
+    def count_medicines(self, **filters):
+        return self._call("count_medicines", query=self._filters(filters))
+
+    def medicine_rows(self, columns=None, sort="id", limit=20, cursor=None, offset=0, **filters):
+        query = {"columns": self._column_list(columns), "sort": sort, "limit": limit, "cursor": cursor,
+                 "offset": offset or None, **self._filters(filters)}
+        return self._page(self._call("medicine_rows", query=query), dict)
+
+    def export_medicines_csv(self, columns=None, sort="id", **filters):
+        query = {"columns": self._column_list(columns), "sort": sort, **self._filters(filters)}
+        return self._call("export_medicines_csv", query=query)
+
+    @staticmethod
+    def _column_list(columns):
+        return columns if columns is None or isinstance(columns, str) else ",".join(columns)
+
+    def get_medicines(self, ids):
+        return [build(Medicine, row) for row in self._call("get_medicines", {"ids": list(ids)})]
+
+    def near_duplicates(self, ids, limit=DUPLICATE_MATCHES):
+        body = {"ids": [int(i) for i in ids], "limit": limit}
+        return [build(ImageDuplicate, row) for row in self._call("near_duplicates", body)]
+
+    def options(self, column, status=None):
+        return self._call("options", query={"status": status}, column=column)
+
+    def donor_summary(self, donor_id):
+        return self._call("donor_summary", donor_id=donor_id)
+
+    def submit_donations(self, donations):
+        return self._call("submit_donations", {"donations": list(donations)})
+
+    def update_statuses(self, ids, status, actor="system"):
+        return self._call("update_statuses", {"ids": [int(i) for i in ids], "status": status, "actor": actor})
+
+    def sweep_expired(self):
+        return self._call("sweep_expired")
+
+    # ---- dashboards ----
+    def impact(self):
+        return build(ImpactSummary, self._call("impact"))
+
+    def analytics(self):
+        return build(Analytics, self._call("analytics"))
+
+    def stats_version(self):
+        return self._call("stats_version")
+
+    def check_counters(self):
+        # JSON has no tuples: each drift is (stored, actual) again
+        drift = self._call("check_counters")
+        return {kind: {key: tuple(pair) for key, pair in diff.items()} for kind, diff in drift.items()}
+
+    def rebuild_counters(self):
+        self._call("rebuild_counters")
+
+    # ---- requests ----
+    def create_request(self, request):
+        return build(RequestSubmitted, self._call("create_request", {"request": request}))
+
+    def list_requests(self, recipient_id=None, limit=20, cursor=None, offset=0):
+        query = {"recipient_id": recipient_id, "limit": limit, "cursor": cursor, "offset": offset or None}
+        return self._page(self._call("list_requests", query=query), self._request)
+
+    def cancel_request(self, request_id, recipient_id=None):
+        return self._call("cancel_request", {"recipient_id": recipient_id}, request_id=request_id)
+
+    # ---- reservations ----
+    def reserve(self, medicine_id, units, recipient_id, recipient="", request_id=None):
+        return self._call("reserve", {"medicine_id": int(medicine_id), "units": int(units), "recipient_id": recipient_id,
+                                      "recipient": recipient, "request_id": request_id})
+
+    def list_reservations(self, recipient_id=None, limit=20, cursor=None, offset=0):
+        query = {"recipient_id": recipient_id, "limit": limit, "cursor": cursor, "offset": offset or None}
+        return self._page(self._call("list_reservations", query=query), lambda row: build(Reservation, row))
+
+    def cancel_reservation(self, reservation_id, recipient_id=None, actor=None):
+        return self._call("cancel_reservation", {"recipient_id": recipient_id, "actor": actor},
+                          reservation_id=reservation_id)
+
+    def fulfil_reservation(self, reservation_id, actor="system"):
+        self._call("fulfil_reservation", {"actor": actor}, reservation_id=reservation_id)
+
+    # ---- admin ----
+    def audit_log(self, limit=200):
+        return self._call("audit_log", query={"limit": limit})
+
+    def outbox(self, limit=200):
+        return build(Outbox, self._call("outbox", query={"limit": limit}))
+
+
+# ---- server process ----
+def _run_worker(args, reuse_port):
+    store = InventoryStore(args.db)
+    ExpirySweeper(store).start()
+    if args.users:
+        from notifications import NotificationWorker, StaticDirectory
+        with open(args.users) as f:
+            NotificationWorker(store, StaticDirectory(json.load(f))).start()
+    server = make_server(create_service(store), args.host, args.port, reuse_port=reuse_port)
+    logger.info("Inventory service worker %d listening on %s:%d", os.getpid(), args.host, args.port)
+    # shutdown() would wait on this very thread's serve_forever; unwind instead
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the inventory API over local HTTP/JSON")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--workers", type=int, default=1, help="processes sharing the port and the SQLite store")
+    parser.add_argument("--users", help="JSON list of users ({id, role, phone}) to enable notification delivery")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+
+    # Workers are forked before any store or thread exists, so nothing is shared but the file
+    children = []
+    for _ in range(args.workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(args, reuse_port=True)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    try:
+        _run_worker(args, reuse_port=args.workers > 1)
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventory_store import InventoryStore  # noqa: E402
+
+
+def medicine(**overrides):
+    # A valid donation row; tests override only what they care about
+    row = {
+        "name": "Paracetamol 500mg", "description": "", "quantity": 10, "expiry": "2030-01-01",
+        "donor": "Donor 1", "donor_id": "S00001", "donor_contact": "919000000001", "location": "Hostel A",
+        "status": "pending", "category": "Pain Relief", "image": "", "value": 2, "added_date": "2026-01-01",
+        "prescription": False,
+    }
+    row.update(overrides)
+    return row
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "inventory.db")
+
+
+@pytest.fixture
+def store(db_path):
+    return InventoryStore(db_path)
@@ -0,0 +1,42 @@
+import io
+
+from bulk_import import import_donations
+from inventory_service import InventoryService
+
+HEADER = "name,quantity,expiry,category,location,value\n"
+
+
+def upload(lines, name="donations.csv"):
+    data = io.BytesIO((HEADER + "".join(lines)).encode())
+    data.name = name
+    return data
+
+
+def line(quantity=5, value=3, name="Paracetamol 500mg"):
+    return f"{name},{quantity},2030-01-01,Pain Relief,Hostel A,{value}\n"
+
+
+def test_out_of_range_rows_are_reported_not_raised(store):
+    # Line 9 of the file (row 8 after the header) sits in the second chunk
+    lines = [line(name=f"Med {i}") for i in range(10)]
+    lines[7] = line(quantity=3_000_000_000, name="Too many")
+    lines[2] = line(value=5_000_000_000, name="Too dear")
+    imported, report = import_donations(InventoryService(store), upload(lines), "pending", "Donor", "91900",
+                                        chunk_rows=5)
+    assert len(imported) == 8
+    assert store.count_medicines() == 8
+    assert report["row"].tolist() == [4, 9]
+    assert "quantity must be at most" in report["errors"][1]
+    assert "value must be at most" in report["errors"][0]
+
+
+def test_schema_refusals_carry_file_line_numbers(store, monkeypatch):
+    # Rows that pass the import checks but not the store schema are reported by line too
+    monkeypatch.setattr("bulk_import.INT32_RANGE", (-2**63, 2**63 - 1))
+    lines = [line(name=f"Med {i}") for i in range(7)]
+    lines[6] = line(quantity=3_000_000_000, name="Too many")
+    imported, report = import_donations(InventoryService(store), upload(lines), "pending", "Donor", "91900",
+                                        chunk_rows=5)
+    assert len(imported) == 6
+    assert report["row"].tolist() == [8]
+    assert "quantity" in report["errors"][0]
@@ -0,0 +1,88 @@
+import pytest
+
+from conftest import medicine
+from inventory_store import ChangeFeed, InventoryStore
+
+REQUEST = {"recipient_id": "U1", "recipient": "Recipient", "drug": "Paracetamol 500mg", "quantity": 4}
+
+
+class Recorder:
+    # Store listener that remembers the ids of every row it was handed
+    def __init__(self):
+        self.ids = []
+
+    def __call__(self, rows):
+        self.ids += [row["id"] for row in rows]
+
+
+@pytest.fixture
+def feed(store):
+    # Polled by hand rather than from its thread
+    return ChangeFeed(store, batch=2)
+
+
+@pytest.fixture
+def other(db_path, store):
+    # Another process's connection to the same database
+    return InventoryStore(db_path)
+
+
+@pytest.fixture
+def seen(store):
+    medicines, requests = Recorder(), Recorder()
+    store.add_listener(medicines)
+    store.add_request_listener(requests)
+    return medicines, requests
+
+
+def test_poll_applies_writes_from_other_processes(feed, other, seen):
+    medicines, requests = seen
+    ids = other.insert_many([medicine(name=f"Med {i}") for i in range(5)])
+    request_id = other.create_request(REQUEST)
+
+    assert feed.poll() == 6
+    assert sorted(medicines.ids) == ids
+    assert requests.ids == [request_id]
+    assert feed.seq == other.change_seq()
+    assert feed.poll() == 0
+
+
+def test_poll_skips_this_process_own_writes(store, feed, other, seen):
+    medicines, _ = seen
+    own = store.insert_many([medicine(name="Own 1")])
+    theirs = other.insert_many([medicine(name="Theirs")])
+    own += store.insert_many([medicine(name="Own 2")])
+    # Own writes reached the listeners when they committed
+    assert medicines.ids == own
+    medicines.ids.clear()
+
+    assert feed.poll() == 1
+    assert medicines.ids == theirs
+    # Ranges already passed are dropped
+    assert list(store._own_changes) == [(store.change_seq() - 1, store.change_seq())]
+
+
+def test_poll_resyncs_after_the_log_was_pruned(store, feed, other, seen):
+    medicines, requests = seen
+    ids = store.insert_many([medicine(name="Own")])
+    ids += other.insert_many([medicine(name=f"Med {i}") for i in range(4)])
+    request_id = other.create_request(REQUEST)
+    medicines.ids.clear()
+    assert other.prune_changes(other.change_seq()) > 0
+
+    feed.poll()
+    # Every stored row is reloaded, own writes included, since which changes were missed is unknown
+    assert sorted(set(medicines.ids)) == ids
+    assert requests.ids == [request_id]
+    assert feed.seq == store.change_seq()
+
+
+def test_poll_resyncs_on_a_gap_in_the_sequence(store, feed, other, seen):
+    medicines, _ = seen
+    ids = other.insert_many([medicine(name=f"Med {i}") for i in range(3)])
+    with other._transaction() as conn:
+        conn.execute("DELETE FROM change_log WHERE seq = (SELECT MIN(seq) FROM change_log)")
+
+    feed.poll()
+    assert sorted(set(medicines.ids)) == ids
+    assert feed.seq == other.change_seq()
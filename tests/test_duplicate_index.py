@@ -0,0 +1,30 @@
+import pandas as pd
+
+from duplicate_index import DuplicateIndex
+
+ORIGINAL = "img:aa:00000000000000ff"
+COPY = "img:bb:00000000000000fe"      # one bit away
+OTHER = "img:cc:ffffffffffff0000"
+
+
+def index_of(rows):
+    index = DuplicateIndex()
+    index.rebuild(pd.DataFrame(rows, columns=["id", "image", "status"]))
+    return index
+
+
+def test_only_earlier_listings_are_duplicates():
+    index = index_of([(1, ORIGINAL, "approved"), (2, COPY, "pending"), (3, OTHER, "pending")])
+    assert index.duplicates_of(2) == [(1, 1)]
+    assert index.duplicates_of(1) == []
+    assert index.duplicates_of(3) == []
+
+
+def test_rejected_listings_are_not_counted():
+    index = index_of([(1, ORIGINAL, "rejected"), (2, COPY, "pending")])
+    assert index.duplicates_of(2) == []
+
+    index.upsert({"id": 1, "image": ORIGINAL, "status": "approved"})
+    assert index.duplicates_of(2) == [(1, 1)]
+    index.apply_changes([{"id": 1, "image": ORIGINAL, "status": "rejected"}])
+    assert index.duplicates_of(2) == []
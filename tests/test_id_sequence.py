@@ -0,0 +1,65 @@
+import multiprocessing
+import threading
+
+from conftest import medicine
+from inventory_store import InventoryStore
+
+
+def _assert_disjoint(ranges):
+    ids = [i for r in ranges for i in r]
+    assert len(ids) == len(set(ids))
+
+
+def test_two_stores_on_one_file_never_share_ids(db_path):
+    stores = [InventoryStore(db_path), InventoryStore(db_path)]
+    ranges, errors = [], []
+
+    def allocate(store, worker):
+        try:
+            for i in range(40):
+                if i % 4 == 0:
+                    ranges.append(store.insert_many([medicine(name=f"W{worker} {i}")] * 3))
+                else:
+                    ranges.append(list(store.reserve_ids(1 + (i + worker) % 7)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=allocate, args=(stores[w % 2], w)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    _assert_disjoint(ranges)
+    assert stores[0].count_medicines() == 4 * 10 * 3
+
+
+def _reserve_in_child(db_path, queue):
+    store = InventoryStore(db_path)
+    queue.put([list(store.reserve_ids(5)) for _ in range(25)])
+
+
+def test_processes_never_share_ids(db_path):
+    InventoryStore(db_path)
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    workers = [context.Process(target=_reserve_in_child, args=(db_path, queue)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    ranges = [r for _ in workers for r in queue.get(timeout=60)]
+    for worker in workers:
+        worker.join()
+    assert len(ranges) == 75
+    _assert_disjoint(ranges)
+
+
+def test_sequence_survives_reopen_and_explicit_ids(db_path):
+    store = InventoryStore(db_path)
+    first, = store.insert_many([medicine()])
+    reserved = list(store.reserve_ids(10))
+    assert min(reserved) > first
+    explicit = store.insert_medicine(medicine(id=500))
+    reopened = InventoryStore(db_path)
+    next_id, = reopened.insert_many([medicine()])
+    assert explicit == 500
+    assert next_id == 501
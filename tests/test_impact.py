@@ -0,0 +1,26 @@
+from conftest import medicine
+from page_data import impact_summary
+
+
+def test_withdrawn_stock_stops_counting_as_saved(store):
+    a, b, c = store.insert_many([medicine(), medicine(), medicine()])
+    store.update_status_many([a, b, c], "approved")
+    assert impact_summary(store)["total_medicines"] == 30
+
+    reservation = store.reserve(b, 4, "R1", "Recipient")
+    store.fulfil_reservation(reservation)
+    store.update_status_many([a, b], "expired")
+    summary = impact_summary(store)
+    # c untouched, plus the 4 units of b that were handed over before it expired
+    assert summary["total_medicines"] == 14
+    assert summary["total_value"] == 28
+    assert summary["units_handed_over"] == 4
+
+
+def test_reapproval_counts_again(store):
+    med_id, = store.insert_many([medicine()])
+    store.update_status_many([med_id], "approved")
+    store.update_status_many([med_id], "rejected")
+    assert impact_summary(store)["total_medicines"] == 0
+    store.update_status_many([med_id], "approved")
+    assert impact_summary(store)["total_medicines"] == 10
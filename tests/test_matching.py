@@ -0,0 +1,96 @@
+import pytest
+
+from conftest import medicine
+from matching import MatchingEngine
+from search_index import SearchIndex
+
+REQUEST = {"recipient_id": "U1", "recipient": "Recipient", "drug": "Paracetamol 500mg", "quantity": 4}
+
+
+@pytest.fixture
+def engine(store):
+    # The in-process views the app wires up
+    index = SearchIndex()
+    store.add_listener(index.apply_changes)
+    engine = MatchingEngine(store, index)
+    store.add_listener(engine.apply_changes)
+    store.add_request_listener(engine.apply_request_changes)
+    return engine
+
+
+def reserved_request(store, engine):
+    med_id, = store.insert_many([medicine(status="approved", quantity=4)])
+    request_id, allocations = engine.submit(dict(REQUEST))
+    assert allocations == [(med_id, 4)]
+    reservation_id = store.reserve(med_id, 4, "U1", request_id=request_id)
+    assert len(engine) == 0
+    return med_id, request_id, reservation_id
+
+
+def request_row(store, request_id):
+    return store.get_requests([request_id])[0]
+
+
+def lapse_matches(store):
+    with store._transaction() as conn:
+        conn.execute("UPDATE request_matches SET expires_at = datetime('now', '-1 minute')")
+
+
+def test_lapsed_match_is_offered_to_the_next_request(store, engine):
+    med_id, = store.insert_many([medicine(status="approved", quantity=4)])
+    first, _ = engine.submit(dict(REQUEST))
+    second, allocations = engine.submit(dict(REQUEST, recipient_id="U2"))
+    assert allocations == []
+
+    lapse_matches(store)
+    assert store.expire_matches() == [first]
+    assert request_row(store, first)["status"] == "open"
+    assert request_row(store, second)["matched_quantity"] == 4
+
+
+def test_lapsed_units_go_back_to_the_pool(store, engine):
+    med_id, = store.insert_many([medicine(status="approved", quantity=4)])
+    request_id, _ = engine.submit(dict(REQUEST))
+    lapse_matches(store)
+    store.expire_matches()
+
+    # Not promised to the same request again, so the next request gets them
+    assert request_row(store, request_id)["matched_quantity"] == 0
+    _, allocations = engine.submit(dict(REQUEST, recipient_id="U2"))
+    assert allocations == [(med_id, 4)]
+
+    # Other stock is still matched to the request
+    new_id, = store.insert_many([medicine(quantity=6)])
+    store.update_status_many([new_id], "approved")
+    assert request_row(store, request_id)["matched_quantity"] == 4
+    assert store.expire_matches() == []
+
+
+def test_cancelled_hold_is_offered_back_to_its_request(store, engine):
+    med_id, request_id, reservation_id = reserved_request(store, engine)
+    store.cancel_reservation(reservation_id)
+    # The freed units go straight back to the reopened request
+    assert request_row(store, request_id)["matched_quantity"] == 4
+    assert store.get_medicines([med_id])[0]["available_quantity"] == 4
+
+
+def test_expired_hold_reopens_request_in_the_engine(store, engine):
+    med_id, request_id, reservation_id = reserved_request(store, engine)
+    with store._transaction() as conn:
+        conn.execute("UPDATE reservations SET expires_at = datetime('now', '-1 minute') WHERE id = ?", (reservation_id,))
+    assert store.expire_reservations() == [reservation_id]
+    assert request_row(store, request_id)["matched_quantity"] == 4
+
+
+def test_rejected_reserved_stock_reopens_request_for_new_stock(store, engine):
+    med_id, request_id, _ = reserved_request(store, engine)
+    store.update_status_many([med_id], "rejected")
+    request = request_row(store, request_id)
+    assert request["matched_quantity"] == 0 and request["status"] == "open"
+    assert len(engine) == 1
+
+    new_id, = store.insert_many([medicine(quantity=6)])
+    store.update_status_many([new_id], "approved")
+    request = request_row(store, request_id)
+    assert request["matched_quantity"] == 4
+    assert len(engine) == 0
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import notifications
+from notifications import DeliveryError, NotificationWorker, StaticDirectory
+
+USER = {"id": "U1", "role": "recipient", "phone": "919000000001", "email": "u1@example.com"}
+
+
+class FlakySender:
+    # Fails the next len(errors) sends with the given errors, then delivers
+    def __init__(self, channel, contact_field, errors=()):
+        self.channel = channel
+        self.contact_field = contact_field
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send(self, contact, text):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((contact, text))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # Retries are due again at once
+    monkeypatch.setattr(notifications, "BACKOFF_BASE_SECONDS", 0)
+
+
+def enqueue(store):
+    with store._transaction() as conn:
+        store._enqueue(conn, "request_matched", "user:U1", {"units": 3, "drug": "Paracetamol", "request_id": 1})
+    return int(store.list_outbox()["id"].iloc[0])
+
+
+def deliver(store, *senders):
+    worker = NotificationWorker(store, StaticDirectory([USER]), senders=list(senders))
+    return asyncio.run(worker.deliver_batch())
+
+
+def status(store, outbox_id):
+    outbox = store.list_outbox()
+    return outbox.loc[outbox["id"] == outbox_id].iloc[0]
+
+
+def test_retry_resends_only_the_failed_channel(store):
+    outbox_id = enqueue(store)
+    whatsapp = FlakySender("whatsapp", "phone")
+    email = FlakySender("email", "email", errors=[DeliveryError("timed out")])
+
+    deliver(store, whatsapp, email)
+    assert status(store, outbox_id)["status"] == "queued"
+    assert {c: d["status"] for c, d in store.delivery_status(outbox_id).items()} == {
+        "whatsapp": "sent", "email": "queued"}
+
+    deliver(store, whatsapp, email)
+    assert len(whatsapp.sent) == 1
+    assert len(email.sent) == 1
+    assert status(store, outbox_id)["status"] == "sent"
+
+
+def test_row_is_sent_when_only_some_channels_fail_for_good(store):
+    outbox_id = enqueue(store)
+    whatsapp = FlakySender("whatsapp", "phone")
+    email = FlakySender("email", "email", errors=[DeliveryError("mailbox unknown", permanent=True)])
+
+    deliver(store, whatsapp, email)
+    assert status(store, outbox_id)["status"] == "sent"
+    channels = store.delivery_status(outbox_id)
+    assert channels["email"]["status"] == "failed"
+    assert "mailbox unknown" in channels["email"]["last_error"]
+
+
+def test_row_fails_only_when_every_channel_failed(store):
+    outbox_id = enqueue(store)
+    whatsapp = FlakySender("whatsapp", "phone", errors=[DeliveryError("bad number", permanent=True)])
+    email = FlakySender("email", "email", errors=[DeliveryError("timed out")] * notifications.MAX_ATTEMPTS)
+
+    for _ in range(notifications.MAX_ATTEMPTS):
+        deliver(store, whatsapp, email)
+    row = status(store, outbox_id)
+    assert row["status"] == "failed"
+    assert row["attempts"] == notifications.MAX_ATTEMPTS
+    assert {c: d["attempts"] for c, d in store.delivery_status(outbox_id).items()} == {
+        "whatsapp": 1, "email": notifications.MAX_ATTEMPTS}
+    assert deliver(store, whatsapp, email) == 0
@@ -0,0 +1,94 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from conftest import medicine
+from inventory_store import InventoryStore, ReservationError
+from page_data import inventory_mask, recipient_filters
+
+RACERS = 8
+
+
+def _race(db_path, med_id, units, barrier):
+    store = InventoryStore(db_path)
+    barrier.wait()
+    try:
+        return store.reserve(med_id, units, "U1")
+    except ReservationError:
+        return None
+
+
+def _assert_one_winner(store, med_id, outcomes):
+    winners = [outcome for outcome in outcomes if outcome is not None]
+    assert len(winners) == 1
+    med = store.get_medicines([med_id])[0]
+    assert med["available_quantity"] == 0
+    held = store._connect().execute(
+        "SELECT COALESCE(SUM(quantity), 0) FROM reservations WHERE medicine_id = ? AND status = 'held'", (med_id,)
+    ).fetchone()[0]
+    assert held == 3
+
+
+def test_threads_racing_for_the_last_units(store, db_path):
+    med_id, = store.insert_many([medicine(status="approved", quantity=3)])
+    barrier, outcomes = threading.Barrier(RACERS), []
+    threads = [threading.Thread(target=lambda: outcomes.append(_race(db_path, med_id, 3, barrier)))
+               for _ in range(RACERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(outcomes) == RACERS
+    _assert_one_winner(store, med_id, outcomes)
+
+
+def _race_in_child(db_path, med_id, barrier, queue):
+    queue.put(_race(db_path, med_id, 3, barrier))
+
+
+def test_processes_racing_for_the_last_units(store, db_path):
+    med_id, = store.insert_many([medicine(status="approved", quantity=3)])
+    context = multiprocessing.get_context("fork")
+    barrier, queue = context.Barrier(RACERS), context.Queue()
+    workers = [context.Process(target=_race_in_child, args=(db_path, med_id, barrier, queue)) for _ in range(RACERS)]
+    for worker in workers:
+        worker.start()
+    outcomes = [queue.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+    _assert_one_winner(store, med_id, outcomes)
+
+
+def test_partial_claims_never_drive_availability_negative(store, db_path):
+    med_id, = store.insert_many([medicine(status="approved", quantity=5)])
+    barrier, outcomes = threading.Barrier(RACERS), []
+    threads = [threading.Thread(target=lambda: outcomes.append(_race(db_path, med_id, 2, barrier)))
+               for _ in range(RACERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(outcome is not None for outcome in outcomes) == 2
+    assert store.get_medicines([med_id])[0]["available_quantity"] == 1
+
+
+def test_promised_units_are_neither_listed_nor_reservable(store):
+    med_id, = store.insert_many([medicine(status="approved", quantity=5)])
+    request_id = store.create_request({"recipient_id": "U1", "recipient": "Recipient", "drug": "Paracetamol 500mg",
+                                       "quantity": 4})
+    assert store.allocate_request(request_id, [med_id]) == [(med_id, 4)]
+    med = store.get_medicines([med_id])[0]
+    assert med["available_quantity"] - med["promised_quantity"] == 1
+
+    with pytest.raises(ReservationError, match="Only 1 units"):
+        store.reserve(med_id, 2, "U2")
+    store.reserve(med_id, 1, "U2")
+    # Nothing left that another recipient could reserve: the listing drops it, in SQL and in memory
+    filters = recipient_filters()
+    assert store.count_medicines(**filters) == 0
+    assert not inventory_mask(store.list_medicines(), filters).any()
+
+    # The request still reserves the units promised to it
+    store.reserve(med_id, 4, "U1", request_id=request_id)
+    assert store.get_medicines([med_id])[0]["promised_quantity"] == 0
@@ -0,0 +1,45 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import medicine
+from schema import SchemaError, validate_medicine, validate_medicines
+
+VALID = [
+    medicine(),
+    medicine(quantity="12", value=3.0, expiry=datetime.date(2031, 5, 2), added_date=pd.Timestamp("2026-02-03")),
+    medicine(quantity=np.int64(4), value=np.int32(0), prescription=True, status="approved"),
+    medicine(id=42, available_quantity=3, description=None, image=None),
+    {k: v for k, v in medicine().items() if k not in ("description", "image", "value", "status", "prescription")},
+]
+INVALID = [
+    medicine(name=" "),
+    medicine(quantity=0),
+    medicine(quantity=2.5),
+    medicine(quantity=3_000_000_000),
+    medicine(value=-1),
+    medicine(expiry="not a date"),
+    medicine(status="lost"),
+    medicine(category="Sweets"),
+    medicine(location="Mars"),
+    medicine(available_quantity=11),
+    medicine(quantity=0, available_quantity=5),
+    medicine(id=-3),
+    {k: v for k, v in medicine().items() if k != "donor"},
+]
+
+
+@pytest.mark.parametrize("row", VALID)
+def test_single_row_path_matches_frame_path(row):
+    assert validate_medicine(row) == validate_medicines([row])[0]
+
+
+@pytest.mark.parametrize("row", INVALID)
+def test_single_row_path_rejects_what_frame_path_rejects(row):
+    with pytest.raises(SchemaError) as frame_error:
+        validate_medicines([row])
+    with pytest.raises(SchemaError) as row_error:
+        validate_medicine(row)
+    assert str(row_error.value) == str(frame_error.value)
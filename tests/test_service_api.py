@@ -0,0 +1,83 @@
+import threading
+import urllib.request
+
+import pytest
+
+from conftest import medicine
+from inventory_service import FindQuery, create_service
+from service_api import ServiceClient, make_server
+
+REQUEST = {"recipient_id": "R1", "recipient": "Recipient 1", "contact": "919000000009", "drug": "Paracetamol 500mg",
+           "category": "Pain Relief", "location": "Hostel A", "quantity": 4, "urgency": "urgent"}
+
+
+@pytest.fixture
+def api(store):
+    # Two near-identical photos, a request matched against them and a reservation
+    ids = store.insert_many([
+        medicine(image="img:aa:00000000000000ff"),
+        medicine(name="Paracetamol 650mg", image="img:bb:00000000000000fe"),
+        medicine(name="Cetirizine", category="Other", donor="Donor 2", donor_id="S00002"),
+    ])
+    service = create_service(store)
+    service.update_statuses(ids, "approved", actor="admin")
+    service.create_request(REQUEST)
+    service.reserve(ids[2], 2, "R2", recipient="Recipient 2")
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield service, ServiceClient(f"http://127.0.0.1:{server.server_address[1]}"), ids
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("name, args", [
+    ("find_medicines", (FindQuery(search="paracetamol"),)),
+    ("list_medicines", ()),
+    ("medicine_ids", ()),
+    ("medicine_rows", (["name", "quantity", "expiry"],)),
+    ("options", ("category",)),
+    ("donor_summary", ("S00001",)),
+    ("list_requests", ()),
+    ("list_reservations", ()),
+    ("audit_log", ()),
+    ("outbox", ()),
+])
+def test_collections_round_trip(api, name, args):
+    service, client, _ = api
+    result = getattr(client, name)(*args)
+    assert result == getattr(service, name)(*args)
+
+
+def test_batches_round_trip(api):
+    service, client, ids = api
+    assert client.get_medicines(ids) == service.get_medicines(ids)
+    duplicates = client.near_duplicates(ids)
+    assert duplicates == service.near_duplicates(ids)
+    assert [(d.medicine_id, d.id) for d in duplicates] == [(ids[1], ids[0])]
+
+
+def test_counter_drift_round_trips(api, store):
+    service, client, _ = api
+    with store._transaction() as conn:
+        conn.execute("UPDATE medicine_counters SET count = count + 5 WHERE kind = 'status' AND key = 'approved'")
+    drift = client.check_counters()
+    assert drift == service.check_counters() == {"status": {"approved": (8, 3)}}
+
+
+def test_writes_round_trip(api):
+    service, client, _ = api
+    new_ids = client.submit_donations([medicine(name="Ibuprofen"), medicine(name="ORS", category="Vitamins")])
+    assert len(new_ids) == 2
+    assert client.update_statuses(new_ids, "approved", actor="admin") == new_ids
+    assert [m.name for m in client.get_medicines(new_ids)] == ["Ibuprofen", "ORS"]
+    assert client.sweep_expired() == service.sweep_expired() == []
+
+
+def test_export_is_served_as_csv(api):
+    service, client, _ = api
+    with urllib.request.urlopen(f"{client.base_url}/v1/medicines/export?columns=id,name") as response:
+        assert response.headers.get_content_type() == "text/csv"
+        body = response.read().decode()
+    assert body == client.export_medicines_csv(columns=["id", "name"]) == service.export_medicines_csv(["id", "name"])
+    assert body.splitlines()[0] == "id,name"